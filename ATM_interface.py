@@ -1,21 +1,34 @@
 import tkinter as tk
 from tkinter import messagebox, simpledialog
 
+import instrumentation
+from atm_engine import ATMSession, parse_amount
+from atm_ledger import Ledger
+from metrics_view import bind_debug_key
+from task_runner import TaskRunner
+
 class ATM:
-    def __init__(self, root):
-        # Initialize user details
-        self.user_pin = "1234"
-        self.user_balance = 500.00
+    def __init__(self, root, ledger, dispenser=None):
+        # Accounts live in the persistent ledger; the session tracks who is signed in
+        self.ledger = ledger
+        self.session = ATMSession(ledger, dispenser)
 
         # Configure the root window
         self.root = root
         self.root.title("ATM System")
-        self.root.geometry("400x300")
+        self.root.geometry("400x360")
 
         # Welcome label
         self.welcome_label = tk.Label(self.root, text="Welcome to the ATM", font=("Helvetica", 16))
         self.welcome_label.pack(pady=20)
 
+        # Account number entry section
+        self.account_label = tk.Label(self.root, text="Account Number:", font=("Helvetica", 12))
+        self.account_label.pack(pady=5)
+
+        self.account_entry = tk.Entry(self.root, font=("Helvetica", 12), width=20, justify="center")
+        self.account_entry.pack(pady=5)
+
         # PIN entry section
         self.pin_label = tk.Label(self.root, text="Enter PIN:", font=("Helvetica", 12))
         self.pin_label.pack(pady=5)
@@ -41,68 +54,112 @@ class ATM:
         self.exit_button = tk.Button(self.menu_frame, text="Exit", font=("Helvetica", 12), command=self.exit_atm)
         self.exit_button.pack(pady=5)
 
+        # Status line and single worker so account operations run in order, off the Tk thread
+        self.status_var = tk.StringVar(self.root)
+        self.status_label = tk.Label(self.root, textvariable=self.status_var, font=("Helvetica", 10))
+        self.status_label.pack(side="bottom", pady=5)
+        self.runner = TaskRunner(self.root, workers=1, status_var=self.status_var)
+        self.root.bind("<Escape>", lambda event: self.runner.cancel_all())
+        bind_debug_key(self.root)  # F12 opens the performance panel
+
     # Verify PIN
+    @instrumentation.timed("ui.atm.verify_pin")
     def verify_pin(self):
+        account_number = self.account_entry.get()
         entered_pin = self.pin_entry.get()
-        if entered_pin == self.user_pin:
-            messagebox.showinfo("Access Granted", "PIN verified successfully!")
+        self.runner.submit(self.session.sign_in, account_number, entered_pin,
+                           on_done=self.pin_checked, on_error=self.show_error, message="Verifying PIN...")
+
+    # Report the PIN check result
+    def pin_checked(self, signed_in):
+        if signed_in:
+            self.alert(messagebox.showinfo, "Access Granted", "PIN verified successfully!")
             self.show_menu()
         else:
-            messagebox.showerror("Access Denied", "Incorrect PIN. Please try again.")
+            self.alert(messagebox.showerror, "Access Denied", "Incorrect PIN. Please try again.")
 
     # Show menu
+    @instrumentation.timed("ui.atm.show_menu")
     def show_menu(self):
         self.welcome_label.config(text="Main Menu")
+        self.account_label.pack_forget()
+        self.account_entry.pack_forget()
         self.pin_label.pack_forget()
         self.pin_entry.pack_forget()
         self.submit_button.pack_forget()
         self.menu_frame.pack(pady=10)
 
     # Check balance
+    @instrumentation.timed("ui.atm.check_balance")
     def check_balance(self):
-        messagebox.showinfo("Balance", f"Your current balance is: ${self.user_balance:.2f}")
+        self.runner.submit(self.session.balance, on_done=self.show_balance,
+                           on_error=self.show_error, message="Fetching balance...")
+
+    # Display the balance
+    def show_balance(self, balance):
+        self.alert(messagebox.showinfo, "Balance", f"Your current balance is: ${balance:.2f}")
 
     # Deposit money
+    @instrumentation.timed("ui.atm.deposit_money")
     def deposit_money(self):
         amount = self.prompt_user("Deposit Money", "Enter the amount to deposit:")
         if amount:
             try:
-                amount = float(amount)
-                if amount > 0:
-                    self.user_balance += amount
-                    messagebox.showinfo("Success", f"${amount:.2f} deposited successfully.")
-                else:
-                    messagebox.showerror("Error", "Deposit amount must be greater than $0.")
-            except ValueError:
-                messagebox.showerror("Error", "Invalid input. Please enter a valid amount.")
+                amount = parse_amount(amount)
+            except ValueError as e:
+                self.show_error(e)
+                return
+            self.runner.submit(self.session.deposit, amount, on_done=lambda balance: self.deposit_done(amount),
+                               on_error=self.show_error, message="Depositing...")
 
     # Withdraw money
+    @instrumentation.timed("ui.atm.withdraw_money")
     def withdraw_money(self):
         amount = self.prompt_user("Withdraw Money", "Enter the amount to withdraw:")
         if amount:
             try:
-                amount = float(amount)
-                if amount > 0:
-                    if amount <= self.user_balance:
-                        self.user_balance -= amount
-                        messagebox.showinfo("Success", f"${amount:.2f} withdrawn successfully.")
-                    else:
-                        messagebox.showerror("Error", "Insufficient balance.")
-                else:
-                    messagebox.showerror("Error", "Withdrawal amount must be greater than $0.")
-            except ValueError:
-                messagebox.showerror("Error", "Invalid input. Please enter a valid amount.")
+                amount = parse_amount(amount)
+            except ValueError as e:
+                self.show_error(e)
+                return
+            self.runner.submit(self.session.withdraw, amount, on_done=lambda balance: self.withdrawal_done(amount),
+                               on_error=self.show_error, message="Withdrawing...")
+
+    def deposit_done(self, amount):
+        self.alert(messagebox.showinfo, "Success", f"${amount:.2f} deposited successfully.")
+
+    def withdrawal_done(self, amount):
+        notes = ", ".join(f"{count} x ${d}" for d, count in self.session.last_notes.items())
+        self.alert(messagebox.showinfo, "Success",
+                   f"${amount:.2f} withdrawn successfully." + (f"\nPlease take your notes: {notes}" if notes else ""))
+
+    # Show an error raised by a worker
+    def show_error(self, error):
+        self.alert(messagebox.showerror, "Error", str(error))
+
+    # Show a dialog; the time it stays open is left out of the ATM's timings
+    def alert(self, show, title, message):
+        with instrumentation.untimed():
+            show(title, message)
 
     # Prompt user for input
     def prompt_user(self, title, message):
-        return simpledialog.askstring(title, message)
+        with instrumentation.untimed():
+            return simpledialog.askstring(title, message)
 
     # Exit the ATM
     def exit_atm(self):
+        self.session.sign_out()
+        self.runner.shutdown()
+        self.ledger.close()
         self.root.destroy()
 
 # Main program
 if __name__ == "__main__":
+    ledger = Ledger()
+    # Seed the demo account the first time the ledger is created
+    if not ledger.account_exists("1000"):
+        ledger.create_account("1000", "1234", 500.00)
     root = tk.Tk()
-    atm = ATM(root)
+    atm = ATM(root, ledger, ledger.dispenser())  # Cassette counts carry over from the last run
     root.mainloop()
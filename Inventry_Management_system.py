@@ -1,115 +1,27 @@
-import sqlite3
-import bcrypt
+import barcodes
+import instrumentation
+from inventory_auth import authenticate as open_session, sessions
+from inventory_data import setup_database, register, add_product, delete_product, get_versioned_product, ConflictError
+from inventory_data import update_product as edit_product
+from inventory_db import LOCAL_TERMINAL
+from metrics_view import bind_debug_key
+from product_table import FeedWatcher, ProductTable, SearchBar
+from scan_view import ScanWindow
+from task_runner import TaskRunner
 from tkinter import *
 from tkinter import messagebox, ttk
 
 
-# Setup the SQLite database and tables
-def setup_database():
-    # Connect to SQLite database
-    with sqlite3.connect('inventory.db') as conn:
-        cursor = conn.cursor()
-        
-        # Create the Users table if it doesn't exist
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Users (
-            id INTEGER PRIMARY KEY,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL
-        )
-        """)
-        
-        # Create the Products table if it doesn't exist
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Products (
-            id INTEGER PRIMARY KEY, 
-            name TEXT UNIQUE NOT NULL,  
-            category TEXT,  
-            price REAL NOT NULL,  
-            quantity INTEGER NOT NULL,  
-            low_stock_threshold INTEGER DEFAULT 10  
-        )
-        """)
-        
-        # Add a default admin user if not already present
-        try:
-            password_hash = bcrypt.hashpw("admin123".encode('utf-8'), bcrypt.gensalt())
-            cursor.execute("INSERT INTO Users (username, password_hash) VALUES (?, ?)", ("M.Ishfaq", password_hash))
-        except sqlite3.IntegrityError:
-            pass  # Skip if the user already exists
-
-
-# Initialize the database
-setup_database()
-
-
-# Function to handle user login
-def login(username, password):
-    with sqlite3.connect('inventory.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT password_hash FROM Users WHERE username = ?", (username,))
-        user = cursor.fetchone()
-        # Check if the user exists and the password matches
-        return user and bcrypt.checkpw(password.encode('utf-8'), user[0])
-
-
-# Function to handle user registration
-def register(username, password):
-    with sqlite3.connect('inventory.db') as conn:
-        cursor = conn.cursor()
-        try:
-            # Hash the password and insert a new user
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-            cursor.execute("INSERT INTO Users (username, password_hash) VALUES (?, ?)", (username, password_hash))
-            messagebox.showinfo("Success", "User registered successfully!")
-        except sqlite3.IntegrityError:
-            messagebox.showerror("Error", "Username already exists!")
-
-
-# Function to add a product
-def add_product(name, category, price, quantity, threshold):
-    with sqlite3.connect('inventory.db') as conn:
-        cursor = conn.cursor()
-        try:
-            # Insert a new product into the Products table
-            cursor.execute("""
-            INSERT INTO Products (name, category, price, quantity, low_stock_threshold)
-            VALUES (?, ?, ?, ?, ?)
-            """, (name, category, price, quantity, threshold))
-            messagebox.showinfo("Success", "Product added successfully!")
-        except sqlite3.IntegrityError:
-            messagebox.showerror("Error", "Product name already exists!")
-
-
-# Function to edit a product
-def edit_product(product_id, name, category, price, quantity, threshold):
-    with sqlite3.connect('inventory.db') as conn:
-        cursor = conn.cursor()
-        # Update the product details
-        cursor.execute("""
-        UPDATE Products
-        SET name = ?, category = ?, price = ?, quantity = ?, low_stock_threshold = ?
-        WHERE id = ?
-        """, (name, category, price, quantity, threshold, product_id))
-        messagebox.showinfo("Success", "Product updated successfully!")
-
-
-# Function to delete a product
-def delete_product(product_id):
-    with sqlite3.connect('inventory.db') as conn:
-        cursor = conn.cursor()
-        # Delete the product by ID
-        cursor.execute("DELETE FROM Products WHERE id = ?", (product_id,))
-        messagebox.showinfo("Success", "Product deleted successfully!")
-
-
-# Function to fetch all products
-def get_products():
-    with sqlite3.connect('inventory.db') as conn:
-        cursor = conn.cursor()
-        # Retrieve all products
-        cursor.execute("SELECT * FROM Products")
-        return cursor.fetchall()
+# Show the message returned by a background task
+def show_success(message):
+    with instrumentation.untimed():  # Time spent reading the dialog is not the app's
+        messagebox.showinfo("Success", message)
+
+
+# Show the error raised by a background task
+def show_error(error):
+    with instrumentation.untimed():
+        messagebox.showerror("Error", str(error))
 
 
 # Main GUI function
@@ -118,47 +30,118 @@ def main_gui():
     def show_frame(frame):
         frame.tkraise()
 
-    # Authenticate user
+    # Authenticate user and keep the session token for logout
+    @instrumentation.timed("ui.authenticate")
     def authenticate():
-        if login(username_var.get(), password_var.get()):
-            show_frame(dashboard_frame)
-            refresh_table()
-        else:
-            messagebox.showerror("Error", "Invalid username or password!")
+        username = username_var.get()
+
+        def done(token):
+            if token:
+                session["token"] = token
+                session["username"] = username
+                show_frame(dashboard_frame)
+                refresh_table()
+                watcher.start()
+                if not barcodes.index.complete:
+                    runner.submit(barcodes.index.warm, message="Loading SKUs...")
+            else:
+                show_error("Invalid username or password!")
+
+        runner.submit(open_session, username, password_var.get(), LOCAL_TERMINAL,
+                      on_done=done, on_error=show_error, message="Signing in...")
+
+    # End the session and go back to the login frame
+    @instrumentation.timed("ui.logout")
+    def logout():
+        token = session.pop("token", None)
+        session.pop("username", None)
+        password_var.set("")
+        show_frame(login_frame)
+        watcher.stop()
+        if token:
+            runner.submit(sessions.revoke, token, on_error=show_error, message="Signing out...")
 
     # Register a new user
+    @instrumentation.timed("ui.submit_registration")
     def submit_registration():
-        register(reg_username_var.get(), reg_password_var.get())
-        show_frame(login_frame)
+        def done(result):
+            show_success("User registered successfully!")
+            show_frame(login_frame)
+
+        runner.submit(register, reg_username_var.get(), reg_password_var.get(),
+                      on_done=done, on_error=show_error, message="Registering...")
+
+    # Callback that applies a finished product change to the table and confirms it
+    def product_changed(message):
+        def done(result):
+            table.sync()
+            show_success(message)
+        return done
 
     # Refresh the product table
+    @instrumentation.timed("ui.refresh_table")
     def refresh_table():
-        tree.delete(*tree.get_children())  # Clear the table
-        for product in get_products():  # Populate with updated product list
-            tree.insert('', 'end', values=product)
+        table.refresh()  # Reload the visible page of products
 
     # Submit a new product
+    @instrumentation.timed("ui.submit_product")
     def submit_product():
-        add_product(name_var.get(), category_var.get(), float(price_var.get()),
-                    int(quantity_var.get()), int(threshold_var.get()))
-        refresh_table()
-
-    # Update an existing product
+        runner.submit(add_product, name_var.get(), category_var.get(), float(price_var.get()),
+                      int(quantity_var.get()), int(threshold_var.get()), session.get("username"),
+                      on_done=product_changed("Product added successfully!"), on_error=show_error,
+                      message="Adding product...")
+
+    # Fill the form with the selected product as it is now, remembering its version
+    @instrumentation.timed("ui.load_selected")
+    def load_selected(event=None):
+        selected_item = tree.focus()
+        if not selected_item:
+            return
+
+        def fill_form(product):
+            if product is None:
+                return
+            (product_id, name, category, price, quantity, threshold), version = product
+            editing.update(id=str(product_id), version=version)
+            for var, value in zip((name_var, category_var, price_var, quantity_var, threshold_var),
+                                  (name, category or "", price, quantity, threshold)):
+                var.set(value)
+
+        runner.submit(get_versioned_product, tree.item(selected_item, 'values')[0],
+                      on_done=fill_form, on_error=show_error, message="Loading product...")
+
+    # Save failed; after a conflict show the other change before the user retries
+    def update_failed(error):
+        show_error(error)
+        if isinstance(error, ConflictError):
+            table.sync()
+            load_selected()
+
+    # Update an existing product; only succeeds if nobody changed it since it was loaded
+    @instrumentation.timed("ui.update_product")
     def update_product():
         selected_item = tree.focus()
         if selected_item:
             product = tree.item(selected_item, 'values')
-            edit_product(product[0], name_var.get(), category_var.get(), float(price_var.get()),
-                         int(quantity_var.get()), int(threshold_var.get()))
-            refresh_table()
+            version = editing.get("version") if editing.get("id") == str(product[0]) else None
+
+            def done(result):
+                product_changed("Product updated successfully!")(result)
+                load_selected()  # Pick up the new version for the next edit
+
+            runner.submit(edit_product, product[0], name_var.get(), category_var.get(), float(price_var.get()),
+                          int(quantity_var.get()), int(threshold_var.get()), version,
+                          on_done=done, on_error=update_failed, message="Saving product...")
 
     # Remove a selected product
+    @instrumentation.timed("ui.remove_product")
     def remove_product():
         selected_item = tree.focus()
         if selected_item:
             product = tree.item(selected_item, 'values')
-            delete_product(product[0])
-            refresh_table()
+            runner.submit(delete_product, product[0],
+                          on_done=product_changed("Product deleted successfully!"), on_error=show_error,
+                          message="Deleting product...")
 
     # Setup the main Tkinter window
     root = Tk()
@@ -173,6 +156,12 @@ def main_gui():
     for frame in (login_frame, register_frame, dashboard_frame):
         frame.grid(row=0, column=0, sticky='nsew')
 
+    # Token of the signed-in session
+    session = {}
+
+    # Id and row version of the product loaded into the form
+    editing = {}
+
     # Variables for user input
     username_var, password_var = StringVar(), StringVar()
     reg_username_var, reg_password_var = StringVar(), StringVar()
@@ -203,12 +192,25 @@ def main_gui():
     Button(dashboard_frame, text="Add Product", command=submit_product).pack()
     Button(dashboard_frame, text="Edit Product", command=update_product).pack()
     Button(dashboard_frame, text="Delete Product", command=remove_product).pack()
+    Button(dashboard_frame, text="Scan Mode", command=lambda: ScanWindow(root, runner, on_change=table.sync)).pack()
+    Button(dashboard_frame, text="Logout", command=logout).pack()
+
+    # Status bar showing background work; Escape cancels it
+    status_var = StringVar()
+    Label(root, textvariable=status_var, anchor="w").grid(row=1, column=0, sticky='ew')
+    runner = TaskRunner(root, status_var=status_var)
+
+    table = ProductTable(dashboard_frame, runner)
+    tree = table.tree
+    tree.bind("<<TreeviewSelect>>", load_selected)
+    SearchBar(dashboard_frame, table).pack(fill=X)
+    table.pack(fill=BOTH, expand=True)
+
+    root.bind("<Escape>", lambda event: runner.cancel_all())
+    bind_debug_key(root)  # F12 opens the performance panel
 
-    columns = ("ID", "Name", "Category", "Price", "Quantity", "Low Stock Threshold")
-    tree = ttk.Treeview(dashboard_frame, columns=columns, show="headings")
-    for col in columns:
-        tree.heading(col, text=col)
-    tree.pack(fill=BOTH, expand=True)
+    # While signed in, changes made on other dashboards show up without a refresh
+    watcher = FeedWatcher(root, runner, table.sync)
 
     # Show login frame initially
     show_frame(login_frame)
@@ -216,4 +218,6 @@ def main_gui():
 
 
 # Run the GUI application
-main_gui()
+if __name__ == "__main__":
+    setup_database("M.Ishfaq")
+    main_gui()
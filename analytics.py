@@ -0,0 +1,232 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import inventory_db
+
+
+SECONDS_PER_DAY = 86400
+
+# Cumulative value shares that close the A and B classes
+ABC_LIMITS = (0.80, 0.95)
+ABC_LABELS = ("A", "B", "C")
+
+# Per-category totals computed by SQLite instead of NumPy
+CATEGORY_SQL = """
+SELECT IFNULL(category, ''), COUNT(*), SUM(quantity), SUM(price * quantity),
+       SUM(quantity <= low_stock_threshold)
+FROM Products GROUP BY IFNULL(category, '') ORDER BY 4 DESC
+"""
+
+
+# Products and their recent movement history as NumPy columns, one entry per product
+class Columns:
+    def __init__(self, ids, prices, quantities, thresholds, category_codes, categories,
+                 sold, net_change, sales_sq, days):
+        self.ids = ids
+        self.prices = prices
+        self.quantities = quantities
+        self.thresholds = thresholds
+        self.category_codes = category_codes
+        self.categories = categories
+        self.sold = sold              # units sold over the period
+        self.net_change = net_change  # stock change over the period
+        self.sales_sq = sales_sq      # sum of squared daily sales, for demand variability
+        self.days = days
+
+    def __len__(self):
+        return len(self.ids)
+
+
+# Product columns loaded into arrays, as (expression, dtype)
+PRODUCT_COLUMNS = (
+    ("id", np.int64),
+    ("price", np.float64),
+    ("quantity", np.int64),
+    ("IFNULL(low_stock_threshold, 0)", np.int64),
+)
+
+
+def _parse(text, dtype):
+    return np.fromstring(text, dtype=dtype, sep=",") if text else np.zeros(0, dtype=dtype)
+
+
+# Read product columns in id order. SQLite joins each column into one string that
+# NumPy parses in C, which avoids building a Python tuple per row.
+def _product_columns(conn):
+    aggregates = ", ".join(f"group_concat({expression})" for expression, _ in PRODUCT_COLUMNS)
+    row = conn.execute(f"SELECT {aggregates} FROM (SELECT * FROM Products ORDER BY id)").fetchone()
+    return [_parse(text, dtype) for text, (_, dtype) in zip(row, PRODUCT_COLUMNS)]
+
+
+# Category names and the category index of every product, read from the category index
+def _category_codes(conn, ids):
+    categories = []
+    codes = np.zeros(len(ids), dtype=np.int32)
+    groups = conn.execute("SELECT IFNULL(category, ''), group_concat(id) FROM Products GROUP BY 1 ORDER BY 1")
+    for code, (category, members) in enumerate(groups):
+        categories.append(category)
+        codes[np.searchsorted(ids, _parse(members, np.int64))] = code
+    return categories, codes
+
+
+# Position of each product id in `ids` (sorted), dropping products that no longer exist
+def _positions(ids, product_ids):
+    positions = np.searchsorted(ids, product_ids)
+    positions = np.minimum(positions, len(ids) - 1)
+    return positions, ids[positions] == product_ids
+
+
+# Load Products, plus sales over the last `days`, into columns
+def load_columns(days=90, now=None):
+    since = (now or time.time()) - days * SECONDS_PER_DAY
+    with inventory_db.connection() as conn:
+        conn.execute("BEGIN")  # one read snapshot for every column
+        ids, prices, quantities, thresholds = _product_columns(conn)
+        categories, category_codes = _category_codes(conn, ids)
+        count = len(ids)
+
+        daily = np.array(conn.execute("""
+        SELECT product_id, -SUM(delta) FROM stock_movements
+        WHERE kind = 'sale' AND created_at >= ? GROUP BY product_id, CAST(created_at / ? AS INTEGER)
+        """, (since, SECONDS_PER_DAY)).fetchall(), dtype=np.float64).reshape(-1, 2)
+        net = np.array(conn.execute("""
+        SELECT product_id, SUM(delta) FROM stock_movements WHERE created_at >= ? GROUP BY product_id
+        """, (since,)).fetchall(), dtype=np.float64).reshape(-1, 2)
+
+    sold = np.zeros(count)
+    sales_sq = np.zeros(count)
+    net_change = np.zeros(count)
+    if count:
+        positions, live = _positions(ids, daily[:, 0].astype(np.int64))
+        sold = np.bincount(positions[live], weights=daily[live, 1], minlength=count)
+        sales_sq = np.bincount(positions[live], weights=daily[live, 1] ** 2, minlength=count)
+        positions, live = _positions(ids, net[:, 0].astype(np.int64))
+        net_change = np.bincount(positions[live], weights=net[live, 1], minlength=count)
+    return Columns(ids, prices, quantities, thresholds, category_codes, categories,
+                   sold, net_change, sales_sq, days)
+
+
+# Stock value (price x quantity) of every product
+def valuation(columns):
+    return columns.prices * columns.quantities
+
+
+# Per-category (category, products, units, value, low stock count), largest value first
+def category_summary(columns=None, push_down=False):
+    if push_down or columns is None:
+        with inventory_db.connection() as conn:
+            return conn.execute(CATEGORY_SQL).fetchall()
+
+    size = len(columns.categories)
+    codes = columns.category_codes
+    products = np.bincount(codes, minlength=size)
+    units = np.bincount(codes, weights=columns.quantities, minlength=size)
+    value = np.bincount(codes, weights=valuation(columns), minlength=size)
+    low = np.bincount(codes, weights=columns.quantities <= columns.thresholds, minlength=size)
+    order = np.argsort(-value, kind="stable")
+    return [(columns.categories[i], int(products[i]), int(units[i]), float(value[i]), int(low[i]))
+            for i in order]
+
+
+# ABC class (0 = A, 1 = B, 2 = C) of each product by its share of total `weights`
+def abc_classes(weights, limits=ABC_LIMITS):
+    order = np.argsort(-weights, kind="stable")
+    total = weights.sum()
+    if total <= 0:
+        return np.full(len(weights), 2, dtype=np.int8)
+    # Share of value held by the products ranked above each one
+    shares = (np.cumsum(weights[order]) - weights[order]) / total
+    classes = np.empty(len(weights), dtype=np.int8)
+    classes[order] = np.searchsorted(np.asarray(limits), shares, side="right")
+    return classes
+
+
+# Average units sold per day, and its standard deviation, over the loaded period
+def daily_demand(columns):
+    mean = columns.sold / columns.days
+    variance = np.maximum(columns.sales_sq / columns.days - mean ** 2, 0)
+    return mean, np.sqrt(variance)
+
+
+# Stock level at which to reorder: demand over the lead time plus safety stock
+def reorder_points(columns, lead_time_days=7, service_z=1.65):
+    mean, std = daily_demand(columns)
+    return np.ceil(mean * lead_time_days + service_z * std * np.sqrt(lead_time_days)).astype(np.int64)
+
+
+# Annualised stock turnover: units sold over the average stock held during the period
+def turnover(columns):
+    start = columns.quantities - columns.net_change
+    average = (start + columns.quantities) / 2
+    rate = np.divide(columns.sold, average, out=np.zeros(len(columns)), where=average > 0)
+    return rate * (365 / columns.days)
+
+
+# Everything shown on the Reports tab
+def build_report(days=90, lead_time_days=7, push_down=False, reorder_limit=200):
+    columns = load_columns(days)
+    values = valuation(columns)
+    consumption = columns.sold * columns.prices
+    # Classify by sales value when there is sales history, otherwise by stock value
+    weights = consumption if consumption.any() else values
+    classes = abc_classes(weights)
+
+    points = reorder_points(columns, lead_time_days)
+    mean, _ = daily_demand(columns)
+    due = np.flatnonzero((columns.quantities <= points) & (mean > 0))
+    due = due[np.argsort(columns.quantities[due] - points[due], kind="stable")][:reorder_limit]
+    rates = turnover(columns)
+
+    return {
+        "products": len(columns),
+        "units": int(columns.quantities.sum()),
+        "value": float(values.sum()),
+        "turnover": float(np.average(rates, weights=values)) if values.sum() > 0 else 0.0,
+        "categories": category_summary(columns, push_down),
+        "abc_basis": "sales value" if weights is consumption else "stock value",
+        "abc": [(ABC_LABELS[c], int((classes == c).sum()), float(weights[classes == c].sum()))
+                for c in range(len(ABC_LABELS))],
+        "reorder": [(int(columns.ids[i]), int(columns.quantities[i]), int(points[i]),
+                     float(mean[i]), float(rates[i])) for i in due],
+    }
+
+
+def print_report(report):
+    print(f"{report['products']} products, {report['units']} units, stock value {report['value']:.2f}, "
+          f"turnover {report['turnover']:.2f}/yr")
+    print(f"\n{'Category':<24}{'Products':>10}{'Units':>12}{'Value':>16}{'Low':>8}")
+    for category, products, units, value, low in report["categories"]:
+        print(f"{category or '(none)':<24}{products:>10}{units:>12}{value:>16.2f}{low:>8}")
+    print(f"\nABC classes by {report['abc_basis']}")
+    for label, count, value in report["abc"]:
+        print(f"{label}: {count:>10} products {value:>16.2f}")
+    print(f"\n{len(report['reorder'])} products at or below their reorder point")
+    for product_id, quantity, point, demand, rate in report["reorder"][:20]:
+        print(f"  #{product_id}: {quantity} in stock, reorder at {point} ({demand:.1f}/day)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stock valuation, category rollups, ABC classes and reorder points")
+    parser.add_argument("--db", help="database file (defaults to INVENTORY_DB or inventory.db)")
+    parser.add_argument("--days", type=int, default=90, help="sales history to analyse")
+    parser.add_argument("--lead-time", type=int, default=7, help="supplier lead time in days")
+    parser.add_argument("--push-down", action="store_true", help="compute category totals in SQLite")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        inventory_db.configure(path=args.db)
+    inventory_db.setup_schema()
+
+    start = time.perf_counter()
+    report = build_report(args.days, args.lead_time, args.push_down)
+    elapsed = time.perf_counter() - start
+    print_report(report)
+    print(f"\nreport built in {elapsed:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import math
+
+from cash_dispenser import CashUnavailable
+
+
+# Raised when a terminal is asked to move money before anyone has signed in
+class NotSignedIn(ValueError):
+    pass
+
+
+# Parse an amount typed at a terminal; raises ValueError with the message the terminal shows
+def parse_amount(text):
+    try:
+        amount = float(text)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid input. Please enter a valid amount.")
+    if not math.isfinite(amount):
+        raise ValueError("Invalid input. Please enter a valid amount.")
+    return amount
+
+
+# One ATM terminal without a screen: who is signed in and what they can do.
+# Every method blocks on the ledger, so callers with a UI or an event loop run
+# them on a worker thread. Terminals sharing a Ledger (or its database file)
+# are safe to drive concurrently; balance changes are serialised by the ledger.
+# With a cash_dispenser.Dispenser, withdrawals are also limited to what the
+# terminal's cassettes can pay out, and the notes are taken out of the
+# terminal's stored cassette counts together with the debit.
+class ATMSession:
+    def __init__(self, ledger, dispenser=None, terminal=None):
+        self.ledger = ledger
+        self.dispenser = dispenser
+        self.terminal = terminal
+        self.account_id = None
+        self.last_notes = {}  # notes paid out by the last withdrawal, {denomination: count}
+
+    @property
+    def signed_in(self):
+        return self.account_id is not None
+
+    # Check an account number and PIN; returns True and signs in if they match.
+    # A mismatch signs out whoever was signed in before.
+    def sign_in(self, account_number, pin):
+        account_id = self.ledger.verify_pin(str(account_number), str(pin))
+        if account_id is None:
+            self.account_id = None
+            return False
+        self.account_id = account_id
+        return True
+
+    def sign_out(self):
+        self.account_id = None
+
+    # Current balance in dollars
+    def balance(self):
+        return self.ledger.balance(self._account())
+
+    # Deposit an amount (a number or the text typed in); returns the new balance
+    def deposit(self, amount):
+        return self.ledger.deposit(self._account(), parse_amount(amount))
+
+    # Withdraw an amount; returns the new balance. Raises InsufficientFunds, or
+    # CashUnavailable before any money moves if the notes cannot be paid out.
+    def withdraw(self, amount):
+        account_id = self._account()
+        amount = parse_amount(amount)
+        if self.dispenser is None:
+            return self.ledger.withdraw(account_id, amount)
+        notes = self.dispenser.take(amount)
+        try:
+            balance = self.ledger.withdraw(account_id, amount, notes, self.terminal)
+        except CashUnavailable:
+            # The stored counts disagree with ours (refilled or emptied elsewhere); plan against them from now on
+            self.dispenser = self.ledger.dispenser(self.terminal)
+            raise
+        except BaseException:
+            self.dispenser.put_back(notes)
+            raise
+        self.last_notes = notes
+        return balance
+
+    # Most recent ledger entries, newest first
+    def history(self, limit=20):
+        return self.ledger.history(self._account(), limit)
+
+    def _account(self):
+        if self.account_id is None:
+            raise NotSignedIn("Please sign in first.")
+        return self.account_id
+
@@ -0,0 +1,212 @@
+import os
+import socket
+import time
+
+import bcrypt
+
+import instrumentation
+from cash_dispenser import DEFAULT_CASSETTES, CashUnavailable, Dispenser
+from inventory_db import ConnectionPool
+
+
+# Default ledger database, overridable with the ATM_DB environment variable
+ATM_DB_PATH = os.environ.get("ATM_DB", "atm.db")
+
+# bcrypt cost factor for new PIN hashes
+PIN_ROUNDS = int(os.environ.get("ATM_PIN_ROUNDS", "12"))
+
+# Name of this machine; each terminal keeps its own cassette counts in the ledger
+TERMINAL = os.environ.get("ATM_TERMINAL") or socket.gethostname()
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS accounts (
+        id INTEGER PRIMARY KEY,
+        account_number TEXT UNIQUE NOT NULL,
+        pin_hash BLOB NOT NULL,
+        balance_cents INTEGER NOT NULL DEFAULT 0 CHECK (balance_cents >= 0)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ledger (
+        id INTEGER PRIMARY KEY,
+        account_id INTEGER NOT NULL REFERENCES accounts(id),
+        kind TEXT NOT NULL CHECK (kind IN ('open', 'deposit', 'withdrawal')),
+        amount_cents INTEGER NOT NULL,
+        balance_cents INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_ledger_account ON ledger(account_id, id)",
+    # Notes left in each terminal's cassettes; capacity is the count at the last refill
+    """
+    CREATE TABLE IF NOT EXISTS cassettes (
+        terminal TEXT NOT NULL,
+        denomination INTEGER NOT NULL,
+        count INTEGER NOT NULL CHECK (count >= 0),
+        capacity INTEGER NOT NULL,
+        PRIMARY KEY (terminal, denomination)
+    ) WITHOUT ROWID
+    """,
+    # The ledger is append-only: history can never be rewritten
+    """
+    CREATE TRIGGER IF NOT EXISTS ledger_no_update BEFORE UPDATE ON ledger BEGIN
+        SELECT RAISE(ABORT, 'ledger is append-only');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS ledger_no_delete BEFORE DELETE ON ledger BEGIN
+        SELECT RAISE(ABORT, 'ledger is append-only');
+    END
+    """,
+)
+
+
+# Raised when a withdrawal is larger than the account balance
+class InsufficientFunds(ValueError):
+    pass
+
+
+# Convert a dollar amount to whole cents
+def to_cents(amount):
+    return int(round(float(amount) * 100))
+
+
+# Persistent accounts with an append-only transaction ledger.
+# Every balance change runs inside BEGIN IMMEDIATE, so any number of threads,
+# terminals or processes can share one database file without lost updates.
+class Ledger:
+    def __init__(self, path=None, pool_size=4):
+        self.path = path or ATM_DB_PATH
+        self.pool = ConnectionPool(self.path, pool_size)
+        self.setup()
+
+    # Create the tables if they do not exist yet
+    def setup(self):
+        with self.pool.connection() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+    def close(self):
+        self.pool.close()
+
+    # Open a new account; returns its id
+    @instrumentation.timed
+    def create_account(self, account_number, pin, balance=0.0):
+        with instrumentation.span("bcrypt.hash"):
+            pin_hash = bcrypt.hashpw(pin.encode('utf-8'), bcrypt.gensalt(PIN_ROUNDS))
+        cents = to_cents(balance)
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cursor = conn.execute(
+                "INSERT INTO accounts (account_number, pin_hash, balance_cents) VALUES (?, ?, ?)",
+                (account_number, pin_hash, cents))
+            account_id = cursor.lastrowid
+            self._append(conn, account_id, "open", cents, cents)
+        return account_id
+
+    # Whether an account number is already in use
+    def account_exists(self, account_number):
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT 1 FROM accounts WHERE account_number = ?", (account_number,)).fetchone()
+        return row is not None
+
+    # Check a PIN; returns the account id, or None if the account or PIN is wrong
+    @instrumentation.timed
+    def verify_pin(self, account_number, pin):
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT id, pin_hash FROM accounts WHERE account_number = ?",
+                               (account_number,)).fetchone()
+        if not row:
+            return None
+        with instrumentation.span("bcrypt.check"):
+            return row[0] if bcrypt.checkpw(pin.encode('utf-8'), row[1]) else None
+
+    # Current balance in dollars
+    @instrumentation.timed
+    def balance(self, account_id):
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT balance_cents FROM accounts WHERE id = ?", (account_id,)).fetchone()
+        if row is None:
+            raise ValueError("Unknown account.")
+        return row[0] / 100
+
+    # Add money to an account; returns the new balance in dollars
+    @instrumentation.timed
+    def deposit(self, account_id, amount):
+        cents = to_cents(amount)
+        if cents <= 0:
+            raise ValueError("Deposit amount must be greater than $0.")
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "UPDATE accounts SET balance_cents = balance_cents + ? WHERE id = ? RETURNING balance_cents",
+                (cents, account_id)).fetchone()
+            if row is None:
+                raise ValueError("Unknown account.")
+            self._append(conn, account_id, "deposit", cents, row[0])
+        return row[0] / 100
+
+    # Take money from an account; returns the new balance in dollars. With notes,
+    # {denomination: count}, they come out of the terminal's cassettes in the same
+    # transaction, and CashUnavailable is raised if a cassette holds fewer.
+    @instrumentation.timed
+    def withdraw(self, account_id, amount, notes=None, terminal=None):
+        cents = to_cents(amount)
+        if cents <= 0:
+            raise ValueError("Withdrawal amount must be greater than $0.")
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for denomination, count in (notes or {}).items():
+                cursor = conn.execute(
+                    "UPDATE cassettes SET count = count - ? WHERE terminal = ? AND denomination = ? AND count >= ?",
+                    (count, terminal or TERMINAL, denomination, count))
+                if not cursor.rowcount:
+                    raise CashUnavailable(f"This ATM has run out of ${denomination} notes.")
+            row = conn.execute(
+                "UPDATE accounts SET balance_cents = balance_cents - ? "
+                "WHERE id = ? AND balance_cents >= ? RETURNING balance_cents",
+                (cents, account_id, cents)).fetchone()
+            if row is None:
+                if conn.execute("SELECT 1 FROM accounts WHERE id = ?", (account_id,)).fetchone() is None:
+                    raise ValueError("Unknown account.")
+                raise InsufficientFunds("Insufficient balance.")
+            self._append(conn, account_id, "withdrawal", -cents, row[0])
+        return row[0] / 100
+
+    # Notes in a terminal's cassettes as {denomination: (count, capacity)}; empty if never loaded
+    def cassettes(self, terminal=None):
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT denomination, count, capacity FROM cassettes WHERE terminal = ?",
+                                (terminal or TERMINAL,)).fetchall()
+        return {denomination: (count, capacity) for denomination, count, capacity in rows}
+
+    # Refill a terminal's cassettes, {denomination: count}; each count becomes that cassette's capacity
+    def load_cassettes(self, counts, terminal=None):
+        with self.pool.connection() as conn:
+            conn.executemany("INSERT OR REPLACE INTO cassettes (terminal, denomination, count, capacity) "
+                             "VALUES (?, ?, ?, ?)",
+                             [(terminal or TERMINAL, d, count, count) for d, count in counts.items()])
+
+    # A Dispenser planning against a terminal's stored cassettes, which are
+    # filled with DEFAULT_CASSETTES the first time the terminal is used
+    def dispenser(self, terminal=None):
+        cassettes = self.cassettes(terminal)
+        if not cassettes:
+            self.load_cassettes(DEFAULT_CASSETTES, terminal)
+            cassettes = self.cassettes(terminal)
+        return Dispenser({d: count for d, (count, _) in cassettes.items()},
+                         capacity={d: capacity for d, (_, capacity) in cassettes.items()})
+
+    # Most recent ledger entries for an account, newest first
+    @instrumentation.timed
+    def history(self, account_id, limit=20):
+        with self.pool.connection() as conn:
+            return conn.execute(
+                "SELECT kind, amount_cents / 100.0, balance_cents / 100.0, created_at FROM ledger "
+                "WHERE account_id = ? ORDER BY id DESC LIMIT ?", (account_id, limit)).fetchall()
+
+    def _append(self, conn, account_id, kind, amount_cents, balance_cents):
+        conn.execute(
+            "INSERT INTO ledger (account_id, kind, amount_cents, balance_cents, created_at) VALUES (?, ?, ?, ?, ?)",
+            (account_id, kind, amount_cents, balance_cents, time.time()))
@@ -0,0 +1,228 @@
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import change_log
+import inventory_db
+import product_cache
+import stock_movements
+
+
+# Seconds before the in-memory index is dropped, bounding how stale it can get
+# when other processes change SKUs; scans never act on a stale entry either way
+MAX_AGE = float(os.environ.get("INVENTORY_SKU_INDEX_TTL", "300"))
+
+# Rows fetched per round trip while warming the index
+WARM_BATCH = 50_000
+
+# A scan is one statement: the movement is only written if the product still
+# carries the scanned SKU, so a stale index entry can never move the wrong stock
+SCAN_SQL = """
+INSERT INTO stock_movements (product_id, kind, delta, created_at, location_id)
+SELECT id, ?, ?, ?, ? FROM Products WHERE id = ? AND sku = ?
+"""
+
+
+# Normalise a scanned or typed code; scanners often add whitespace
+def clean(sku):
+    sku = str(sku or "").strip()
+    if not sku:
+        raise ValueError("SKU must not be empty!")
+    return sku
+
+
+# In-memory hash index from SKU to product id. warm() loads every SKU in one
+# pass over idx_products_sku; after that lookups of indexed SKUs never touch
+# the database, and a miss costs one query on idx_products_sku, since another
+# process may have given the SKU to a product since. SKUs set through this
+# module are written through; an entry left stale by a deletion or by another
+# process is corrected the first time it is used, and the whole index is
+# dropped after max_age seconds.
+class SkuIndex:
+    def __init__(self, max_age=MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def clear(self):
+        with self._lock:
+            self._ids = {}  # sku -> product id
+            self.complete = False  # True once warm() has loaded every SKU
+            self._expires_at = time.monotonic() + self.max_age
+
+    # Load every SKU; returns how many were indexed
+    def warm(self):
+        ids = {}
+        with inventory_db.connection() as conn:
+            cursor = conn.execute("SELECT sku, id FROM Products INDEXED BY idx_products_sku WHERE sku IS NOT NULL")
+            while True:
+                rows = cursor.fetchmany(WARM_BATCH)
+                if not rows:
+                    break
+                ids.update(rows)
+        with self._lock:
+            # SKUs written while the index was loading win over what was read
+            ids.update(self._ids)
+            self._ids = ids
+            self.complete = True
+            self._expires_at = time.monotonic() + self.max_age
+        return len(ids)
+
+    # Product id carrying a SKU, or None
+    def lookup(self, sku):
+        with self._lock:
+            if time.monotonic() >= self._expires_at:
+                self._ids, self.complete = {}, False
+                self._expires_at = time.monotonic() + self.max_age
+            product_id = self._ids.get(sku)
+            if product_id is not None:
+                self.hits += 1
+                return product_id
+            self.misses += 1
+        return self.refresh(sku)
+
+    # Re-read one SKU from the database and index the result
+    def refresh(self, sku):
+        with inventory_db.connection() as conn:
+            row = conn.execute("SELECT id FROM Products WHERE sku = ?", (sku,)).fetchone()
+        with self._lock:
+            if row is None:
+                self._ids.pop(sku, None)
+                return None
+            self._ids[sku] = row[0]
+        return row[0]
+
+    # Write-through: a SKU now belongs to a product (or, with None, to nobody)
+    def put(self, sku, product_id):
+        with self._lock:
+            if product_id is None:
+                self._ids.pop(sku, None)
+            else:
+                self._ids[sku] = product_id
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self._ids), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+index = SkuIndex()
+
+
+# Give a product a SKU (or None to remove it); raises ValueError if another product has it
+def assign(product_id, sku):
+    sku = None if sku is None else clean(sku)
+    try:
+        with inventory_db.connection() as conn:
+            old = conn.execute("SELECT sku FROM Products WHERE id = ?", (product_id,)).fetchone()
+            if old is None:
+                raise ValueError("Product not found!")
+            conn.execute("UPDATE Products SET sku = ? WHERE id = ?", (sku, product_id))
+    except sqlite3.IntegrityError:
+        raise ValueError("SKU already belongs to another product!")
+    if old[0] is not None:
+        index.put(old[0], None)
+    if sku is not None:
+        index.put(sku, int(product_id))
+    change_log.record(product_id)
+
+
+# Product row for a SKU, or None. The row is read by id and SKU together, so a
+# SKU that has moved to another product never returns the old product's row.
+def find(sku):
+    sku = clean(sku)
+    product_id = index.lookup(sku)
+    if product_id is None:
+        return None
+    with inventory_db.connection() as conn:
+        row = conn.execute(f"SELECT {product_cache.PRODUCT_FIELDS} FROM Products WHERE id = ? AND sku = ?",
+                           (product_id, sku)).fetchone()
+    if row is None:
+        # Moved, removed or deleted since it was indexed; look it up afresh
+        row = find_uncached(sku)
+        index.put(sku, row[0] if row else None)
+    return row
+
+
+# Product row for a SKU straight from idx_products_sku, bypassing both caches
+def find_uncached(sku):
+    with inventory_db.connection() as conn:
+        return conn.execute(f"SELECT {product_cache.PRODUCT_FIELDS} FROM Products WHERE sku = ?",
+                            (clean(sku),)).fetchone()
+
+
+# Record one scan: a sale of `quantity` units (or, with receive=True, a receipt)
+# at a location. Returns the product id; raises ValueError for an unknown SKU
+# or when there is not enough stock.
+def scan(sku, quantity=1, receive=False, location_id=stock_movements.DEFAULT_LOCATION):
+    sku = clean(sku)
+    kind = "receipt" if receive else "sale"
+    delta = stock_movements.to_delta(kind, quantity)
+    for attempt in range(2):
+        product_id = index.lookup(sku)
+        if product_id is None:
+            raise ValueError("Unknown SKU!")
+        try:
+            with inventory_db.connection() as conn:
+                cursor = conn.execute(SCAN_SQL, (kind, delta, time.time(), location_id, product_id, sku))
+        except sqlite3.IntegrityError as e:
+            raise stock_movements.movement_error(e)
+        if cursor.rowcount:
+            break
+        # The SKU moved to another product or was removed elsewhere; look it up afresh
+        index.refresh(sku)
+    else:
+        raise ValueError("Unknown SKU!")
+    change_log.record(product_id)
+    stock_movements.maybe_snapshot(cursor.lastrowid)
+    return product_id
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Look up products by SKU / barcode and record scans")
+    parser.add_argument("--db", help="database file (defaults to INVENTORY_DB or inventory.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    find_parser = sub.add_parser("find", help="show the product with a SKU")
+    find_parser.add_argument("sku")
+    assign_parser = sub.add_parser("assign", help="give a product a SKU")
+    assign_parser.add_argument("product", type=int)
+    assign_parser.add_argument("sku")
+    scan_parser = sub.add_parser("scan", help="record a sale (or receipt) of a SKU")
+    scan_parser.add_argument("sku")
+    scan_parser.add_argument("--quantity", type=int, default=1)
+    scan_parser.add_argument("--receive", action="store_true", help="add stock instead of removing it")
+    scan_parser.add_argument("--location", type=int, default=stock_movements.DEFAULT_LOCATION)
+    args = parser.parse_args(argv)
+
+    if args.db:
+        inventory_db.configure(path=args.db)
+    inventory_db.setup_schema()
+
+    try:
+        if args.command == "find":
+            row = find_uncached(args.sku)
+            if row is None:
+                print("Unknown SKU!", file=sys.stderr)
+                return 1
+            print("\t".join(str(value) for value in row))
+        elif args.command == "assign":
+            assign(args.product, args.sku)
+        else:
+            product_id = scan(args.sku, args.quantity, args.receive, args.location)
+            print(f"product {product_id}: {product_cache.products.get(product_id)[4]} in stock")
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+import argparse
+import os
+import tempfile
+import time
+
+import analytics
+import inventory_db
+
+
+# Generate products and a day-spread history of sales inside SQLite
+def seed(products, sales, days):
+    with inventory_db.connection() as conn:
+        conn.execute("""
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+        INSERT INTO Products (name, category, price, quantity, low_stock_threshold)
+        SELECT 'product-' || i, 'category-' || (i % 100), 1 + (i * 7919) % 1000, 1000 + (i * 104729) % 5000, 10
+        FROM n
+        """, (products,))
+    now = time.time()
+    with inventory_db.connection() as conn:
+        conn.execute("""
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+        INSERT INTO stock_movements (product_id, kind, delta, created_at)
+        SELECT 1 + (i * 2654435761) % ?, 'sale', -1 - i % 3, ? - (i % ?) * 86400.0 FROM n
+        """, (sales, min(products, 50_000), now, days))
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the vectorised analytics on a large catalogue")
+    parser.add_argument("--products", type=int, default=5_000_000)
+    parser.add_argument("--sales", type=int, default=500_000)
+    parser.add_argument("--days", type=int, default=90)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        inventory_db.configure(path=os.path.join(tmp, "inventory.db"))
+        inventory_db.setup_schema()
+        _, elapsed = timed(seed, args.products, args.sales, args.days)
+        print(f"seeded {args.products} products and {args.sales} sales in {elapsed:.1f}s")
+
+        columns, load_time = timed(analytics.load_columns, args.days)
+        print(f"load columns:                  {load_time:8.2f}s")
+        numpy_rows, numpy_time = timed(analytics.category_summary, columns)
+        sql_rows, sql_time = timed(analytics.category_summary, push_down=True)
+        assert [row[:3] for row in numpy_rows] == [row[:3] for row in sql_rows], "category totals disagree"
+        print(f"category rollup, NumPy:        {numpy_time:8.2f}s")
+        print(f"category rollup, SQL push-down:{sql_time:8.2f}s")
+        _, abc_time = timed(analytics.abc_classes, analytics.valuation(columns))
+        print(f"ABC classification:            {abc_time:8.2f}s")
+        _, reorder_time = timed(analytics.reorder_points, columns)
+        print(f"reorder points:                {reorder_time:8.2f}s")
+        _, report_time = timed(analytics.build_report, args.days)
+        print(f"full report (load + compute):  {report_time:8.2f}s")
+        inventory_db.get_pool().close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import inventory_auth
+import inventory_data
+import inventory_db
+
+
+# Create `count` users sharing one password
+def seed_users(count, password):
+    for i in range(count):
+        inventory_data.register(f"user-{i}", password)
+
+
+# Run `ops` calls of func(user_index) split across `threads` workers and return calls/sec
+def run(func, ops, threads, users):
+    per_thread = ops // threads
+
+    def worker(offset):
+        for i in range(per_thread):
+            func((offset + i) % users)
+
+    workers = [threading.Thread(target=worker, args=(t * per_thread,)) for t in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare full bcrypt logins against cached session checks")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--logins", type=int, default=80, help="full password logins to time")
+    parser.add_argument("--checks", type=int, default=200_000, help="session validations to time")
+    args = parser.parse_args()
+    password = "correct horse"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        inventory_db.configure(path=os.path.join(tmp, "inventory.db"), size=args.threads)
+        inventory_db.setup_schema()
+        seed_users(args.users, password)
+        # Each user logs in many times over; this measures bcrypt, not the login limits
+        inventory_auth.throttle.enabled = False
+
+        tokens = [inventory_auth.authenticate(f"user-{i}", password) for i in range(args.users)]
+        assert all(tokens), "seeded users could not log in"
+
+        logins = run(lambda i: inventory_auth.verify_password(f"user-{i}", password),
+                     args.logins, args.threads, args.users)
+        cached = run(lambda i: inventory_auth.sessions.validate(tokens[i]), args.checks, args.threads, args.users)
+
+        # Cold checks: an empty LRU forces every lookup to SQLite
+        cold_store = inventory_auth.SessionStore(cache_size=0)
+        cold = run(lambda i: cold_store.validate(tokens[i]), args.checks // 10, args.threads, args.users)
+        inventory_db.get_pool().close()
+
+    print(f"bcrypt cost {inventory_auth.BCRYPT_ROUNDS}, {args.threads} threads, {args.users} users")
+    print(f"password login:         {logins:12.0f} logins/sec")
+    print(f"session check (SQLite): {cold:12.0f} checks/sec  ({cold / logins:.0f}x)")
+    print(f"session check (LRU):    {cached:12.0f} checks/sec  ({cached / logins:.0f}x)")
+    print(f"LRU hits {inventory_auth.sessions.hits}, misses {inventory_auth.sessions.misses}")
+
+
+if __name__ == "__main__":
+    main()
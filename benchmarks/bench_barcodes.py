@@ -0,0 +1,105 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import barcodes
+import inventory_db
+import stock_movements
+from benchmarks import synthetic
+
+
+# Give every product a 13-digit code, like an EAN-13 barcode
+def assign_skus():
+    with inventory_db.connection() as conn:
+        conn.execute("UPDATE Products SET sku = printf('40%011d', id * 7)")
+
+
+# Average microseconds per call of func(sku) over the given codes
+def per_call(func, skus):
+    start = time.perf_counter()
+    for sku in skus:
+        func(sku)
+    return (time.perf_counter() - start) / len(skus) * 1e6
+
+
+# Scan every code once, split across `threads` tills; returns scans/sec
+def run_scans(skus, threads):
+    chunks = [skus[i::threads] for i in range(threads)]
+
+    def till(chunk):
+        for sku in chunk:
+            barcodes.scan(sku)
+
+    workers = [threading.Thread(target=till, args=(chunk,)) for chunk in chunks]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return len(skus) / (time.perf_counter() - start)
+
+
+def total_stock():
+    with inventory_db.connection() as conn:
+        return conn.execute("SELECT SUM(quantity) FROM Products").fetchone()[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SKU lookups and point-of-sale scans against a large catalogue")
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=200_000)
+    parser.add_argument("--scans", type=int, default=20_000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        inventory_db.configure(path=os.path.join(tmp, "inventory.db"))
+        start = time.perf_counter()
+        synthetic.generate(args.products, user_count=10, seed=args.seed)
+        assign_skus()
+        # Plenty of stock on the products being scanned, so no scan is refused
+        hot = rng.sample(range(1, args.products + 1), min(args.products, 1000))
+        stock_movements.record_movements((product_id, "receipt", 1_000_000, time.time()) for product_id in hot)
+        print(f"{args.products} products with SKUs generated in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        indexed = barcodes.index.warm()
+        warm_seconds = time.perf_counter() - start
+        # Warm again under tracemalloc, which slows it down, to see what the index holds
+        barcodes.index.clear()
+        tracemalloc.start()
+        barcodes.index.warm()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"index warmed with {indexed} SKUs in {warm_seconds:.2f}s, {memory / 1e6:.0f} MB")
+
+        with inventory_db.connection() as conn:
+            codes = dict(conn.execute("SELECT id, sku FROM Products"))
+        lookups = [codes[rng.randint(1, args.products)] for _ in range(args.lookups)]
+        print(f"lookup via the unique index (SQL):  {per_call(barcodes.find_uncached, lookups[:20_000]):8.2f} us")
+        print(f"lookup via the in-memory index:     {per_call(barcodes.index.lookup, lookups):8.2f} us")
+        hot_codes = [codes[product_id] for product_id in hot]
+        per_call(barcodes.find, hot_codes)  # bring the hot products' pages into SQLite's cache
+        print(f"find() on a hot product:            "
+              f"{per_call(barcodes.find, [rng.choice(hot_codes) for _ in range(args.lookups)]):8.2f} us")
+
+        scans = [rng.choice(hot_codes) for _ in range(args.scans)]
+        before = total_stock()
+        print(f"scans, one till:                    {run_scans(scans, 1):8.0f} /sec")
+        print(f"scans, {args.threads} tills:                   {run_scans(scans, args.threads):8.0f} /sec")
+        sold = before - total_stock()
+        mismatches = stock_movements.verify()
+        print(f"units sold: {sold} of {2 * len(scans)} scanned, movement log mismatches: {len(mismatches)}")
+        inventory_db.get_pool().close()
+    return 0 if sold == 2 * len(scans) and not mismatches else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import bulk_edit
+import inventory_data
+import inventory_db
+import locations
+import stock_movements
+from benchmarks import synthetic
+
+
+# Seconds taken by func(), and what it returned
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def report(label, seconds, count):
+    rate = count / seconds if seconds else 0
+    print(f"{label:<44} {count:>9} products {seconds * 1000:>10.0f} ms  {rate:>12,.0f}/s")
+
+
+# Size of the undo record kept for the latest operation
+def undo_bytes():
+    with inventory_db.connection() as conn:
+        row = conn.execute("SELECT LENGTH(data) FROM bulk_operations WHERE data IS NOT NULL "
+                           "ORDER BY id DESC LIMIT 1").fetchone()
+    return row[0] if row else 0
+
+
+def prices():
+    with inventory_db.connection() as conn:
+        return conn.execute("SELECT id, price FROM Products ORDER BY id").fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Set-based bulk price and stock edits, and undoing them")
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--per-row", type=int, default=2000, help="products edited one call at a time, to compare")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        inventory_db.configure(path=os.path.join(tmp, "bulk.db"))
+        seconds, _ = timed(synthetic.generate, args.products, seed=args.seed)
+        print(f"generated {args.products} products in {seconds:.1f}s")
+        with inventory_db.connection() as conn:
+            category = conn.execute("SELECT category FROM Products GROUP BY category "
+                                    "ORDER BY COUNT(*) DESC LIMIT 1").fetchone()[0]
+        before = prices()
+
+        # The same change made one product at a time, as the edit dialog would
+        sample = before[:args.per_row]
+        start = time.perf_counter()
+        for product_id, price in sample:
+            (_, name, product_category, _, quantity, threshold), version = \
+                inventory_data.get_versioned_product(product_id)
+            inventory_data.update_product(product_id, name, product_category, round(price * 1.1, 2), quantity,
+                                          threshold, version)
+        per_row = (time.perf_counter() - start) / len(sample)
+        print(f"{'per-row update_product':<44} {len(sample):>9} products {per_row * len(sample) * 1000:>10.0f} ms"
+              f"  {1 / per_row:>12,.0f}/s  (~{per_row * args.products:.0f}s for all {args.products})")
+        with inventory_db.connection() as conn:
+            conn.executemany("UPDATE Products SET price = ? WHERE id = ?", [(p, i) for i, p in sample])
+            conn.commit()
+
+        seconds, count = timed(bulk_edit.reprice, percent=10, category=category)
+        report(f"reprice +10% in {category}", seconds, count)
+        seconds, (count, _) = timed(bulk_edit.undo)
+        report("  undo", seconds, count)
+
+        seconds, count = timed(bulk_edit.reprice, percent=10)
+        report("reprice +10%, every product", seconds, count)
+        print(f"  undo record: {undo_bytes() / 1e6:.1f} MB ({undo_bytes() / count:.1f} bytes/product)")
+        seconds, (count, _) = timed(bulk_edit.undo)
+        report("  undo", seconds, count)
+        restored = prices() == before
+
+        seconds, count = timed(bulk_edit.reprice, amount=-0.5, low_stock_only=True)
+        report("reprice -$0.50, low stock only", seconds, count)
+        timed(bulk_edit.undo)
+
+        seconds, count = timed(bulk_edit.adjust_stock, 5, category=category)
+        report(f"stock +5 in {category}", seconds, count)
+        seconds, (count, _) = timed(bulk_edit.undo)
+        report("  undo", seconds, count)
+
+        seconds, count = timed(bulk_edit.delete_products, category=category)
+        report(f"delete {category}", seconds, count)
+        print(f"  undo record: {undo_bytes() / 1e6:.1f} MB")
+        seconds, (count, _) = timed(bulk_edit.undo)
+        report("  undo", seconds, count)
+
+        movement_errors = stock_movements.verify()
+        location_errors = locations.verify()
+        print("prices restored exactly" if restored else "prices NOT restored")
+        print(f"movement log: {len(movement_errors)} mismatches, per-location stock: {len(location_errors)}")
+
+        # The generated stock is only in the opening snapshot, so a rebuild that
+        # replayed the movements alone would throw it away
+        seconds, fixed = timed(stock_movements.rebuild_quantities)
+        movement_errors += stock_movements.verify()
+        location_errors += locations.verify()
+        print(f"rebuild from the movement log: {seconds * 1000:.0f} ms, {fixed} totals changed, "
+              f"{len(movement_errors)} mismatches after")
+    return 0 if restored and not fixed and not movement_errors and not location_errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
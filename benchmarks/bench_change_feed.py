@@ -0,0 +1,177 @@
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import change_feed
+import inventory_data
+import inventory_db
+import product_search
+from benchmarks import synthetic
+
+
+# One dashboard: poll the feed every `interval` seconds and fetch the rows it
+# names, as ProductTable.apply_changes does. Reports the time each (product,
+# version) was first seen, and how long polls took with and without changes.
+# Every tenth tick it also times reloading a page, which is what a dashboard
+# without the feed would have to do to notice other clerks' changes.
+def dashboard(number, path, interval, ack_interval, ready, start, stop, results):
+    inventory_db.configure(path=path, size=1)
+    change_feed.ACK_INTERVAL = ack_interval
+    subscriber = change_feed.Subscriber(f"dashboard-{number}")
+    subscriber.poll()
+    ready.put(number)
+    start.wait()
+    seen = {}  # product id -> [(version, first seen at)]
+    idle, busy, pages = [], [], []
+    reloads = 0
+    # Dashboards opened at different moments poll out of step with each other
+    next_poll = time.time() + random.Random(number).random() * interval
+    time.sleep(max(0.0, next_poll - time.time()))
+    while not stop.is_set():
+        began = time.perf_counter()
+        changed = subscriber.poll()
+        if changed is None:
+            reloads += 1
+        elif changed:
+            with inventory_db.connection() as conn:
+                rows = conn.execute(f"SELECT id, version FROM Products WHERE id IN ({','.join('?' * len(changed))})",
+                                    list(changed)).fetchall()
+            now = time.time()
+            for product_id, version in rows:
+                seen.setdefault(product_id, []).append((version, now))
+        (busy if changed else idle).append(time.perf_counter() - began)
+        if (len(idle) + len(busy)) % 10 == 0:
+            began = time.perf_counter()
+            product_search.search_products(limit=200)
+            pages.append(time.perf_counter() - began)
+        next_poll += interval
+        time.sleep(max(0.0, next_poll - time.time()))
+    subscriber.close()
+    inventory_db.get_pool().close()
+    results.put((number, seen, idle, busy, pages, reloads))
+
+
+# How long after each write a dashboard first saw it (or a later version);
+# None for writes it never saw
+def latencies(writes, seen):
+    delays = []
+    for product_id, version, written_at in writes:
+        first = min((at for v, at in seen.get(product_id, ()) if v >= version), default=None)
+        delays.append(None if first is None else max(0.0, first - written_at))
+    return delays
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+# Median microseconds of `runs` update_product calls
+def write_cost(product_ids, runs, rng):
+    timings = []
+    for _ in range(runs):
+        product_id = rng.choice(product_ids)
+        (_, name, category, price, quantity, threshold), version = inventory_data.get_versioned_product(product_id)
+        start = time.perf_counter()
+        inventory_data.update_product(product_id, name, category, price, quantity, threshold, version)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Propagation latency of the change feed to concurrent dashboards")
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--dashboards", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=20, help="seconds of writes")
+    parser.add_argument("--rate", type=float, default=20, help="product writes per second")
+    parser.add_argument("--interval", type=float, default=change_feed.POLL_INTERVAL, help="seconds between polls")
+    parser.add_argument("--ack-interval", type=float, default=change_feed.ACK_INTERVAL)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "feed.db")
+        inventory_db.configure(path=path)
+        synthetic.generate(args.products, seed=args.seed)
+        inventory_db.get_pool().close()
+
+        ready, results = multiprocessing.Queue(), multiprocessing.Queue()
+        start, stop = multiprocessing.Event(), multiprocessing.Event()
+        processes = [multiprocessing.Process(target=dashboard, args=(i, path, args.interval, args.ack_interval,
+                                                                     ready, start, stop, results))
+                     for i in range(args.dashboards)]
+        for process in processes:
+            process.start()
+        for _ in processes:
+            ready.get()
+
+        # One clerk writing: price edits and stock adjustments, alternately
+        inventory_db.configure(path=path)
+        writes = []
+        start.set()
+        began = time.time()
+        next_write = began
+        while time.time() - began < args.duration:
+            product_id = rng.randint(1, args.products)
+            if len(writes) % 2:
+                inventory_data.adjust_quantity(product_id, rng.randint(1, 5))
+            else:
+                (_, name, category, price, quantity, threshold), version = \
+                    inventory_data.get_versioned_product(product_id)
+                inventory_data.update_product(product_id, name, category, round(price + 0.01, 2), quantity,
+                                              threshold, version)
+            written_at = time.time()
+            with inventory_db.connection() as conn:
+                version = conn.execute("SELECT version FROM Products WHERE id = ?", (product_id,)).fetchone()[0]
+            writes.append((product_id, version, written_at))
+            next_write += 1 / args.rate
+            time.sleep(max(0.0, next_write - time.time()))
+        # Give the dashboards one more poll to catch the last writes
+        time.sleep(args.interval * 2)
+        stop.set()
+        outcomes = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        delays, idle, busy, pages = [], [], [], []
+        reloads = 0
+        for number, seen, idle_polls, busy_polls, page_loads, dashboard_reloads in outcomes:
+            delays += latencies(writes, seen)
+            idle += idle_polls
+            busy += busy_polls
+            pages += page_loads
+            reloads += dashboard_reloads
+        delivered = [delay * 1000 for delay in delays if delay is not None]
+        with inventory_db.connection() as conn:
+            held = conn.execute("SELECT COUNT(*) FROM product_changes").fetchone()[0]
+            total = conn.execute("SELECT pruned_seq FROM change_feed_state").fetchone()[0] + held
+
+        print(f"{args.dashboards} dashboards polling every {args.interval * 1000:.0f} ms, "
+              f"{len(writes)} writes at {args.rate:g}/s over {args.duration:g}s")
+        print(f"delivered {len(delivered)} of {len(delays)} (write, dashboard) pairs, {reloads} full reloads")
+        print(f"propagation latency ms: p50 {percentile(delivered, 0.5):.0f}  p95 {percentile(delivered, 0.95):.0f}  "
+              f"p99 {percentile(delivered, 0.99):.0f}  max {max(delivered):.0f}")
+        print(f"median us per poll: {statistics.median(idle) * 1e6:.0f} idle, "
+              f"{statistics.median(busy) * 1e6:.0f} with changes ({len(idle) + len(busy)} polls); "
+              f"reloading a 200-row page instead: {statistics.median(pages) * 1e6:.0f}")
+        print(f"changes recorded {total}, still held after pruning {held}")
+
+        # What the triggers add to a single product write
+        product_ids = [write[0] for write in writes]
+        with_feed = write_cost(product_ids, 500, rng)
+        with inventory_db.connection() as conn:
+            conn.execute("UPDATE change_feed_state SET muted = 1")
+        without_feed = write_cost(product_ids, 500, rng)
+        print(f"update_product us: {with_feed:.0f} with the feed, {without_feed:.0f} without")
+        inventory_db.get_pool().close()
+    return 0 if len(delivered) == len(delays) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
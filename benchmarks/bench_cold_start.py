@@ -0,0 +1,60 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# What every launch used to do: run each CREATE ... IF NOT EXISTS statement and
+# hash the admin password, only to find the account already exists
+LEGACY_STARTUP = """
+import sqlite3
+import inventory_auth, inventory_db
+with inventory_db.connection() as conn:
+    for statement in inventory_db.SCHEMA:
+        conn.execute(statement)
+    try:
+        conn.execute("INSERT INTO Users (username, password_hash) VALUES (?, ?)",
+                     ("admin", inventory_auth.hash_password("admin123")))
+    except sqlite3.IntegrityError:
+        pass
+"""
+
+# Startup as it is now: one schema version check and an admin lookup
+CURRENT_STARTUP = """
+import inventory_data
+inventory_data.setup_database("admin")
+"""
+
+
+# Median seconds for a fresh interpreter to import the data layer and run `code`
+def cold_start(code, runs, env):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], env=env, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process start-up time of the old and migration-based setup")
+    parser.add_argument("--runs", type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, INVENTORY_DB=os.path.join(tmp, "inventory.db"))
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+
+        # The first launch creates the database, seeds the admin and records the schema version
+        print(f"first launch:         {cold_start(CURRENT_STARTUP, 1, env) * 1000:8.1f} ms")
+        print(f"bare interpreter:     {cold_start('pass', args.runs, env) * 1000:8.1f} ms")
+        print(f"later launch, before: {cold_start(LEGACY_STARTUP, args.runs, env) * 1000:8.1f} ms")
+        print(f"later launch, after:  {cold_start(CURRENT_STARTUP, args.runs, env) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import inventory_db
+
+
+# Fill the Products table with rows to edit
+def seed_products(path, count):
+    with sqlite3.connect(path) as conn:
+        for statement in inventory_db.SCHEMA:
+            conn.execute(statement)
+        conn.executemany(
+            "INSERT INTO Products (name, category, price, quantity, low_stock_threshold) VALUES (?, ?, ?, ?, ?)",
+            ((f"product-{i}", "bench", 1.0, 100, 10) for i in range(count)))
+
+
+# The original pattern: open, update, commit and close for every call
+def connect_per_call(path, product_id, quantity):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("UPDATE Products SET quantity = ? WHERE id = ?", (quantity, product_id))
+    conn.commit()
+    conn.close()
+
+
+# The same edit through the shared connection pool
+def pooled(path, product_id, quantity):
+    with inventory_db.connection() as conn:
+        conn.execute("UPDATE Products SET quantity = ? WHERE id = ?", (quantity, product_id))
+
+
+# Run `ops` edits split across `threads` workers and return ops/sec
+def run(func, path, ops, threads, products):
+    per_thread = ops // threads
+
+    def worker(offset):
+        for i in range(per_thread):
+            func(path, (offset + i) % products + 1, i)
+
+    workers = [threading.Thread(target=worker, args=(t * per_thread,)) for t in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare connect-per-call against the pooled connection layer")
+    parser.add_argument("--ops", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--products", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "inventory.db")
+        seed_products(path, args.products)
+        inventory_db.configure(path=path, size=args.threads)
+        inventory_db.get_pool()._connect().close()  # switch the file to WAL once
+
+        baseline = run(connect_per_call, path, args.ops, args.threads, args.products)
+        pool = run(pooled, path, args.ops, args.threads, args.products)
+        inventory_db.get_pool().close()
+
+    print(f"connect-per-call: {baseline:10.0f} ops/sec")
+    print(f"pooled:           {pool:10.0f} ops/sec  ({pool / baseline:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
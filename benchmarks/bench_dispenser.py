@@ -0,0 +1,125 @@
+import argparse
+import itertools
+import random
+import sys
+import time
+
+from cash_dispenser import DEFAULT_CASSETTES, NOTE_COST, SCARCITY_PENALTY, CashUnavailable, Dispenser
+
+
+# Largest notes first, as many as each cassette allows; the usual planner, and
+# it fails on amounts like $60 once the $10 and $5 cassettes are empty
+def greedy(counts, amount):
+    notes = {}
+    for d in sorted(counts, reverse=True):
+        n = min(counts[d], amount // d)
+        if n:
+            notes[d] = n
+            amount -= n * d
+    return notes if amount == 0 else None
+
+
+# Cheapest plan by brute force, scored like the dispenser; for checking small amounts
+def brute_force(dispenser, amount):
+    best = None
+    denominations = dispenser.denominations
+    costs = [NOTE_COST + SCARCITY_PENALTY[dispenser._level(i)] for i in range(len(denominations))]
+    ranges = [range(min(count, amount // d) + 1) for d, count in zip(denominations[:-1], dispenser.counts)]
+    for combo in itertools.product(*ranges):
+        # The smallest note makes up the rest, if it can
+        rest = amount - sum(n * d for n, d in zip(combo, denominations))
+        if rest >= 0 and rest % denominations[-1] == 0 and rest // denominations[-1] <= dispenser.counts[-1]:
+            cost = sum(n * c for n, c in zip(combo + (rest // denominations[-1],), costs))
+            best = cost if best is None else min(best, cost)
+    return best
+
+
+def plan_cost(dispenser, notes):
+    return sum(count * (NOTE_COST + SCARCITY_PENALTY[dispenser._level(dispenser.denominations.index(d))])
+               for d, count in notes.items())
+
+
+# Whether the machine could pay out an amount right now
+def dispenser_can(dispenser, amount):
+    try:
+        dispenser.plan(amount)
+        return True
+    except CashUnavailable:
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plan cash withdrawals against the notes in the cassettes")
+    parser.add_argument("--amounts", type=int, default=2_000_000, help="random withdrawal amounts to plan")
+    parser.add_argument("--withdrawals", type=int, default=200_000, help="withdrawals paid out in the depletion run")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    rng = random.Random(args.seed)
+
+    # Withdrawals are mostly small round amounts, with a long tail up to the limit
+    def amount():
+        return min(1000, 5 * max(1, int(rng.expovariate(1 / 20))))
+
+    dispenser = Dispenser()
+    amounts = [amount() for _ in range(args.amounts)]
+    start = time.perf_counter()
+    for value in amounts:
+        dispenser.plan(value)
+    table = (time.perf_counter() - start) / len(amounts) * 1e6
+    start = time.perf_counter()
+    for value in amounts[:200]:
+        dispenser._build(dispenser._usable, dispenser._levels)
+    per_request = (time.perf_counter() - start) / 200 * 1e6
+    print(f"plan from the precomputed table:   {table:10.2f} us")
+    print(f"DP solved per request:             {per_request:10.2f} us  ({per_request / table:.0f}x slower)")
+
+    # A machine that has run out of small notes: greedy refuses amounts the DP can pay
+    low = {100: 40, 50: 3, 20: 200, 10: 0, 5: 0}
+    dispenser = Dispenser(low)
+    payable = [a for a in range(5, 1001, 5) if dispenser_can(dispenser, a)]
+    greedy_fails = [a for a in payable if greedy(low, a) is None]
+    print(f"with no $10 or $5 notes left: {len(payable)} amounts payable, "
+          f"greedy refuses {len(greedy_fails)} of them (e.g. {greedy_fails[:5]})")
+
+    # Plans must be as cheap as the best combination, whatever the cassettes hold
+    mismatches = 0
+    for counts in (None, low, {100: 2, 50: 1, 20: 30, 10: 4, 5: 60}):
+        dispenser = Dispenser(counts)
+        for value in range(5, 305, 5):
+            expected = brute_force(dispenser, value)
+            actual = plan_cost(dispenser, dispenser.plan(value)) if dispenser_can(dispenser, value) else None
+            mismatches += actual != expected
+    print(f"plans checked against brute force: {mismatches} mismatches")
+
+    # Pay out until the machine runs dry, refilling it each time
+    dispenser = Dispenser()
+    paid = refused = refills = bad = 0
+    in_a_row = 0
+    start = time.perf_counter()
+    while paid < args.withdrawals:
+        value = amount()
+        before = dispenser.remaining()
+        try:
+            notes = dispenser.take(value)
+        except CashUnavailable:
+            refused += 1
+            in_a_row += 1
+            if in_a_row == 20:
+                dispenser.load(DEFAULT_CASSETTES)
+                refills += 1
+                in_a_row = 0
+            continue
+        in_a_row = 0
+        paid += 1
+        after = dispenser.remaining()
+        bad += (sum(d * n for d, n in notes.items()) != value
+                or any(after[d] != before[d] - notes.get(d, 0) or after[d] < 0 for d in before))
+    elapsed = time.perf_counter() - start
+    print(f"{paid} withdrawals paid out, {refused} refused, {refills} refills: "
+          f"{elapsed / (paid + refused) * 1e6:.1f} us each, table rebuilt {dispenser.rebuilds} times")
+    print(f"payouts that did not add up or overdrew a cassette: {bad}")
+    return 1 if mismatches or bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
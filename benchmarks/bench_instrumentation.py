@@ -0,0 +1,71 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import instrumentation
+import inventory_data
+import inventory_db
+
+
+# Average microseconds per call of func(product_id) over `calls` calls
+def per_call(func, calls, products):
+    start = time.perf_counter()
+    for i in range(calls):
+        func(i % products + 1)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cost of instrumentation on a hot data function")
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--calls", type=int, default=200_000)
+    parser.add_argument("--out", help="also write the collected metrics here (.json or Prometheus text)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        inventory_db.configure(path=os.path.join(tmp, "inventory.db"))
+        inventory_db.setup_schema()
+        for i in range(args.products):
+            inventory_data.add_product(f"product-{i}", "bench", 1.0, 10, 5)
+
+        # Cached lookups are the cheapest data call, so they show the overhead most
+        if not instrumentation.enabled:
+            print(f"metrics off at startup:      {per_call(inventory_data.get_product, args.calls, args.products):7.2f} us/call")
+            inventory_db.get_pool().close()
+            # Decorators are only applied when metrics are on at startup, so measure that in a new process
+            env = dict(os.environ, INVENTORY_METRICS="1")
+            return subprocess.run([sys.executable, "-m", "benchmarks.bench_instrumentation"] + sys.argv[1:],
+                                  env=env).returncode
+
+        plain = inventory_data.get_product.__wrapped__
+        instrumentation.disable()
+        print(f"undecorated:                 {per_call(plain, args.calls, args.products):7.2f} us/call")
+        print(f"decorated, switched off:     {per_call(inventory_data.get_product, args.calls, args.products):7.2f} us/call")
+        instrumentation.enable()
+        instrumentation.reset()
+        print(f"decorated, collecting:       {per_call(inventory_data.get_product, args.calls, args.products):7.2f} us/call")
+
+        # Uncached reads, with every SQL statement traced and counted
+        with instrumentation.span("bench.uncached_reads"):
+            for i in range(args.products):
+                inventory_data.get_versioned_product(i + 1)
+        instrumentation.profile_next("bench.", os.path.join(tmp, "profile.prof"))
+        with instrumentation.span("bench.profiled_refresh"):
+            inventory_data.get_products()
+
+        for name, metric in instrumentation.snapshot().items():
+            print(f"{name:<40} calls {metric['count']:>7}  p50 {metric['p50'] * 1e6:8.1f} us  "
+                  f"p99 {metric['p99'] * 1e6:8.1f} us  queries {metric['queries']:>6}  rows {metric['rows']:>6}")
+        name, _, summary = instrumentation.last_profile
+        print(f"profile of {name}: {summary.strip().splitlines()[0]}")
+        if args.out:
+            print(f"metrics written to {instrumentation.dump(args.out)}")
+        inventory_db.get_pool().close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
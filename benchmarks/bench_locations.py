@@ -0,0 +1,125 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import inventory_db
+import locations
+import product_search
+import stock_movements
+from benchmarks import synthetic
+
+
+# Spread each product's stock over a few random locations. Written straight to
+# the tables, like synthetic.generate, and recorded as the starting snapshot.
+def distribute(location_ids, density, seed):
+    rng = random.Random(seed)
+    with inventory_db.connection() as conn:
+        conn.execute("PRAGMA synchronous = OFF")
+        try:
+            conn.execute("DELETE FROM product_stock")
+            products = conn.execute("SELECT id FROM Products ORDER BY id").fetchall()
+            for start in range(0, len(products), synthetic.BATCH):
+                rows = []
+                for (product_id,) in products[start:start + synthetic.BATCH]:
+                    held = max(1, int(rng.expovariate(1 / (density * len(location_ids)))))
+                    for location_id in rng.sample(location_ids, min(held, len(location_ids))):
+                        rows.append((location_id, product_id, int(rng.expovariate(1 / 40)) + 1))
+                conn.executemany("INSERT INTO product_stock (location_id, product_id, quantity) VALUES (?, ?, ?)",
+                                 rows)
+            conn.execute("""
+            UPDATE Products SET quantity = IFNULL((SELECT SUM(quantity) FROM product_stock
+                                                   WHERE product_id = Products.id), 0)
+            """)
+            conn.execute("DELETE FROM stock_snapshots")
+            stock_movements.save_snapshot(conn, 0, conn.execute(
+                "SELECT id, quantity FROM Products WHERE quantity != 0 ORDER BY id").fetchall())
+            conn.commit()
+            conn.execute("ANALYZE")
+        finally:
+            conn.execute("PRAGMA synchronous = NORMAL")
+
+
+# Median milliseconds of `runs` calls of func(i)
+def median_ms(func, runs):
+    timings = []
+    for i in range(runs):
+        start = time.perf_counter()
+        func(i)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-location stock: filtered pages, lookups and transfers")
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--locations", type=int, default=100)
+    parser.add_argument("--density", type=float, default=0.05,
+                        help="average fraction of locations holding each product")
+    parser.add_argument("--transfers", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "inventory.db")
+        inventory_db.configure(path=path)
+        start = time.perf_counter()
+        synthetic.generate(args.products, user_count=10, seed=args.seed)
+        location_ids = [stock_movements.DEFAULT_LOCATION] + [
+            locations.add_location(f"warehouse-{i}") for i in range(1, args.locations)]
+        distribute(location_ids, args.density, args.seed)
+        with inventory_db.connection() as conn:
+            rows = conn.execute("SELECT COUNT(*) FROM product_stock").fetchone()[0]
+        print(f"{args.products} products over {args.locations} locations ({rows} stock rows) "
+              f"generated in {time.perf_counter() - start:.1f}s")
+        print(f"database size: {os.path.getsize(path) / 1e6:.0f} MB")
+
+        def page(order_by, **filters):
+            return lambda i: product_search.search_products(order_by, location=rng.choice(location_ids),
+                                                            limit=200, **filters)
+
+        # What the dashboard runs when the location filter changes: one page, not the catalogue
+        print(f"switch location, first page by id:       {median_ms(page('id'), args.runs):8.3f} ms")
+        print(f"switch location, first page by quantity: {median_ms(page('quantity'), args.runs):8.3f} ms")
+        print(f"switch location, low stock only:         "
+              f"{median_ms(page('quantity', low_stock_only=True), args.runs):8.3f} ms")
+        print(f"switch location, page by price:          {median_ms(page('price'), args.runs // 10 or 1):8.3f} ms")
+        print(f"stock of one product by location:        "
+              f"{median_ms(lambda i: locations.stock_by_location(rng.randint(1, args.products)), args.runs):8.3f} ms")
+        print(f"catalogue page, all locations:           "
+              f"{median_ms(lambda i: product_search.search_products(limit=200), args.runs):8.3f} ms")
+
+        # Transfers between random locations that hold the product
+        with inventory_db.connection() as conn:
+            holdings = conn.execute("SELECT product_id, location_id FROM product_stock WHERE quantity >= 10 "
+                                    "ORDER BY random() LIMIT ?", (args.transfers,)).fetchall()
+        moves = [(product_id, source, rng.choice([l for l in location_ids if l != source]), 1)
+                 for product_id, source in holdings]
+        start = time.perf_counter()
+        for move in moves:
+            locations.transfer(*move)
+        single = len(moves) / (time.perf_counter() - start)
+        start = time.perf_counter()
+        for i in range(0, len(moves), 500):
+            locations.transfer_many([(product_id, target, source, 1)
+                                     for product_id, source, target, _ in moves[i:i + 500]])
+        batched = len(moves) / (time.perf_counter() - start)
+        print(f"transfers, one per transaction:          {single:8.0f} /sec")
+        print(f"transfers, 500 per transaction:          {batched:8.0f} /sec")
+
+        start = time.perf_counter()
+        mismatches = locations.verify()
+        print(f"totals match per-location stock: {not mismatches} "
+              f"(checked in {time.perf_counter() - start:.2f}s), "
+              f"movement log mismatches: {len(stock_movements.verify())}")
+        inventory_db.get_pool().close()
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
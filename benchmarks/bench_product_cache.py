@@ -0,0 +1,85 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import inventory_db
+import product_cache
+from product_search import PRODUCT_FIELDS
+
+
+def seed_products(count, categories):
+    with inventory_db.connection() as conn:
+        conn.execute("""
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+        INSERT INTO Products (name, category, price, quantity, low_stock_threshold)
+        SELECT 'product-' || i, 'category-' || (i % ?), 1 + (i * 7919) % 1000 / 100.0, (i * 104729) % 5000, 10
+        FROM n
+        """, (count, categories))
+
+
+# The previous get_products(): a fresh list of row tuples from SQLite every call
+def uncached_products():
+    with inventory_db.connection() as conn:
+        return conn.execute(f"SELECT {PRODUCT_FIELDS} FROM Products").fetchall()
+
+
+def uncached_product(product_id):
+    with inventory_db.connection() as conn:
+        return conn.execute(f"SELECT {PRODUCT_FIELDS} FROM Products WHERE id = ?", (product_id,)).fetchone()
+
+
+# Bytes allocated while building and holding the result of func()
+def retained_bytes(func):
+    tracemalloc.start()
+    result = func()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+# Average seconds per call of func(*args) over `repeat` calls
+def per_call(func, repeat, *args):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(*args)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory and latency of the product cache against plain queries")
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--lookups", type=int, default=100_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        inventory_db.configure(path=os.path.join(tmp, "inventory.db"))
+        inventory_db.setup_schema()
+        seed_products(args.products, args.categories)
+
+        rows, row_bytes = retained_bytes(uncached_products)
+        del rows
+        cache = product_cache.ProductCache(max_size=args.products)
+        _, cache_bytes = retained_bytes(lambda: (cache.all(), cache)[1])
+        print(f"list of row tuples: {row_bytes / args.products:6.0f} bytes/product")
+        print(f"product cache:      {cache_bytes / args.products:6.0f} bytes/product")
+
+        print(f"refresh (every product), query: {per_call(uncached_products, 5) * 1000:8.1f} ms")
+        print(f"refresh (every product), cache: {per_call(cache.all, 5) * 1000:8.1f} ms")
+
+        ids = [random.randint(1, args.products) for _ in range(args.lookups)]
+        lookup = iter(ids)
+        query_time = per_call(lambda: uncached_product(next(lookup)), args.lookups)
+        lookup = iter(ids)
+        cache_time = per_call(lambda: cache.get(next(lookup)), args.lookups)
+        print(f"single product, query: {query_time * 1e6:8.1f} us")
+        print(f"single product, cache: {cache_time * 1e6:8.1f} us")
+        print(cache.stats())
+        inventory_db.get_pool().close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import inventory_db
+import product_search
+
+
+# Fill the Products table with `count` synthetic rows
+def seed_products(path, count):
+    with sqlite3.connect(path) as conn:
+        for statement in inventory_db.SCHEMA:
+            conn.execute(statement)
+        conn.executemany(
+            "INSERT INTO Products (name, category, price, quantity, low_stock_threshold) VALUES (?, ?, ?, ?, ?)",
+            ((f"product-{i}", f"category-{i % 100}", 1.0, i % 500, 10) for i in range(count)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the keyset page queries behind the dashboard table")
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "inventory.db")
+        seed_products(path, args.products)
+        inventory_db.configure(path=path)
+
+        start = time.perf_counter()
+        rows = product_search.search_products(limit=args.page_size)
+        first_page = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(args.pages):
+            after_id = random.randint(0, args.products)
+            key = (after_id, after_id)
+            product_search.search_products(after=key, limit=args.page_size)
+            product_search.search_products(descending=True, after=key, limit=args.page_size)
+        per_page = (time.perf_counter() - start) / (args.pages * 2)
+
+        start = time.perf_counter()
+        with inventory_db.connection() as conn:
+            conn.execute("SELECT * FROM Products").fetchall()
+        full_scan = time.perf_counter() - start
+        inventory_db.get_pool().close()
+
+    print(f"first page ({len(rows)} rows):     {first_page * 1000:8.2f} ms")
+    print(f"random page (avg):          {per_page * 1000:8.2f} ms")
+    print(f"old SELECT * fetchall:      {full_scan * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
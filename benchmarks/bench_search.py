@@ -0,0 +1,69 @@
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import inventory_db
+import product_search
+
+
+WORDS = ("steel", "copper", "widget", "bolt", "gear", "valve", "pump", "cable", "sensor", "filter")
+
+
+# Fill the Products table with `count` synthetic rows (the FTS triggers index them as they go)
+def seed_products(path, count):
+    random.seed(6)
+    with sqlite3.connect(path) as conn:
+        for statement in inventory_db.SCHEMA:
+            conn.execute(statement)
+        conn.executemany(
+            "INSERT INTO Products (name, category, price, quantity, low_stock_threshold) VALUES (?, ?, ?, ?, ?)",
+            ((f"{random.choice(WORDS)} {random.choice(WORDS)} {i}", f"category-{i % 200}",
+              round(random.uniform(1, 1000), 2), random.randint(0, 1000), 10) for i in range(count)))
+
+
+# Queries the dashboard issues, as (label, keyword arguments) pairs
+def queries():
+    return [
+        ("first page by id", {}),
+        ("sort by name", {"order_by": "name"}),
+        ("sort by price desc", {"order_by": "price", "descending": True}),
+        ("category filter", {"category": "category-42"}),
+        ("category + sort by quantity", {"category": "category-42", "order_by": "quantity"}),
+        ("name prefix", {"name_prefix": "steel gear"}),
+        ("price range", {"min_price": 100, "max_price": 110, "order_by": "price"}),
+        ("quantity range", {"min_quantity": 5, "max_quantity": 6}),
+        ("free text", {"text": "copper valve"}),
+        ("free text + sort by price", {"text": "sensor", "order_by": "price"}),
+        ("low stock only", {"low_stock_only": True}),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time product search queries on a large catalogue")
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "inventory.db")
+        start = time.perf_counter()
+        seed_products(path, args.products)
+        print(f"seeded {args.products} products in {time.perf_counter() - start:.1f}s")
+        inventory_db.configure(path=path)
+
+        for label, kwargs in queries():
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                rows = product_search.search_products(limit=200, **kwargs)
+                timings.append(time.perf_counter() - start)
+            print(f"{label:30s} {statistics.median(timings) * 1000:8.2f} ms median  ({len(rows)} rows)")
+        inventory_db.get_pool().close()
+
+
+if __name__ == "__main__":
+    main()
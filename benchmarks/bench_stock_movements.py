@@ -0,0 +1,92 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import inventory_db
+import stock_movements
+
+
+# Products start with plenty of stock so random sales never run out
+OPENING_STOCK = 1_000_000
+
+
+def seed_products(count):
+    with inventory_db.connection() as conn:
+        conn.executemany("INSERT INTO Products (name, category, price, quantity) VALUES (?, 'bench', 1.0, 0)",
+                         ((f"product-{i}",) for i in range(count)))
+    stock_movements.record_movements((product_id, "receipt", OPENING_STOCK, 0.0)
+                                     for product_id in range(1, count + 1))
+
+
+# Append `count` random receipts and sales, one simulated second apart, in batches
+def generate_movements(count, products, batch_size, seed=0):
+    rng = random.Random(seed)
+    written = 0
+    while written < count:
+        batch = []
+        for i in range(written, min(count, written + batch_size)):
+            if rng.random() < 0.7:
+                batch.append((rng.randint(1, products), "sale", -rng.randint(1, 5), float(i + 1)))
+            else:
+                batch.append((rng.randint(1, products), "receipt", rng.randint(1, 20), float(i + 1)))
+        stock_movements.record_movements(batch)
+        written += len(batch)
+
+
+# Stock rebuilt by replaying every movement from the very first one
+def full_replay(movement_id=None):
+    with inventory_db.connection() as conn:
+        return dict(conn.execute("""
+        SELECT product_id, SUM(delta) FROM stock_movements WHERE id <= ? GROUP BY product_id
+        """, (movement_id or 1 << 62,)))
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time stock rebuilds from snapshots against a full replay")
+    parser.add_argument("--movements", type=int, default=1_000_000)
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--interval", type=int, default=stock_movements.SNAPSHOT_INTERVAL,
+                        help="movements between snapshots")
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    args = parser.parse_args()
+    stock_movements.SNAPSHOT_INTERVAL = args.interval
+
+    with tempfile.TemporaryDirectory() as tmp:
+        inventory_db.configure(path=os.path.join(tmp, "inventory.db"))
+        inventory_db.setup_schema()
+        seed_products(args.products)
+
+        _, elapsed = timed(generate_movements, args.movements, args.products, args.batch_size)
+        print(f"recorded {args.movements} movements in {elapsed:.1f}s ({args.movements / elapsed:.0f}/sec)")
+        with inventory_db.connection() as conn:
+            snapshots, snapshot_bytes = conn.execute(
+                "SELECT COUNT(*), SUM(LENGTH(data)) FROM stock_snapshots").fetchone()
+        print(f"{snapshots} snapshots, {snapshot_bytes / snapshots / 1024:.1f} KiB each on average")
+
+        replayed, replay_time = timed(full_replay)
+        current, current_time = timed(stock_movements.stock_at)
+        assert current == replayed, "snapshot rebuild disagrees with full replay"
+        print(f"current stock, full replay:       {replay_time * 1000:9.1f} ms")
+        print(f"current stock, snapshot + tail:   {current_time * 1000:9.1f} ms  ({replay_time / current_time:.0f}x)")
+
+        when = args.movements * 0.37  # a point between two snapshots
+        past, past_time = timed(stock_movements.stock_as_of, when)
+        assert past == full_replay(int(when) + args.products), "as-of rebuild disagrees with full replay"
+        print(f"stock as of a past time:          {past_time * 1000:9.1f} ms")
+
+        _, product_time = timed(stock_movements.product_stock, args.products // 2, when)
+        print(f"one product as of a past time:    {product_time * 1000:9.1f} ms")
+        assert not stock_movements.verify(), "Products.quantity disagrees with the movement log"
+        inventory_db.get_pool().close()
+
+
+if __name__ == "__main__":
+    main()
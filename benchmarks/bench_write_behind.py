@@ -0,0 +1,116 @@
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+import inventory_data
+import inventory_db
+import stock_movements
+import write_behind
+
+
+# Scanner traffic: mostly stock changes on a hot set of products, some price edits
+def operations(count, products, seed):
+    rng = random.Random(seed)
+    for _ in range(count):
+        product_id = min(int(rng.expovariate(1 / (products / 10))) + 1, products)
+        if rng.random() < 0.75:
+            yield "adjust", product_id, rng.choice((-1, 1, 1, 2))
+        else:
+            yield "price", product_id, round(rng.uniform(1, 100), 2)
+
+
+# The current design: every change commits its own transaction
+def commit_per_call(op, product_id, value):
+    if op == "adjust":
+        inventory_data.adjust_quantity(product_id, value)
+    else:
+        product = inventory_data.get_product(product_id)
+        inventory_data.update_product(product_id, product[1], product[2], value, product[4], product[5])
+
+
+def queued(queue):
+    def apply(op, product_id, value):
+        if op == "adjust":
+            queue.adjust_quantity(product_id, value)
+        else:
+            queue.update_product(product_id, price=value)
+    return apply
+
+
+# Run the operations split across `threads` scanners; returns ops/sec
+def run(apply, ops, threads):
+    chunks = [ops[i::threads] for i in range(threads)]
+
+    def worker(chunk):
+        for op in chunk:
+            try:
+                apply(*op)
+            except ValueError:
+                pass  # e.g. not enough stock
+
+    workers = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return len(ops) / (time.perf_counter() - start)
+
+
+def total_stock():
+    with inventory_db.connection() as conn:
+        return conn.execute("SELECT SUM(quantity) FROM Products").fetchone()[0]
+
+
+def setup(path, products, synchronous):
+    inventory_db.PRAGMAS = tuple(p for p in inventory_db.PRAGMAS if "synchronous" not in p) + (
+        f"PRAGMA synchronous = {synchronous}",)
+    inventory_db.configure(path=path)
+    inventory_db.setup_schema()
+    with inventory_db.connection() as conn:
+        conn.executemany("INSERT INTO Products (name, category, price, quantity, low_stock_threshold) "
+                         "VALUES (?, 'bench', 9.99, 0, 5)", ((f"product-{i}",) for i in range(products)))
+    stock_movements.record_movements((i + 1, "receipt", 1_000_000, time.time()) for i in range(products))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Commit-per-call writes against the write-behind queue")
+    parser.add_argument("--ops", type=int, default=20_000)
+    parser.add_argument("--products", type=int, default=5_000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=write_behind.MAX_BATCH)
+    parser.add_argument("--delay", type=float, default=write_behind.MAX_DELAY)
+    args = parser.parse_args()
+    ops = list(operations(args.ops, args.products, seed=7))
+
+    for synchronous in ("NORMAL", "FULL"):
+        with tempfile.TemporaryDirectory() as tmp:
+            setup(os.path.join(tmp, "direct.db"), args.products, synchronous)
+            direct = run(commit_per_call, ops, args.threads)
+            direct_stock = total_stock()
+            inventory_db.get_pool().close()
+
+            setup(os.path.join(tmp, "queued.db"), args.products, synchronous)
+            queue = write_behind.WriteBehindQueue(max_batch=args.batch, max_delay=args.delay)
+            start = time.perf_counter()
+            run(queued(queue), ops, args.threads)
+            enqueue_done = time.perf_counter() - start
+            queue.flush()
+            total = time.perf_counter() - start
+            queue.close()
+            mismatches = stock_movements.verify()
+            same_stock = total_stock() == direct_stock
+            inventory_db.get_pool().close()
+
+        print(f"synchronous={synchronous}")
+        print(f"  commit per call:           {direct:10.0f} ops/sec")
+        print(f"  write-behind (to barrier): {len(ops) / total:10.0f} ops/sec "
+              f"({len(ops) / enqueue_done:.0f} ops/sec to enqueue)")
+        print(f"  same total stock as commit per call: {same_stock}, movement log mismatches: {len(mismatches)}")
+
+
+if __name__ == "__main__":
+    main()
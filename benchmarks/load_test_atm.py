@@ -0,0 +1,155 @@
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+import atm_ledger
+from atm_engine import ATMSession
+from atm_ledger import InsufficientFunds, Ledger
+
+
+PIN = "1234"
+
+# Share of operations during a visit, after the PIN check
+MIX = (("balance", 0.4), ("withdraw", 0.35), ("deposit", 0.25))
+
+
+# Open `count` accounts sharing one PIN. Written straight to the tables, so
+# setting up thousands of accounts does not take one bcrypt hash each.
+def seed_accounts(ledger, count, rounds, balance_cents):
+    pin_hash = bcrypt.hashpw(PIN.encode(), bcrypt.gensalt(rounds))
+    numbers = [f"{100000 + i}" for i in range(count)]
+    now = time.time()
+    with ledger.pool.connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("INSERT INTO accounts (account_number, pin_hash, balance_cents) VALUES (?, ?, ?)",
+                         [(number, pin_hash, balance_cents) for number in numbers])
+        conn.execute("INSERT INTO ledger (account_id, kind, amount_cents, balance_cents, created_at) "
+                     "SELECT id, 'open', balance_cents, balance_cents, ? FROM accounts", (now,))
+    return numbers
+
+
+# Latencies per operation, as a terminal sees them: queueing for a worker included
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.declined = 0
+        self.net_cents = {}  # account id -> cents moved by successful deposits and withdrawals
+
+    def add(self, name, seconds):
+        self.latencies.setdefault(name, []).append(seconds * 1000)
+
+    def summary(self):
+        everything = [ms for values in self.latencies.values() for ms in values]
+        return {name: percentiles(values) for name, values in sorted(self.latencies.items())}, percentiles(everything)
+
+
+def percentiles(values):
+    values = sorted(values)
+    return len(values), statistics.median(values), values[min(len(values) - 1, int(len(values) * 0.99))]
+
+
+# One terminal: customers walk up, enter their PIN, do a few things and leave
+async def terminal(seed, ledger, numbers, executor, deadline, recorder, args):
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    session = ATMSession(ledger)
+    names, weights = zip(*MIX)
+
+    async def call(name, func, *func_args):
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(executor, func, *func_args)
+        finally:
+            recorder.add(name, time.perf_counter() - start)
+
+    while loop.time() < deadline:
+        if not await call("sign_in", session.sign_in, rng.choice(numbers), PIN):
+            raise RuntimeError("seeded account rejected its PIN")
+        for _ in range(rng.randint(1, 2 * args.visit_ops - 1)):
+            name = rng.choices(names, weights)[0]
+            cents = rng.randint(1, 200) * 500
+            try:
+                if name == "balance":
+                    await call(name, session.balance)
+                elif name == "deposit":
+                    await call(name, session.deposit, cents / 100)
+                    recorder.net_cents[session.account_id] = recorder.net_cents.get(session.account_id, 0) + cents
+                else:
+                    await call(name, session.withdraw, cents / 100)
+                    recorder.net_cents[session.account_id] = recorder.net_cents.get(session.account_id, 0) - cents
+            except InsufficientFunds:
+                recorder.declined += 1
+            if args.think:
+                await asyncio.sleep(rng.expovariate(1 / args.think))
+        session.sign_out()
+
+
+# Run `terminals` terminals for `duration` seconds; returns (seconds taken, recorder)
+async def run_level(ledger, numbers, terminals, args):
+    recorder = Recorder()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + args.duration
+        start = time.perf_counter()
+        await asyncio.gather(*(terminal(args.seed * 100_000 + terminals * 1000 + i, ledger, numbers, executor,
+                                        deadline, recorder, args) for i in range(terminals)))
+        elapsed = time.perf_counter() - start
+    return elapsed, recorder
+
+
+# Every balance must equal its opening balance plus what the terminals moved, and the ledger must replay to it
+def check_balances(ledger, opening_cents, net_cents):
+    with ledger.pool.connection() as conn:
+        rows = conn.execute("SELECT a.id, a.balance_cents, SUM(l.amount_cents) FROM accounts a "
+                            "JOIN ledger l ON l.account_id = a.id GROUP BY a.id").fetchall()
+    return [account_id for account_id, balance, replayed in rows
+            if not balance == replayed == opening_cents + net_cents.get(account_id, 0)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate many ATM terminals to size the ledger host")
+    parser.add_argument("--terminals", default="50,100,200,400",
+                        help="comma-separated numbers of concurrent terminals to try in turn")
+    parser.add_argument("--accounts", type=int, default=10_000)
+    parser.add_argument("--workers", type=int, default=4, help="threads running ledger operations")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per level")
+    parser.add_argument("--visit-ops", type=int, default=3, help="average operations per customer after the PIN")
+    parser.add_argument("--think", type=float, default=0.0, help="average seconds a customer pauses between steps")
+    parser.add_argument("--pin-rounds", type=int, default=atm_ledger.PIN_ROUNDS, help="bcrypt cost of the PINs")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+    opening_cents = 1_000_000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ledger = Ledger(os.path.join(tmp, "atm.db"), pool_size=args.workers)
+        numbers = seed_accounts(ledger, args.accounts, args.pin_rounds, opening_cents)
+        print(f"{args.accounts} accounts, PIN cost {args.pin_rounds}, {args.workers} workers, "
+              f"{args.duration:g}s per level")
+        print(f"{'terminals':>9} {'ops/sec':>9} {'p50 ms':>9} {'p99 ms':>9}   per operation: count p50/p99 ms")
+
+        net_cents = {}
+        for terminals in [int(n) for n in args.terminals.split(",")]:
+            elapsed, recorder = asyncio.run(run_level(ledger, numbers, terminals, args))
+            per_op, (count, p50, p99) = recorder.summary()
+            detail = "  ".join(f"{name} {n} {m:.1f}/{p:.1f}" for name, (n, m, p) in per_op.items())
+            print(f"{terminals:>9} {count / elapsed:>9.0f} {p50:>9.1f} {p99:>9.1f}   {detail}  "
+                  f"declined {recorder.declined}")
+            for account_id, cents in recorder.net_cents.items():
+                net_cents[account_id] = net_cents.get(account_id, 0) + cents
+
+        inconsistent = check_balances(ledger, opening_cents, net_cents)
+        print("balances consistent" if not inconsistent else f"{len(inconsistent)} account(s) inconsistent")
+        ledger.close()
+    return 1 if inconsistent else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import inventory_auth
+import inventory_data
+import inventory_db
+import login_throttle
+
+
+PASSWORD = "correct horse"
+
+
+# Mean milliseconds of `runs` calls of func(i)
+def mean_ms(func, runs):
+    start = time.perf_counter()
+    for i in range(runs):
+        func(i)
+    return (time.perf_counter() - start) / runs * 1000
+
+
+# One password guess, as the service's thread pool would run it
+def guess(username, terminal):
+    try:
+        inventory_auth.verify_password(username, "hunter2", terminal)
+        return "hashed"
+    except login_throttle.LoginThrottled:
+        return "rejected"
+
+
+# Run legitimate logins (and, optionally, an attack) against a pool of `workers`
+# threads for `duration` seconds; returns (staff latencies in ms, failed staff logins, attack outcome counts)
+def run_phase(args, staff, victims, attack):
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    stop = threading.Event()
+    attempts = []
+    latencies = []
+    failures = []
+
+    def attacker():
+        rng = random.Random(1)
+        interval = 1 / args.rate
+        next_at = time.perf_counter()
+        while not stop.is_set():
+            # Known accounts and made-up names, from a handful of addresses
+            username = rng.choice(victims) if rng.random() < 0.5 else f"guess-{rng.randrange(10 ** 6)}"
+            terminal = f"10.66.0.{rng.randrange(args.attackers)}"
+            attempts.append(executor.submit(guess, username, terminal))
+            next_at += interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+    def staff_logins():
+        i = 0
+        while not stop.is_set():
+            username = staff[i % len(staff)]
+            start = time.perf_counter()
+            try:
+                token = executor.submit(inventory_auth.authenticate, username, PASSWORD,
+                                        f"10.1.0.{i % len(staff)}").result()
+            except CancelledError:
+                # Still queued behind the attack when the phase ended
+                latencies.append((time.perf_counter() - start) * 1000)
+                failures.append(username)
+                break
+            latencies.append((time.perf_counter() - start) * 1000)
+            if token is None:
+                failures.append(username)
+            i += 1
+            stop.wait(args.interval)
+
+    threads = [threading.Thread(target=staff_logins)]
+    if attack:
+        threads.append(threading.Thread(target=attacker))
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    # Drop whatever is still queued, so an overwhelmed pool does not take minutes to drain
+    executor.shutdown(wait=False, cancel_futures=True)
+    for t in threads:
+        t.join()
+    executor.shutdown(wait=True)
+    outcomes = {"sent": len(attempts), "hashed": 0, "rejected": 0, "backlog": 0}
+    for future in attempts:
+        outcomes["backlog" if future.cancelled() else future.result()] += 1
+    return latencies, failures, outcomes
+
+
+# Start each phase from a clean slate: nothing in memory, nothing stored
+def fresh_throttle(enabled):
+    with inventory_db.connection() as conn:
+        conn.execute("DELETE FROM login_throttle")
+    inventory_auth.throttle = login_throttle.LoginThrottle(enabled=enabled)
+    return inventory_auth.throttle
+
+
+def report(name, latencies, failures, outcomes):
+    latencies = sorted(latencies)
+    p90 = latencies[int(len(latencies) * 0.9)]
+    line = (f"{name:<20} staff logins {len(latencies):4d}  p50 {statistics.median(latencies):8.1f} ms  "
+            f"p90 {p90:8.1f} ms  max {latencies[-1]:8.1f} ms  failed {len(failures)}")
+    if outcomes["sent"]:
+        line += (f"  | attack {outcomes['sent']} sent, {outcomes['hashed']} hashed, "
+                 f"{outcomes['rejected']} rejected, {outcomes['backlog']} still queued")
+    print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Staff login latency while the login endpoint is under attack")
+    parser.add_argument("--rounds", type=int, default=8, help="bcrypt cost factor")
+    parser.add_argument("--rate", type=int, default=1000, help="attack attempts per second")
+    parser.add_argument("--attackers", type=int, default=20, help="addresses the attack comes from")
+    parser.add_argument("--staff", type=int, default=50, help="legitimate accounts, each on its own terminal")
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds between staff logins")
+    parser.add_argument("--workers", type=int, default=4, help="threads checking passwords, as in the service")
+    parser.add_argument("--duration", type=float, default=5)
+    args = parser.parse_args(argv)
+    inventory_auth.BCRYPT_ROUNDS = args.rounds
+
+    with tempfile.TemporaryDirectory() as tmp:
+        inventory_db.configure(path=os.path.join(tmp, "inventory.db"), size=args.workers + 2)
+        inventory_db.setup_schema()
+        staff = [f"staff-{i}" for i in range(args.staff)]
+        victims = [f"victim-{i}" for i in range(50)]
+        for username in staff + victims:
+            inventory_data.register(username, PASSWORD)
+
+        # Unknown usernames must cost the same as wrong passwords, or timing reveals which accounts exist
+        fresh_throttle(False)
+        known = mean_ms(lambda i: inventory_auth.verify_password(victims[i % 50], "wrong"), 20)
+        unknown = mean_ms(lambda i: inventory_auth.verify_password(f"nobody-{i}", "wrong"), 20)
+        print(f"wrong password {known:.1f} ms, unknown user {unknown:.1f} ms (bcrypt cost {args.rounds})")
+
+        fresh_throttle(True)
+        baseline = run_phase(args, staff, victims, attack=False)
+        report("no attack", *baseline)
+        fresh_throttle(False)
+        report("attack, unthrottled", *run_phase(args, staff, victims, attack=True))
+        throttle = fresh_throttle(True)
+        result = run_phase(args, staff, victims, attack=True)
+        report("attack, throttled", *result)
+        print(f"throttle: {throttle.stats()}")
+
+        # A restarted service starts with an empty throttle and must still refuse the attackers
+        inventory_auth.throttle = login_throttle.LoginThrottle(enabled=True)
+        survived = guess(victims[0], "10.66.0.0") == "rejected"
+        print(f"lockouts survive a restart: {survived}")
+        inventory_db.get_pool().close()
+
+    latencies, failures, outcomes = result
+    flat = statistics.median(latencies) < 2 * statistics.median(baseline[0])
+    return 0 if survived and flat and not failures and outcomes["hashed"] < outcomes["sent"] // 10 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
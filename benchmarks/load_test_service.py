@@ -0,0 +1,157 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+import inventory_data
+import inventory_db
+
+
+# Minimal keep-alive HTTP/1.1 client for one simulated caller
+class Client:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.token = None  # sent as a bearer token once set
+
+    async def request(self, method, path, payload=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = b"" if payload is None else json.dumps(payload).encode()
+        auth = f"Authorization: Bearer {self.token}\r\n" if self.token else ""
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n{auth}"
+                          f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        data = await self.reader.readexactly(length)
+        return status, data
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+# One caller issuing a mix of searches, reads and updates until the deadline
+async def caller(host, port, token, products, deadline, latencies, errors, seed):
+    rng = random.Random(seed)
+    client = Client(host, port)
+    client.token = token
+    try:
+        while time.perf_counter() < deadline:
+            roll = rng.random()
+            product_id = rng.randint(1, products)
+            if roll < 0.5:
+                path = f"/products?category=category-{rng.randint(0, 99)}&order_by=price&limit=50"
+                method, payload = "GET", None
+            elif roll < 0.9:
+                path, method, payload = f"/products/{product_id}", "GET", None
+            else:
+                path, method = f"/products/{product_id}", "PUT"
+                payload = {"name": f"product-{product_id - 1}", "category": f"category-{(product_id - 1) % 100}",
+                           "price": rng.randint(1, 1000), "quantity": rng.randint(0, 500)}
+            start = time.perf_counter()
+            status, _ = await client.request(method, path, payload)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors.append(status)
+    finally:
+        client.close()
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+# Start a service on a temporary database seeded with `products` rows and a
+# user to sign in as; returns (process, port)
+def start_local_service(tmp, products, username, password):
+    path = os.path.join(tmp, "inventory.db")
+    seed = os.path.join(tmp, "seed.jsonl")
+    with open(seed, "w") as handle:
+        for i in range(products):
+            handle.write(json.dumps({"name": f"product-{i}", "category": f"category-{i % 100}",
+                                     "price": 1 + i % 1000, "quantity": i % 500}) + "\n")
+    subprocess.run([sys.executable, "bulk_io.py", "--db", path, "import", seed], check=True,
+                   stdout=subprocess.DEVNULL)
+    inventory_db.configure(path=path)
+    inventory_data.register(username, password)
+    inventory_db.get_pool().close()
+
+    process = subprocess.Popen([sys.executable, "inventory_service.py", "--db", path, "--port", "0"],
+                               stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    match = re.search(r":(\d+)$", line.strip())
+    if not match:
+        process.kill()
+        raise RuntimeError(f"Service did not start: {line!r}")
+    return process, int(match.group(1))
+
+
+async def run(host, port, args):
+    # Updates need a session; every caller shares one
+    client = Client(host, port)
+    status, data = await client.request("POST", "/login", {"username": args.username, "password": args.password})
+    client.close()
+    if status != 200:
+        raise RuntimeError(f"Login failed: {status} {data.decode()}")
+    token = json.loads(data)["token"]
+
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + args.duration
+    start = time.perf_counter()
+    await asyncio.gather(*(caller(host, port, token, args.products, deadline, latencies, errors, seed)
+                           for seed in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(latencies)} requests from {args.concurrency} callers in {elapsed:.1f}s "
+          f"({len(latencies) / elapsed:.0f} req/sec), {len(errors)} errors")
+    print(f"p50 {percentile(latencies, 50) * 1000:.2f} ms   p99 {percentile(latencies, 99) * 1000:.2f} ms   "
+          f"max {max(latencies) * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the inventory HTTP service")
+    parser.add_argument("--url", help="existing service, e.g. http://127.0.0.1:8080 (default: start one)")
+    parser.add_argument("--products", type=int, default=100_000, help="catalogue size (ids 1..N must exist)")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--username", default="loadtest", help="account the callers sign in as")
+    parser.add_argument("--password", default="loadtest")
+    args = parser.parse_args()
+
+    if args.url:
+        url = urlsplit(args.url)
+        asyncio.run(run(url.hostname, url.port, args))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        process, port = start_local_service(tmp, args.products, args.username, args.password)
+        try:
+            asyncio.run(run("127.0.0.1", port, args))
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
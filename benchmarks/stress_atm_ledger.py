@@ -0,0 +1,78 @@
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from atm_ledger import InsufficientFunds, Ledger
+
+
+# One ATM terminal: random deposits and withdrawals against shared accounts.
+# Returns (transactions completed, net cents moved per account).
+def terminal(path, account_ids, operations, seed):
+    rng = random.Random(seed)
+    ledger = Ledger(path, pool_size=1)
+    net = {account_id: 0 for account_id in account_ids}
+    done = 0
+    for _ in range(operations):
+        account_id = rng.choice(account_ids)
+        cents = rng.randint(1, 10000)
+        try:
+            if rng.random() < 0.5:
+                ledger.deposit(account_id, cents / 100)
+                net[account_id] += cents
+            else:
+                ledger.withdraw(account_id, cents / 100)
+                net[account_id] -= cents
+            done += 1
+        except InsufficientFunds:
+            done += 1
+    ledger.close()
+    return done, net
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hammer the ATM ledger from several processes")
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=2000, help="operations per process")
+    parser.add_argument("--accounts", type=int, default=5)
+    parser.add_argument("--opening-balance", type=float, default=1000.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "atm.db")
+        ledger = Ledger(path)
+        account_ids = [ledger.create_account(f"{9000 + i}", "0000", args.opening_balance)
+                       for i in range(args.accounts)]
+
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.starmap(terminal, [(path, account_ids, args.operations, seed)
+                                              for seed in range(args.processes)])
+        elapsed = time.perf_counter() - start
+
+        # Every balance must equal its opening balance plus what the terminals say they moved,
+        # and the ledger must replay to the same figure
+        opening = round(args.opening_balance * 100)
+        failures = 0
+        with ledger.pool.connection() as conn:
+            for account_id in account_ids:
+                expected = opening + sum(net[account_id] for _, net in results)
+                balance = conn.execute("SELECT balance_cents FROM accounts WHERE id = ?", (account_id,)).fetchone()[0]
+                replayed = conn.execute("SELECT SUM(amount_cents) FROM ledger WHERE account_id = ?",
+                                        (account_id,)).fetchone()[0]
+                if not balance == expected == replayed:
+                    failures += 1
+                    print(f"account {account_id}: balance {balance}, expected {expected}, ledger {replayed}")
+        ledger.close()
+
+    total = sum(done for done, _ in results)
+    print(f"{total} transactions from {args.processes} processes in {elapsed:.2f}s "
+          f"({total / elapsed:.0f} tx/sec)")
+    print("balances consistent" if not failures else f"{failures} account(s) inconsistent")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,97 @@
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+import inventory_data
+import inventory_db
+import stock_movements
+from inventory_data import ConflictError
+
+
+# Stock the hot products start with, so random removals never run out
+OPENING_STOCK = 1_000_000
+
+
+# One clerk: half price edits (read, then write price + 1) and half relative stock
+# adjustments against a few shared products. With blind=True price edits write back
+# without a version, as the GUIs used to. Returns (price edits, conflicts, net stock change).
+def clerk(path, product_ids, operations, seed, blind):
+    rng = random.Random(seed)
+    inventory_db.configure(path=path, size=1)
+    edits = conflicts = 0
+    net = {product_id: 0 for product_id in product_ids}
+    for _ in range(operations):
+        product_id = rng.choice(product_ids)
+        if rng.random() < 0.5:
+            delta = rng.choice((-3, -2, -1, 1, 2, 3))
+            inventory_data.adjust_quantity(product_id, delta)
+            net[product_id] += delta
+            continue
+        while True:
+            (_, name, category, price, quantity, threshold), version = inventory_data.get_versioned_product(product_id)
+            try:
+                inventory_data.update_product(product_id, name, category, price + 1, quantity, threshold,
+                                              None if blind else version)
+                edits += 1
+                break
+            except ConflictError:
+                conflicts += 1
+    inventory_db.get_pool().close()
+    return edits, conflicts, net
+
+
+def run(path, product_ids, args, blind):
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.starmap(clerk, [(path, product_ids, args.operations, seed, blind)
+                                       for seed in range(args.processes)])
+    elapsed = time.perf_counter() - start
+    edits = sum(result[0] for result in results)
+    conflicts = sum(result[1] for result in results)
+    net = {product_id: sum(result[2][product_id] for result in results) for product_id in product_ids}
+    return edits, conflicts, net, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Edit a few hot products from several processes at once")
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=500, help="operations per process")
+    parser.add_argument("--products", type=int, default=2, help="number of hot products")
+    parser.add_argument("--blind", action="store_true", help="write without versions to show lost updates")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "inventory.db")
+        inventory_db.configure(path=path)
+        inventory_db.setup_schema()
+        product_ids = [inventory_data.add_product(f"hot-{i}", "bench", 0.0, OPENING_STOCK, 10)
+                       for i in range(args.products)]
+        inventory_db.get_pool().close()
+
+        edits, conflicts, net, elapsed = run(path, product_ids, args, args.blind)
+
+        # Every edit and adjustment must have landed: price counts the edits and
+        # quantity the adjustments, and the movement log must agree with the table
+        inventory_db.configure(path=path)
+        price = sum(inventory_data.get_versioned_product(product_id)[0][3] for product_id in product_ids)
+        lost_edits = edits - int(price)
+        lost_stock = sum(abs(OPENING_STOCK + net[product_id] - inventory_data.get_versioned_product(product_id)[0][4])
+                         for product_id in product_ids)
+        mismatches = stock_movements.verify()
+        inventory_db.get_pool().close()
+
+    operations = args.processes * args.operations
+    print(f"{operations} operations from {args.processes} processes in {elapsed:.2f}s "
+          f"({operations / elapsed:.0f} ops/sec), {conflicts} conflicts retried")
+    print(f"lost price edits: {lost_edits}, lost stock units: {lost_stock}, "
+          f"movement log mismatches: {len(mismatches)}")
+    failed = lost_edits or lost_stock or mismatches
+    print("no lost updates" if not failed else "LOST UPDATES")
+    return 1 if failed and not args.blind else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
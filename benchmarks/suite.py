@@ -0,0 +1,245 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import atm_ledger
+import inventory_auth
+import inventory_data
+import inventory_db
+import product_search
+from benchmarks import synthetic
+
+
+# Slowdown of a case's median, relative to the baseline, reported as a regression
+THRESHOLD = 0.25
+
+# Changes smaller than this many milliseconds are treated as noise
+MIN_DELTA_MS = 0.05
+
+ATM_ACCOUNTS = 4
+ATM_PIN = "1234"
+
+
+# State shared by the benchmark cases: the generated catalogue, a seeded random
+# source and the products added by earlier cases
+class Workload:
+    def __init__(self, products, seed, ledger):
+        self.products = products
+        self.rng = random.Random(seed)
+        self.ledger = ledger
+        self.added = []
+        with inventory_db.connection() as conn:
+            self.usernames = [row[0] for row in conn.execute("SELECT username FROM Users ORDER BY id LIMIT 1000")]
+            self.categories = [row[0] for row in conn.execute(
+                "SELECT category FROM Products GROUP BY category ORDER BY COUNT(*) DESC LIMIT 20")]
+        self.accounts = [ledger.create_account(f"9{i:03d}", ATM_PIN, 1_000_000) for i in range(ATM_ACCOUNTS)]
+        self.token = inventory_auth.authenticate("admin", synthetic.PASSWORD)
+
+    def product_id(self):
+        return self.rng.randint(1, self.products)
+
+    def username(self):
+        return self.rng.choice(self.usernames)
+
+    def account(self):
+        return self.rng.choice(self.accounts)
+
+
+def add_product(work, i):
+    work.added.append(inventory_data.add_product(f"bench product {i}", work.rng.choice(work.categories),
+                                                 9.99, 10, 5))
+
+
+def update_product(work, i):
+    product_id = work.product_id()
+    inventory_data.update_product(product_id, f"updated product {product_id}", "updated", 19.99, i % 100, 5)
+
+
+# Read a product for editing and save it with compare-and-swap, as the GUIs do
+def edit_product(work, i):
+    product = inventory_data.get_versioned_product(work.product_id())
+    if product is not None:
+        (product_id, name, category, price, quantity, threshold), version = product
+        inventory_data.update_product(product_id, name, category, price + 1, quantity, threshold, version)
+
+
+def delete_product(work, i):
+    if work.added:
+        inventory_data.delete_product(work.added.pop())
+
+
+# Cases in the order they run, as (name, default runs, operation(workload, i))
+CASES = (
+    ("login", 5, lambda work, i: inventory_data.login(work.username(), synthetic.PASSWORD)),
+    ("register", 5, lambda work, i: inventory_data.register(f"bench-user-{i}", synthetic.PASSWORD)),
+    ("session_check", 20000, lambda work, i: inventory_auth.sessions.validate(work.token)),
+    ("add_product", 1000, add_product),
+    ("get_product", 20000, lambda work, i: inventory_data.get_product(work.product_id())),
+    ("get_products", 10, lambda work, i: inventory_data.get_products()),
+    ("search_page", 200, lambda work, i: product_search.search_products(
+        limit=200, category=work.rng.choice(work.categories), order_by="price")),
+    ("update_product", 1000, update_product),
+    ("edit_product", 1000, edit_product),
+    ("adjust_quantity", 1000, lambda work, i: inventory_data.adjust_quantity(work.product_id(), 1)),
+    ("delete_product", 1000, delete_product),
+    ("atm_verify_pin", 5, lambda work, i: work.ledger.verify_pin("9000", ATM_PIN)),
+    ("atm_balance", 2000, lambda work, i: work.ledger.balance(work.account())),
+    ("atm_deposit", 2000, lambda work, i: work.ledger.deposit(work.account(), 10)),
+    ("atm_withdraw", 2000, lambda work, i: work.ledger.withdraw(work.account(), 5)),
+)
+
+
+# Latency summary of one case, in milliseconds
+def summarise(timings):
+    timings = sorted(timings)
+    return {
+        "runs": len(timings),
+        "median_ms": statistics.median(timings) * 1000,
+        "mean_ms": statistics.fmean(timings) * 1000,
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        "min_ms": timings[0] * 1000,
+        "ops_per_sec": len(timings) / sum(timings) if sum(timings) else 0.0,
+    }
+
+
+def run_case(work, operation, runs):
+    timings = []
+    for i in range(runs):
+        start = time.perf_counter()
+        operation(work, i)
+        timings.append(time.perf_counter() - start)
+    return summarise(timings)
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def environment(args):
+    return {
+        "products": args.products,
+        "users": args.users,
+        "categories": args.categories,
+        "skew": args.skew,
+        "seed": args.seed,
+        "scale": args.scale,
+        "bcrypt_rounds": inventory_auth.BCRYPT_ROUNDS,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "commit": _commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+# Generate a catalogue in a temporary directory and time every selected case
+def run(args):
+    selected = [case for case in CASES if not args.only or case[0] in args.only]
+    with tempfile.TemporaryDirectory() as tmp:
+        inventory_db.configure(path=os.path.join(tmp, "inventory.db"))
+        start = time.perf_counter()
+        synthetic.generate(args.products, args.users, args.categories, args.skew, args.seed)
+        print(f"generated {args.products} products and {args.users} users in "
+              f"{time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        ledger = atm_ledger.Ledger(os.path.join(tmp, "atm.db"))
+        try:
+            work = Workload(args.products, args.seed, ledger)
+            results = {}
+            for name, runs, operation in selected:
+                results[name] = run_case(work, operation, max(1, int(runs * args.scale)))
+                print(f"{name:<16} {results[name]['median_ms']:10.3f} ms median", file=sys.stderr)
+        finally:
+            ledger.close()
+            inventory_db.get_pool().close()
+    return {"environment": environment(args), "results": results}
+
+
+# Cases whose median got slower than the baseline's by more than `threshold`,
+# as (name, baseline ms, current ms)
+def regressions(results, baseline, threshold=THRESHOLD, min_delta_ms=MIN_DELTA_MS):
+    slower = []
+    for name, current in results["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        delta = current["median_ms"] - before["median_ms"]
+        if delta > min_delta_ms and current["median_ms"] > before["median_ms"] * (1 + threshold):
+            slower.append((name, before["median_ms"], current["median_ms"]))
+    return slower
+
+
+def print_comparison(results, baseline):
+    print(f"{'case':<16}{'baseline ms':>14}{'current ms':>14}{'change':>10}")
+    for name, current in results["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<16}{'-':>14}{current['median_ms']:>14.3f}{'new':>10}")
+            continue
+        change = (current["median_ms"] / before["median_ms"] - 1) * 100 if before["median_ms"] else 0.0
+        print(f"{name:<16}{before['median_ms']:>14.3f}{current['median_ms']:>14.3f}{change:>+9.1f}%")
+
+    ours, theirs = results["environment"], baseline["environment"]
+    for key in ("products", "users", "categories", "skew", "seed", "scale", "bcrypt_rounds"):
+        if ours.get(key) != theirs.get(key):
+            print(f"warning: {key} differs from the baseline ({theirs.get(key)} -> {ours.get(key)})",
+                  file=sys.stderr)
+
+
+def print_results(results):
+    print(f"{'case':<16}{'runs':>8}{'median ms':>12}{'p95 ms':>12}{'ops/sec':>12}")
+    for name, result in results["results"].items():
+        print(f"{name:<16}{result['runs']:>8}{result['median_ms']:>12.3f}{result['p95_ms']:>12.3f}"
+              f"{result['ops_per_sec']:>12.0f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the data functions on a synthetic catalogue, headlessly")
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--categories", type=int, default=200)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of the category sizes")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the number of runs of every case")
+    parser.add_argument("--only", nargs="+", metavar="CASE", help="run only these cases")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="fractional slowdown of a median reported as a regression")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.only or ()) - {case[0] for case in CASES}
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+
+    results = run(args)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if not args.baseline:
+        print_results(results)
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    print_comparison(results, baseline)
+    slower = regressions(results, baseline, args.threshold)
+    for name, before, after in slower:
+        print(f"REGRESSION {name}: {before:.3f} ms -> {after:.3f} ms")
+    return 1 if slower else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
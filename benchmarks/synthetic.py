@@ -0,0 +1,120 @@
+import argparse
+import itertools
+import math
+import random
+import sys
+import time
+
+import change_feed
+import inventory_auth
+import inventory_db
+import stock_movements
+
+
+ADJECTIVES = ("steel", "copper", "brass", "nylon", "rubber", "plastic", "ceramic", "carbon", "zinc", "chrome",
+              "heavy", "compact", "industrial", "mini", "deluxe", "standard", "premium", "coated", "sealed", "flex")
+NOUNS = ("widget", "bolt", "gear", "valve", "pump", "cable", "sensor", "filter", "bearing", "hinge",
+         "bracket", "washer", "spring", "clamp", "fuse", "relay", "switch", "nozzle", "gasket", "coupling")
+FIRST_NAMES = ("amina", "ben", "chen", "dara", "elif", "farah", "goran", "hana", "ivan", "jamal", "kofi", "lena",
+               "mateo", "nadia", "omar", "priya", "quinn", "rosa", "sami", "tariq", "uma", "viktor", "wei", "yara")
+LAST_NAMES = ("ahmed", "brown", "costa", "diaz", "evans", "fischer", "garcia", "haddad", "ito", "jensen", "khan",
+              "lopez", "muller", "nguyen", "okafor", "patel", "rossi", "silva", "tanaka", "usman", "weber", "zhang")
+
+# Password of every generated user, so benchmarks can log in as any of them
+PASSWORD = "synthetic-pass"
+
+# Rows per executemany batch
+BATCH = 50_000
+
+
+# Cumulative Zipf weights over `count` categories: a few categories hold most products
+def zipf_weights(count, skew):
+    weights = [1 / (rank ** skew) for rank in range(1, count + 1)]
+    return list(itertools.accumulate(weights))
+
+
+def _batches(rows):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, BATCH))
+        if not batch:
+            return
+        yield batch
+
+
+# Generated users as (username, password_hash, role). Every user shares one
+# bcrypt hash of PASSWORD so a large user table does not take hours to hash.
+def users(count, rng):
+    password_hash = inventory_auth.hash_password(PASSWORD)
+    yield "admin", password_hash, "admin"
+    for i in range(1, count):
+        yield f"{rng.choice(FIRST_NAMES)}.{rng.choice(LAST_NAMES)}{i}", password_hash, "user"
+
+
+# Generated products as (name, category, price, quantity, threshold, owner id).
+# Categories follow a Zipf distribution, prices are log-normal and roughly one
+# product in twenty is out of stock.
+def products(count, categories, skew, user_count, rng):
+    names = [f"category-{i}" for i in range(categories)]
+    cumulative = zipf_weights(categories, skew)
+    for i in range(count):
+        quantity = 0 if rng.random() < 0.05 else int(rng.expovariate(1 / 150))
+        yield (f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}",
+               rng.choices(names, cum_weights=cumulative)[0],
+               round(math.exp(rng.gauss(3, 1)), 2),
+               quantity,
+               rng.choice((5, 10, 20, 50)),
+               rng.randint(1, user_count) if rng.random() < 0.5 else None)
+
+
+# Fill the database at inventory_db.DB_PATH (which must be empty) with a
+# reproducible catalogue. The generated stock is recorded as the starting
+# snapshot of the movement log, like stock that predates movement tracking.
+def generate(product_count, user_count=1000, categories=200, skew=1.1, seed=42):
+    rng = random.Random(seed)
+    inventory_db.setup_schema()
+    with inventory_db.connection() as conn:
+        conn.execute("PRAGMA synchronous = OFF")
+        try:
+            for batch in _batches(users(max(user_count, 1), rng)):
+                conn.executemany("INSERT INTO Users (username, password_hash, role) VALUES (?, ?, ?)", batch)
+            for batch in _batches(products(product_count, categories, skew, max(user_count, 1), rng)):
+                with change_feed.bulk_change(conn):
+                    conn.executemany("""
+                    INSERT INTO Products (name, category, price, quantity, low_stock_threshold, owner_id)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """, batch)
+                conn.commit()
+            conn.execute("DELETE FROM stock_snapshots")
+            stock_movements.save_snapshot(conn, 0, conn.execute(
+                "SELECT id, quantity FROM Products WHERE quantity != 0 ORDER BY id").fetchall())
+            conn.commit()
+            conn.execute("PRAGMA optimize")
+        finally:
+            conn.execute("PRAGMA synchronous = NORMAL")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic inventory database")
+    parser.add_argument("db", help="database file to create")
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--categories", type=int, default=200)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of the category sizes")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    inventory_db.configure(path=args.db)
+    with inventory_db.connection() as conn:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'Products'").fetchone():
+            print(f"{args.db} already has a Products table", file=sys.stderr)
+            return 1
+    start = time.perf_counter()
+    generate(args.products, args.users, args.categories, args.skew, args.seed)
+    print(f"generated {args.products} products and {args.users} users in {time.perf_counter() - start:.1f}s")
+    inventory_db.get_pool().close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
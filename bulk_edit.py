@@ -0,0 +1,395 @@
+import argparse
+import json
+import sqlite3
+import sys
+import time
+import zlib
+from array import array
+
+import barcodes
+import change_feed
+import change_log
+import inventory_db
+import product_search
+import stock_movements
+
+
+# Rows read per round trip while packing an undo record
+FETCH_BATCH = 50_000
+
+# Each operation first collects the products it touches here, so the
+# statements that follow (and the undo record) all see the same set even
+# while triggers rewrite the tables the filters read. Undo fills `current`
+# with what a row must still hold for the undo to touch it.
+TEMP_SCHEMA = (
+    "CREATE TEMP TABLE IF NOT EXISTS bulk_rows (id INTEGER PRIMARY KEY, value, version INTEGER, current)",
+    "CREATE TEMP TABLE IF NOT EXISTS bulk_stock (product_id INTEGER, location_id INTEGER, quantity INTEGER)",
+    "DELETE FROM temp.bulk_rows",
+    "DELETE FROM temp.bulk_stock",
+)
+
+# Undoing a delete stages the products here and restores them in one INSERT:
+# inserted a row per statement, the full-text index flushes for every row
+BULK_PRODUCTS_SCHEMA = (
+    "CREATE TEMP TABLE IF NOT EXISTS bulk_products (id INTEGER PRIMARY KEY, name, category, price, "
+    "low_stock_threshold, version, owner_id, sku)",
+    "DELETE FROM temp.bulk_products",
+)
+
+# Product columns kept by a bulk delete so it can be undone
+DELETED_FIELDS = "id, name, category, price, low_stock_threshold, version, owner_id, sku"
+
+
+# Pack equal-length arrays into one compressed blob
+def pack(*columns):
+    data = []
+    for column in columns:
+        if sys.byteorder == "big":
+            column = array(column.typecode, column)
+            column.byteswap()
+        data.append(column.tobytes())
+    return zlib.compress(b"".join(data))
+
+
+# Arrays packed by pack(), given how many values each holds and their typecodes
+def unpack(data, count, typecodes):
+    raw = zlib.decompress(data)
+    columns = []
+    offset = 0
+    for typecode in typecodes:
+        column = array(typecode)
+        size = count * column.itemsize
+        column.frombytes(raw[offset:offset + size])
+        if sys.byteorder == "big":
+            column.byteswap()
+        columns.append(column)
+        offset += size
+    return columns
+
+
+# Filters as SQL over Products; `location` keeps only products held there
+def _filters(location, filters):
+    where, params = product_search.filter_sql(**filters)
+    if location is not None:
+        where += ((" AND " if where else " WHERE ")
+                  + "id IN (SELECT product_id FROM product_stock WHERE location_id = ?)")
+        params.append(location)
+    return where, params
+
+
+# Start an operation: take the write lock and collect the matching products
+# into temp.bulk_rows as (id, value, version); returns how many matched
+def _begin(conn, value_sql, value_params, location, filters):
+    conn.execute("BEGIN IMMEDIATE")
+    for statement in TEMP_SCHEMA:
+        conn.execute(statement)
+    where, params = _filters(location, filters)
+    return conn.execute(f"INSERT INTO temp.bulk_rows (id, value, version) SELECT id, {value_sql}, version "
+                        f"FROM Products{where}", value_params + params).rowcount
+
+
+# Columns of temp.bulk_rows (or of another query's rows) as arrays
+def _collected(conn, typecodes, sql=None):
+    columns = [array(typecode) for typecode in typecodes]
+    cursor = conn.execute(sql or f"SELECT {', '.join(('id', 'value', 'version')[:len(typecodes)])} "
+                                 "FROM temp.bulk_rows ORDER BY id")
+    while True:
+        rows = cursor.fetchmany(FETCH_BATCH)
+        if not rows:
+            break
+        for column, values in zip(columns, zip(*rows)):
+            column.extend(values)
+    return columns
+
+
+# Store the undo record for an operation; only the latest operation keeps one
+def _record(conn, kind, description, products, params, data):
+    conn.execute("UPDATE bulk_operations SET data = NULL WHERE data IS NOT NULL")
+    return conn.execute("""
+    INSERT INTO bulk_operations (kind, description, products, params, data, created_at) VALUES (?, ?, ?, ?, ?, ?)
+    """, (kind, description, products, json.dumps(params), data, time.time())).lastrowid
+
+
+def _describe(change, location, filters):
+    scope = ", ".join(f"{name}={value!r}" for name, value in sorted(filters.items())
+                      if value is not None and value is not False)
+    if location is not None:
+        scope = ", ".join(filter(None, [scope, f"location={location}"]))
+    return f"{change} ({scope or 'all products'})"
+
+
+# Change the price of every product matching the filters (the same filters as
+# product_search.search_products) by a percentage or by an amount; prices are
+# rounded to cents and never go below zero. One UPDATE in one transaction;
+# returns how many products were repriced.
+def reprice(percent=None, amount=None, location=None, **filters):
+    if (percent is None) == (amount is None):
+        raise ValueError("Give either a percentage or an amount!")
+    if percent is not None:
+        factor = 1 + float(percent) / 100
+        if factor < 0:
+            raise ValueError("Prices cannot fall by more than 100%!")
+        new_price, value, change = "MAX(0, ROUND(price * ?, 2))", factor, f"price {float(percent):+g}%"
+    else:
+        new_price, value, change = "MAX(0, ROUND(price + ?, 2))", float(amount), f"price {float(amount):+.2f}"
+
+    with inventory_db.connection() as conn:
+        count = _begin(conn, "price", [], location, filters)
+        if not count:
+            return 0
+        # Bumping the version here stops products_version from running an UPDATE per row
+        with change_feed.bulk_change(conn):
+            conn.execute(f"UPDATE Products SET price = {new_price}, version = version + 1 "
+                         "WHERE id IN (SELECT id FROM temp.bulk_rows)", (value,))
+        # Old and new prices: undo restores a price only while it is still the new one
+        ids, old_prices, new_prices = _collected(conn, "qdd", """
+        SELECT r.id, r.value, p.price FROM temp.bulk_rows r JOIN Products p ON p.id = r.id ORDER BY r.id
+        """)
+        _record(conn, "price", _describe(change, location, filters), count, {},
+                pack(ids, old_prices, new_prices))
+        conn.execute("DELETE FROM temp.bulk_rows")
+    change_log.record_all()
+    return count
+
+
+# Add `delta` units of stock (or remove them, with a negative delta) at a
+# location for every product matching the filters. Removals take what the
+# location holds if that is less. One INSERT into the movement log, as
+# adjustments; returns how many products were adjusted.
+def adjust_stock(delta, location_id=stock_movements.DEFAULT_LOCATION, location=None, **filters):
+    delta = int(delta)
+    if delta == 0:
+        raise ValueError("Adjustment must not be zero!")
+    if delta > 0:
+        value_sql, value_params = "?", [delta]
+    else:
+        value_sql = ("-MIN(?, IFNULL((SELECT quantity FROM product_stock "
+                     "WHERE location_id = ? AND product_id = Products.id), 0))")
+        value_params = [-delta, location_id]
+
+    with inventory_db.connection() as conn:
+        _begin(conn, value_sql, value_params, location, filters)
+        conn.execute("DELETE FROM temp.bulk_rows WHERE value = 0")
+        try:
+            with change_feed.bulk_change(conn):
+                count = conn.execute("""
+                INSERT INTO stock_movements (product_id, kind, delta, created_at, location_id)
+                SELECT id, 'adjustment', value, ?, ? FROM temp.bulk_rows ORDER BY id
+                """, (time.time(), location_id)).rowcount
+        except sqlite3.IntegrityError as e:
+            raise stock_movements.movement_error(e)
+        if not count:
+            return 0
+        ids, deltas = _collected(conn, "qq")
+        _record(conn, "stock", _describe(f"stock {delta:+d} at location {location_id}", location, filters), count,
+                {"location_id": location_id}, pack(ids, deltas))
+        conn.execute("DELETE FROM temp.bulk_rows")
+    change_log.record_all()
+    stock_movements.maybe_snapshot()
+    return count
+
+
+# Delete every product matching the filters. Their stock is written off first,
+# in one INSERT into the movement log, then one DELETE removes them. Returns
+# how many products were deleted.
+def delete_products(location=None, **filters):
+    with inventory_db.connection() as conn:
+        count = _begin(conn, "NULL", [], location, filters)
+        if not count:
+            return 0
+        conn.execute("""
+        INSERT INTO temp.bulk_stock (product_id, location_id, quantity)
+        SELECT product_id, location_id, quantity FROM product_stock WHERE product_id IN (SELECT id FROM temp.bulk_rows)
+        """)
+        products = conn.execute(f"SELECT {DELETED_FIELDS} FROM Products "
+                                "WHERE id IN (SELECT id FROM temp.bulk_rows)").fetchall()
+        stock = conn.execute("SELECT product_id, location_id, quantity FROM temp.bulk_stock").fetchall()
+        with change_feed.bulk_change(conn):
+            conn.execute("""
+            INSERT INTO stock_movements (product_id, kind, delta, created_at, location_id)
+            SELECT product_id, 'adjustment', -quantity, ?, location_id FROM temp.bulk_stock
+            """, (time.time(),))
+            conn.execute("DELETE FROM Products WHERE id IN (SELECT id FROM temp.bulk_rows)")
+        _record(conn, "delete", _describe("delete", location, filters), count, {},
+                zlib.compress(json.dumps({"products": products, "stock": stock}).encode()))
+        conn.execute("DELETE FROM temp.bulk_rows")
+        conn.execute("DELETE FROM temp.bulk_stock")
+    for row in products:
+        if row[-1] is not None:
+            barcodes.index.put(row[-1], None)
+    change_log.record_all()
+    stock_movements.maybe_snapshot()
+    return count
+
+
+# The operation undo() would revert, as (id, kind, description, products, created_at), or None
+def last_operation():
+    with inventory_db.connection() as conn:
+        return conn.execute("""
+        SELECT id, kind, description, products, created_at FROM bulk_operations
+        WHERE data IS NOT NULL ORDER BY id DESC LIMIT 1
+        """).fetchone()
+
+
+# Recent bulk operations, newest first: (id, kind, description, products, created_at, undone_at)
+def history(limit=20):
+    with inventory_db.connection() as conn:
+        return conn.execute("""
+        SELECT id, kind, description, products, created_at, undone_at FROM bulk_operations
+        ORDER BY id DESC LIMIT ?
+        """, (limit,)).fetchall()
+
+
+# Revert the latest bulk operation; returns (products restored, ids of the
+# products left as they are). A price is only restored while it is still the
+# price the operation set, so prices edited since are skipped; so are
+# products deleted since. Skipped products can never be restored, so the
+# operation counts as undone either way. Stock that can no longer be
+# taken back (it has been sold since), or deleted names and SKUs that have
+# been reused, make the whole undo fail with ValueError.
+def undo():
+    with inventory_db.connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute("""
+        SELECT id, kind, products, params, data FROM bulk_operations
+        WHERE data IS NOT NULL ORDER BY id DESC LIMIT 1
+        """).fetchone()
+        if row is None:
+            raise ValueError("Nothing to undo!")
+        operation_id, kind, count, params, data = row
+        for statement in TEMP_SCHEMA:
+            conn.execute(statement)
+
+        with change_feed.bulk_change(conn):
+            if kind == "price":
+                ids, old_prices, new_prices = unpack(data, count, "qdd")
+                conn.executemany("INSERT INTO temp.bulk_rows (id, value, current) VALUES (?, ?, ?)",
+                                 zip(ids, old_prices, new_prices))
+                skipped = [product_id for (product_id,) in conn.execute("""
+                SELECT r.id FROM temp.bulk_rows r LEFT JOIN Products p ON p.id = r.id
+                WHERE p.price IS NOT r.current ORDER BY r.id
+                """)]
+                restored = conn.execute("""
+                UPDATE Products SET price = r.value, version = Products.version + 1
+                FROM temp.bulk_rows r WHERE Products.id = r.id AND Products.price = r.current
+                """).rowcount
+            elif kind == "stock":
+                ids, deltas = unpack(data, count, "qq")
+                conn.executemany("INSERT INTO temp.bulk_rows (id, value) VALUES (?, ?)", zip(ids, deltas))
+                skipped = [product_id for (product_id,) in conn.execute("""
+                SELECT id FROM temp.bulk_rows WHERE id NOT IN (SELECT id FROM Products) ORDER BY id
+                """)]
+                try:
+                    restored = conn.execute("""
+                    INSERT INTO stock_movements (product_id, kind, delta, created_at, location_id)
+                    SELECT id, 'adjustment', -value, ?, ? FROM temp.bulk_rows
+                    WHERE id IN (SELECT id FROM Products) ORDER BY id
+                    """, (time.time(), json.loads(params)["location_id"])).rowcount
+                except sqlite3.IntegrityError as e:
+                    if "insufficient stock" in str(e):
+                        raise ValueError("Cannot undo: some of that stock has moved since!")
+                    raise stock_movements.movement_error(e)
+            else:
+                deleted = json.loads(zlib.decompress(data))
+                for statement in BULK_PRODUCTS_SCHEMA:
+                    conn.execute(statement)
+                conn.executemany(f"INSERT INTO temp.bulk_products ({DELETED_FIELDS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                 deleted["products"])
+                try:
+                    conn.execute(f"INSERT INTO Products ({DELETED_FIELDS}, quantity) "
+                                 f"SELECT {DELETED_FIELDS}, 0 FROM temp.bulk_products ORDER BY id")
+                except sqlite3.IntegrityError:
+                    raise ValueError("Cannot undo: a deleted product's name or SKU has been reused!")
+                conn.execute("DELETE FROM temp.bulk_products")
+                conn.executemany("INSERT INTO temp.bulk_stock (product_id, location_id, quantity) VALUES (?, ?, ?)",
+                                 deleted["stock"])
+                conn.execute("""
+                INSERT INTO stock_movements (product_id, kind, delta, created_at, location_id)
+                SELECT product_id, 'adjustment', quantity, ?, location_id FROM temp.bulk_stock
+                """, (time.time(),))
+                restored = len(deleted["products"])
+                skipped = []
+        conn.execute("UPDATE bulk_operations SET data = NULL, undone_at = ? WHERE id = ?",
+                     (time.time(), operation_id))
+        conn.execute("DELETE FROM temp.bulk_rows")
+        conn.execute("DELETE FROM temp.bulk_stock")
+    if kind == "delete":
+        for product in deleted["products"]:
+            if product[-1] is not None:
+                barcodes.index.put(product[-1], product[0])
+    change_log.record_all()
+    stock_movements.maybe_snapshot()
+    return restored, skipped
+
+
+# Search filters given on the command line
+def parse_filters(args):
+    filters = {name: getattr(args, name) for name in ("text", "category", "min_price", "max_price",
+                                                     "min_quantity", "max_quantity", "location")
+               if getattr(args, name) is not None}
+    if args.low_stock_only:
+        filters["low_stock_only"] = True
+    if not filters and not args.all:
+        raise ValueError("Give at least one filter, or --all to change every product")
+    return filters
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Change prices or stock of many products at once, with undo")
+    parser.add_argument("--db", help="database file (defaults to INVENTORY_DB or inventory.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    price_parser = sub.add_parser("price", help="change prices by a percentage or an amount")
+    change = price_parser.add_mutually_exclusive_group(required=True)
+    change.add_argument("--percent", type=float)
+    change.add_argument("--amount", type=float)
+    stock_parser = sub.add_parser("stock", help="add or remove stock")
+    stock_parser.add_argument("delta", type=int)
+    stock_parser.add_argument("--at", type=int, default=stock_movements.DEFAULT_LOCATION,
+                              help="location the stock is added at or removed from")
+    delete_parser = sub.add_parser("delete", help="delete products")
+    for filtered in (price_parser, stock_parser, delete_parser):
+        filtered.add_argument("--text")
+        filtered.add_argument("--category")
+        filtered.add_argument("--min-price", type=float)
+        filtered.add_argument("--max-price", type=float)
+        filtered.add_argument("--min-quantity", type=int)
+        filtered.add_argument("--max-quantity", type=int)
+        filtered.add_argument("--low-stock-only", action="store_true")
+        filtered.add_argument("--location", type=int, help="only products held at this location")
+        filtered.add_argument("--all", action="store_true", help="apply to every product")
+    sub.add_parser("undo", help="revert the latest bulk operation")
+    sub.add_parser("history", help="list recent bulk operations")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        inventory_db.configure(path=args.db)
+    inventory_db.setup_schema()
+
+    try:
+        start = time.perf_counter()
+        if args.command == "price":
+            count = reprice(args.percent, args.amount, **parse_filters(args))
+        elif args.command == "stock":
+            count = adjust_stock(args.delta, args.at, **parse_filters(args))
+        elif args.command == "delete":
+            count = delete_products(**parse_filters(args))
+        elif args.command == "undo":
+            count, skipped = undo()
+            if skipped:
+                print(f"{len(skipped)} products changed or deleted since were left as they are: "
+                      f"{' '.join(map(str, skipped[:20]))}{' ...' if len(skipped) > 20 else ''}", file=sys.stderr)
+        else:
+            for operation_id, kind, description, products, created_at, undone_at in history():
+                status = " (undone)" if undone_at else ""
+                print(f"{operation_id}\t{time.strftime('%Y-%m-%d %H:%M', time.localtime(created_at))}\t"
+                      f"{products} products\t{description}{status}")
+            return 0
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"{count} products in {time.perf_counter() - start:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
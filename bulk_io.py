@@ -0,0 +1,195 @@
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import change_feed
+import change_log
+import inventory_db
+import stock_movements
+
+
+# Columns read and written by the bulk tools, in table order
+COLUMNS = ("name", "category", "price", "quantity", "low_stock_threshold")
+
+# Rows sent to executemany per transaction
+BATCH_SIZE = 5000
+
+# Quantities are not written here: _write records them as stock movements
+UPSERT_SQL = """
+INSERT INTO Products (name, category, price, quantity, low_stock_threshold)
+VALUES (?, ?, ?, 0, ?)
+ON CONFLICT(name) DO UPDATE SET
+    category = excluded.category,
+    price = excluded.price,
+    low_stock_threshold = excluded.low_stock_threshold
+"""
+
+
+# Work out the file format from an explicit value or the file extension
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".jsonl", ".ndjson"):
+        return "jsonl"
+    return "csv"
+
+
+# Yield (line number, record dict) pairs from a CSV or JSON Lines file
+def read_records(handle, fmt):
+    if fmt == "csv":
+        reader = csv.DictReader(handle)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_num, line in enumerate(handle, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_num, e
+                continue
+            yield line_num, record
+
+
+# Turn a raw record into a Products row, raising ValueError when it is invalid
+def to_row(record):
+    if not isinstance(record, dict):
+        raise ValueError(f"not an object: {record}")
+    name = str(record.get("name") or "").strip()
+    if not name:
+        raise ValueError("missing name")
+    category = record.get("category") or None
+    price = float(record.get("price"))
+    quantity = int(record.get("quantity"))
+    threshold = record.get("low_stock_threshold")
+    threshold = 10 if threshold in (None, "") else int(threshold)
+    if price < 0 or quantity < 0:
+        raise ValueError("price and quantity must not be negative")
+    return (name, category, price, quantity, threshold)
+
+
+# Upsert rows and record the stock adjustments that bring them to their quantities
+def _write(conn, rows):
+    conn.executemany(UPSERT_SQL, [(name, category, price, threshold)
+                                  for name, category, price, _, threshold in rows])
+    stock_movements.set_quantities(conn, [(row[0], row[3]) for row in rows], key="name")
+
+
+# Write one batch in a single transaction, isolating bad rows if the batch fails
+def _flush(batch, rejects):
+    try:
+        with inventory_db.connection() as conn, change_feed.bulk_change(conn):
+            _write(conn, [row for _, row in batch])
+        return len(batch)
+    except sqlite3.DatabaseError:
+        pass
+
+    written = 0
+    with inventory_db.connection() as conn, change_feed.bulk_change(conn):
+        for line_num, row in batch:
+            try:
+                conn.execute("SAVEPOINT bulk_row")
+                _write(conn, [row])
+                conn.execute("RELEASE bulk_row")
+                written += 1
+            except sqlite3.DatabaseError as e:
+                conn.execute("ROLLBACK TO bulk_row")
+                conn.execute("RELEASE bulk_row")
+                rejects.append((line_num, str(e)))
+    return written
+
+
+# Upsert (line number, record) pairs in batched transactions; returns (written, rejects)
+def upsert_records(numbered_records, batch_size=BATCH_SIZE):
+    written = 0
+    rejects = []
+    batch = []
+
+    for line_num, record in numbered_records:
+        if isinstance(record, Exception):
+            rejects.append((line_num, str(record)))
+            continue
+        try:
+            batch.append((line_num, to_row(record)))
+        except (TypeError, ValueError) as e:
+            rejects.append((line_num, str(e)))
+            continue
+        if len(batch) >= batch_size:
+            written += _flush(batch, rejects)
+            batch = []
+
+    if batch:
+        written += _flush(batch, rejects)
+    if written:
+        change_log.record_all()
+    stock_movements.maybe_snapshot()
+    return written, rejects
+
+
+# Stream a CSV/JSONL file into Products, upserting on name; returns (written, rejects)
+def import_products(path, fmt=None, batch_size=BATCH_SIZE):
+    fmt = detect_format(path, fmt)
+    with open(path, newline="", encoding="utf-8") as handle:
+        return upsert_records(read_records(handle, fmt), batch_size)
+
+
+# Stream the Products table to a CSV/JSONL file; returns the number of rows written
+def export_products(path, fmt=None, batch_size=BATCH_SIZE):
+    fmt = detect_format(path, fmt)
+    count = 0
+
+    with inventory_db.connection() as conn, open(path, "w", newline="", encoding="utf-8") as handle:
+        cursor = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM Products ORDER BY id")
+        writer = csv.writer(handle) if fmt == "csv" else None
+        if writer:
+            writer.writerow(COLUMNS)
+
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if writer:
+                writer.writerows(rows)
+            else:
+                handle.writelines(json.dumps(dict(zip(COLUMNS, row))) + "\n" for row in rows)
+            count += len(rows)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import/export of the Products table")
+    parser.add_argument("--db", help="database file (defaults to INVENTORY_DB or inventory.db)")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="file format (default: from extension)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("import", help="load products from a file").add_argument("file")
+    sub.add_parser("export", help="write products to a file").add_argument("file")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        inventory_db.configure(path=args.db)
+    inventory_db.setup_schema()
+
+    start = time.perf_counter()
+    if args.command == "import":
+        count, rejects = import_products(args.file, args.format, args.batch_size)
+        for line_num, reason in rejects:
+            print(f"rejected line {line_num}: {reason}", file=sys.stderr)
+    else:
+        count, rejects = export_products(args.file, args.format, args.batch_size), []
+    elapsed = time.perf_counter() - start
+
+    rate = count / elapsed if elapsed else 0
+    print(f"{args.command}ed {count} rows in {elapsed:.2f}s ({rate:.0f} rows/sec), {len(rejects)} rejected")
+    return 1 if rejects else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+import math
+import os
+import threading
+from functools import reduce
+
+
+# Notes the cassettes hold, in dollars
+DENOMINATIONS = (100, 50, 20, 10, 5)
+
+# Notes loaded into a freshly filled machine
+DEFAULT_CASSETTES = {100: 100, 50: 200, 20: 500, 10: 500, 5: 200}
+
+# Largest single withdrawal, in dollars; the plan table covers every amount up to it
+MAX_WITHDRAWAL = int(os.environ.get("ATM_MAX_WITHDRAWAL", "1000"))
+
+# What a note costs a plan. A cassette that is running down costs more per
+# note, so plans spend plentiful notes first: once a cassette is in its last
+# quarter, one of its notes weighs as much as three ordinary ones.
+NOTE_COST = 4
+SCARCITY_PENALTY = (0, 1, 3, 8)  # by scarcity level: over 3/4 full ... under 1/4 full
+
+
+# Raised when the machine cannot pay out an amount with the notes it holds
+class CashUnavailable(ValueError):
+    pass
+
+
+# Plans withdrawals against the notes actually in the cassettes: the fewest
+# notes possible, preferring plentiful denominations over scarce ones.
+#
+# A bounded-knapsack table over every amount up to max_amount is built once,
+# so planning a withdrawal is a list lookup. Taking notes out only invalidates
+# the table once a cassette holds fewer notes than some plan in it uses, and
+# optimal plans use few of each note, so most withdrawals leave it as it is.
+# It is also rebuilt when a cassette crosses a scarcity level, or when notes
+# come back that plans could not count on before.
+#
+# The counts live only in memory; atm_ledger.Ledger.dispenser() builds one from
+# the counts stored for a terminal, and the ledger takes the notes out of
+# storage along with each withdrawal.
+class Dispenser:
+    def __init__(self, counts=None, max_amount=MAX_WITHDRAWAL, capacity=None):
+        counts = dict(DEFAULT_CASSETTES if counts is None else counts)
+        capacity = counts if capacity is None else capacity
+        self.denominations = tuple(sorted(counts, reverse=True))
+        self.max_amount = max_amount
+        self.unit = reduce(math.gcd, self.denominations)
+        self.counts = [counts[d] for d in self.denominations]
+        self.capacity = [max(1, capacity[d]) for d in self.denominations]
+        self._lock = threading.Lock()
+        self.rebuilds = 0
+        self._levels = self._needs = self._usable = []
+        self._refresh()
+
+    # Notes left per denomination
+    def remaining(self):
+        with self._lock:
+            return dict(zip(self.denominations, self.counts))
+
+    # Cash left, in dollars
+    def total(self):
+        with self._lock:
+            return sum(d * count for d, count in zip(self.denominations, self.counts))
+
+    # Notes that would pay out an amount, as {denomination: count}, without taking them
+    def plan(self, amount):
+        with self._lock:
+            return self._notes(self._index(amount))
+
+    # Take the notes for an amount out of the cassettes; returns {denomination: count}
+    def take(self, amount):
+        with self._lock:
+            index = self._index(amount)
+            notes = self._notes(index)
+            for i, count in enumerate(self._plans[index]):
+                self.counts[i] -= count
+            self._refresh()
+            return notes
+
+    # Return notes that were taken but not paid out (the withdrawal was refused)
+    def put_back(self, notes):
+        with self._lock:
+            for i, d in enumerate(self.denominations):
+                self.counts[i] += notes.get(d, 0)
+            self._refresh()
+
+    # Refill cassettes, {denomination: count}; each new count is that cassette's
+    # capacity for the scarcity levels
+    def load(self, counts):
+        with self._lock:
+            for denomination, count in counts.items():
+                i = self.denominations.index(denomination)
+                self.counts[i] = count
+                self.capacity[i] = max(1, count)
+            self._refresh()
+
+    def _notes(self, index):
+        return {d: count for d, count in zip(self.denominations, self._plans[index]) if count}
+
+    # Position of an amount in the plan table; raises if it cannot be paid out
+    def _index(self, amount):
+        cents = int(round(float(amount) * 100))
+        if cents <= 0:
+            raise ValueError("Withdrawal amount must be greater than $0.")
+        if cents > self.max_amount * 100:
+            raise CashUnavailable(f"The most this ATM can pay out at once is ${self.max_amount}.")
+        if cents % (self.unit * 100):
+            raise CashUnavailable(f"This ATM can only pay out multiples of ${self.unit}.")
+        index = cents // (self.unit * 100)
+        if self._plans[index] is None:
+            raise CashUnavailable(f"This ATM cannot pay out ${cents // 100} with the notes it has left.")
+        return index
+
+    def _level(self, i):
+        return min(len(SCARCITY_PENALTY) - 1,
+                   int(len(SCARCITY_PENALTY) * (1 - self.counts[i] / self.capacity[i])))
+
+    # Rebuild the table if the cassettes changed in a way that affects any plan
+    def _refresh(self):
+        levels = [self._level(i) for i in range(len(self.counts))]
+        usable = [min(count, self.max_amount // d) for d, count in zip(self.denominations, self.counts)]
+        if (levels != self._levels
+                or any(count < need for count, need in zip(self.counts, self._needs))
+                or any(now > before for now, before in zip(usable, self._usable))):
+            self._plans = self._build(usable, levels)
+            # The most notes of each denomination any plan uses; while every
+            # cassette holds at least that many, every plan can still be paid
+            self._needs = [max(plan[i] for plan in self._plans if plan is not None)
+                           for i in range(len(self.counts))]
+            self._levels, self._usable = levels, usable
+            self.rebuilds += 1
+
+    # Cheapest plan for every multiple of the unit up to max_amount. Each
+    # denomination's usable notes are split into 1, 2, 4, ... bundles and
+    # added as 0/1 items, which keeps the DP to O(amounts * log(notes)).
+    def _build(self, usable, levels):
+        size = self.max_amount // self.unit
+        costs = [0] + [math.inf] * size
+        plans = [(0,) * len(self.denominations)] + [None] * size
+        for i, (d, left, level) in enumerate(zip(self.denominations, usable, levels)):
+            step = d // self.unit
+            note_cost = NOTE_COST + SCARCITY_PENALTY[level]
+            bundle = 1
+            while left > 0:
+                take = min(bundle, left)
+                left -= take
+                bundle *= 2
+                width, cost = take * step, take * note_cost
+                for a in range(size, width - 1, -1):
+                    base = costs[a - width] + cost
+                    if base < costs[a]:
+                        costs[a] = base
+                        plan = plans[a - width]
+                        plans[a] = plan[:i] + (plan[i] + take,) + plan[i + 1:]
+        return plans
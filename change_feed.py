@@ -0,0 +1,214 @@
+import argparse
+import itertools
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import change_log
+import inventory_db
+
+
+# Seconds between a dashboard's polls of the feed
+POLL_INTERVAL = float(os.environ.get("INVENTORY_FEED_POLL_INTERVAL", "0.5"))
+
+# A subscriber records how far it has read at most this often, in seconds; that
+# is the only write polling makes, and what lets read changes be pruned
+ACK_INTERVAL = float(os.environ.get("INVENTORY_FEED_ACK_INTERVAL", "5"))
+
+# Subscribers not heard from for this many seconds stop holding changes back;
+# if they come back they reload everything
+SUBSCRIBER_TIMEOUT = float(os.environ.get("INVENTORY_FEED_SUBSCRIBER_TIMEOUT", "300"))
+
+# Changes older than this many seconds are pruned even if a subscriber has not
+# read them yet; it reloads everything instead
+RETENTION = float(os.environ.get("INVENTORY_FEED_RETENTION", "3600"))
+
+# Seconds between the inventory service's prunes, which keep the feed small
+# while no dashboard is subscribed to prune it
+PRUNE_INTERVAL = float(os.environ.get("INVENTORY_FEED_PRUNE_INTERVAL", "60"))
+
+# More changes than this since the last poll are cheaper to take as a full reload
+MAX_BATCH = 5000
+
+LATEST_SQL = """
+SELECT MAX(IFNULL((SELECT MAX(seq) FROM product_changes), 0), pruned_seq) FROM change_feed_state
+"""
+
+# The prune watermark, then each change after a sequence number (or one row of NULLs if there are none)
+POLL_SQL = """
+SELECT s.pruned_seq, c.seq, c.product_id FROM change_feed_state s
+LEFT JOIN (SELECT seq, product_id FROM product_changes WHERE seq > ? ORDER BY seq LIMIT ?) c
+ORDER BY c.seq
+"""
+
+SUBSCRIBER_SQL = "INSERT OR REPLACE INTO change_feed_subscribers (name, seq, seen_at) VALUES (?, ?, ?)"
+
+_names = itertools.count(1)
+
+
+# Sequence number of the latest change
+def latest_seq(conn=None):
+    if conn is None:
+        with inventory_db.connection() as conn:
+            return conn.execute(LATEST_SQL).fetchone()[0]
+    return conn.execute(LATEST_SQL).fetchone()[0]
+
+
+# Record the product changes made inside the block as one "everything changed"
+# entry rather than one per product, for writes that touch many products.
+# `conn` must be in the write transaction making the changes; the entry is
+# only recorded if the block changed anything.
+@contextmanager
+def bulk_change(conn):
+    conn.execute("UPDATE change_feed_state SET muted = 1")
+    before = conn.total_changes
+    try:
+        yield
+    finally:
+        changed = conn.total_changes != before
+        conn.execute("UPDATE change_feed_state SET muted = 0")
+    if changed:
+        conn.execute("INSERT INTO product_changes (product_id, changed_at) VALUES (NULL, ?)", (time.time(),))
+
+
+# Delete changes every live subscriber has read or older than RETENTION, and
+# forget subscribers that have gone quiet; returns how many changes were
+# deleted. Runs in the caller's write transaction.
+def _prune(conn, now):
+    conn.execute("DELETE FROM change_feed_subscribers WHERE seen_at < ?", (now - SUBSCRIBER_TIMEOUT,))
+    through = conn.execute("SELECT MIN(seq) FROM change_feed_subscribers").fetchone()[0]
+    # Changes are in time order, so this only reads the expired ones
+    kept = conn.execute("SELECT seq FROM product_changes WHERE changed_at >= ? ORDER BY seq LIMIT 1",
+                        (now - RETENTION,)).fetchone()
+    if through is None or kept is None:
+        through = latest_seq(conn)
+    else:
+        through = max(through, kept[0] - 1)
+    if through <= conn.execute("SELECT pruned_seq FROM change_feed_state").fetchone()[0]:
+        return 0
+    deleted = conn.execute("DELETE FROM product_changes WHERE seq <= ?", (through,)).rowcount
+    conn.execute("UPDATE change_feed_state SET pruned_seq = ?", (through,))
+    return deleted
+
+
+def prune():
+    with inventory_db.connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        return _prune(conn, time.time())
+
+
+# Hand changes read from the feed to this process's change_log, so product
+# tables and caches apply them on their next sync like local changes
+def publish(changed):
+    if changed is None or len(changed) > change_log.MAX_ENTRIES // 2:
+        change_log.record_all()
+    else:
+        for product_id in changed:
+            change_log.record(product_id)
+
+
+# One reader of the feed, e.g. a dashboard. Polling is a read of the changes
+# after the last sequence number seen, so it costs an index lookup when
+# nothing has changed. Writers take turns on SQLite's write lock, so changes
+# commit in sequence order and no earlier number can turn up after a later one.
+class Subscriber:
+    def __init__(self, name=None):
+        self.name = name or f"{inventory_db.LOCAL_TERMINAL}:{os.getpid()}:{next(_names)}"
+        self.seq = None  # last sequence number read
+        self._acked_at = 0.0
+        self._lock = threading.Lock()
+
+    # Ids of the products changed since the last poll, or None if everything
+    # must be reloaded: a bulk change, more than MAX_BATCH changes, or changes
+    # pruned before this subscriber read them. The first poll only registers
+    # the subscriber, at the latest change, and returns an empty set.
+    def poll(self):
+        with self._lock:
+            now = time.time()
+            if self.seq is None:
+                self._ack(now, register=True)
+                return set()
+            with inventory_db.connection() as conn:
+                # One statement, so the watermark and the changes come from one snapshot
+                rows = conn.execute(POLL_SQL, (self.seq, MAX_BATCH + 1)).fetchall()
+                pruned = rows[0][0]
+                if self.seq < pruned or len(rows) > MAX_BATCH:
+                    changed = None
+                    self.seq = latest_seq(conn)
+                elif rows[-1][1] is None:
+                    changed = set()
+                else:
+                    changed = {product_id for _, _, product_id in rows}
+                    self.seq = rows[-1][1]
+                    if None in changed:
+                        changed = None
+            if now - self._acked_at >= ACK_INTERVAL:
+                self._ack(now)
+            return changed
+
+    # Stop holding changes back for this subscriber
+    def close(self):
+        with self._lock:
+            with inventory_db.connection() as conn:
+                conn.execute("DELETE FROM change_feed_subscribers WHERE name = ?", (self.name,))
+            self.seq = None
+
+    # Record how far this subscriber has read, and prune what everyone has read
+    def _ack(self, now, register=False):
+        with inventory_db.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if register:
+                self.seq = latest_seq(conn)
+            conn.execute(SUBSCRIBER_SQL, (self.name, self.seq, now))
+            _prune(conn, now)
+        self._acked_at = now
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or follow the product change feed")
+    parser.add_argument("--db", help="database file (defaults to INVENTORY_DB or inventory.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="show the feed position and every subscriber's lag")
+    sub.add_parser("prune", help="delete changes every subscriber has read, and expired ones")
+    sub.add_parser("follow", help="print changed product ids as they arrive")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        inventory_db.configure(path=args.db)
+    inventory_db.setup_schema()
+
+    if args.command == "status":
+        now = time.time()
+        with inventory_db.connection() as conn:
+            latest = latest_seq(conn)
+            held, oldest = conn.execute("SELECT COUNT(*), MIN(changed_at) FROM product_changes").fetchone()
+            subscribers = conn.execute("SELECT name, seq, seen_at FROM change_feed_subscribers "
+                                       "ORDER BY seq").fetchall()
+        age = f", oldest {now - oldest:.0f}s old" if oldest is not None else ""
+        print(f"latest change {latest}, {held} held{age}")
+        for name, seq, seen_at in subscribers:
+            print(f"{name}\t{latest - seq} behind\tseen {now - seen_at:.0f}s ago")
+    elif args.command == "prune":
+        print(f"{prune()} changes removed")
+    else:
+        subscriber = Subscriber()
+        try:
+            while True:
+                changed = subscriber.poll()
+                if changed is None:
+                    print(f"{subscriber.seq}\teverything")
+                elif changed:
+                    print(f"{subscriber.seq}\t" + " ".join(str(product_id) for product_id in sorted(changed)))
+                sys.stdout.flush()
+                time.sleep(POLL_INTERVAL)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            subscriber.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
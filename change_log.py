@@ -0,0 +1,49 @@
+import threading
+from collections import deque
+
+
+# How many recent product changes are kept for views to catch up on
+MAX_ENTRIES = 10000
+
+_lock = threading.Lock()
+_entries = deque(maxlen=MAX_ENTRIES)  # (version, product_id) pairs
+_version = 0
+
+
+# Note that a product was inserted, updated or deleted
+def record(product_id):
+    global _version
+    with _lock:
+        _version += 1
+        _entries.append((_version, int(product_id)))
+        return _version
+
+
+# Note that an unknown set of products changed, so every view must reload
+def record_all():
+    global _version
+    with _lock:
+        _version += 1
+        _entries.clear()
+        return _version
+
+
+# Current change version
+def current_version():
+    return _version
+
+
+# Return (latest version, changed product ids) since `version`, or None if the
+# log no longer reaches back that far and the caller must reload everything
+def changes_since(version):
+    with _lock:
+        if version == _version:
+            return _version, set()
+        if not _entries or _entries[0][0] > version + 1:
+            return None
+        changed = set()
+        for v, product_id in reversed(_entries):
+            if v <= version:
+                break
+            changed.add(product_id)
+        return _version, changed
@@ -0,0 +1,311 @@
+import atexit
+import bisect
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+
+
+# Collect metrics from startup when INVENTORY_METRICS=1
+enabled = os.environ.get("INVENTORY_METRICS", "") not in ("", "0")
+
+# File the metrics are written to when the process exits (.json for JSON,
+# anything else for Prometheus text format)
+METRICS_FILE = os.environ.get("INVENTORY_METRICS_FILE")
+
+# Upper bounds, in seconds, of the latency histogram buckets: 10us doubling up to ~10s
+BUCKETS = tuple(0.00001 * 2 ** i for i in range(21))
+
+_lock = threading.Lock()
+_metrics = {}  # name -> Metric
+_profile_request = None  # (name prefix, path) of the next span to profile
+_active = enabled  # whether spans do anything at all: collecting or a profile is armed
+
+# Last cProfile capture as (span name, .prof path, text summary)
+last_profile = None
+
+
+# Per-thread running totals; a span reads them on entry and exit
+class _Counters(threading.local):
+    queries = 0
+    rows = 0
+    paused = 0.0  # seconds spent inside untimed() blocks
+
+
+_local = _Counters()
+
+
+# Latency histogram plus query and row totals for one named action
+class Metric:
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)  # the last one has no upper bound
+        self.queries = 0
+        self.rows = 0
+
+    def observe(self, seconds, queries, rows):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.queries += queries
+        self.rows += rows
+
+    # Estimated latency below which `fraction` of calls fall (a bucket upper bound)
+    def percentile(self, fraction):
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "queries": self.queries,
+            "rows": self.rows,
+            "buckets": dict(zip([str(bound) for bound in BUCKETS] + ["+Inf"], self.buckets)),
+        }
+
+
+def _record(name, seconds, queries, rows):
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = Metric(name)
+        metric.observe(seconds, queries, rows)
+
+
+def _update_active():
+    global _active
+    _active = enabled or _profile_request is not None
+
+
+# Times a block of work under `name`, counting the SQL statements and rows it
+# causes on this thread. Time spent in untimed() blocks is left out.
+class Span:
+    __slots__ = ("name", "start", "queries", "rows", "paused", "profiler", "profile_path")
+
+    def __init__(self, name):
+        self.name = name
+        self.profiler = None
+
+    def __enter__(self):
+        if _profile_request is not None and self.name.startswith(_profile_request[0]):
+            self._start_profile()
+        counters = _local
+        self.queries = counters.queries
+        self.rows = counters.rows
+        self.paused = counters.paused
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        if self.profiler is not None:
+            self._finish_profile()
+        counters = _local
+        if enabled:
+            _record(self.name, elapsed - (counters.paused - self.paused),
+                    counters.queries - self.queries, counters.rows - self.rows)
+        return False
+
+    # Count rows read or written by this block that the SQL trace cannot see
+    def add_rows(self, count):
+        _local.rows += count
+
+    def _start_profile(self):
+        global _profile_request
+        with _lock:
+            request, _profile_request = _profile_request, None
+            _update_active()
+        if request is None:
+            return  # another thread took it first
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        self.profile_path = request[1]
+
+    def _finish_profile(self):
+        global last_profile
+        self.profiler.disable()
+        path = self.profile_path or f"profile-{self.name}-{time.strftime('%Y%m%d-%H%M%S')}.prof"
+        self.profiler.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(self.profiler, stream=summary).sort_stats("cumulative").print_stats(25)
+        last_profile = (self.name, path, summary.getvalue())
+        self.profiler = None
+
+
+# Stand-in returned while nothing is being collected
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def add_rows(self, count):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+# Leaves the time of a block (such as waiting on a dialog) out of enclosing spans
+class _Untimed:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.paused += time.perf_counter() - self.start
+        return False
+
+
+# Context manager timing a block as `name`
+def span(name):
+    return Span(name) if _active else _NULL_SPAN
+
+
+# Context manager for a block whose time should not count, e.g. a modal dialog
+def untimed():
+    return _Untimed() if _active else _NULL_SPAN
+
+
+# Decorator timing every call of a function as `name` (by default module.function).
+# A list result is counted as rows. Unless INVENTORY_METRICS was set at startup
+# the function is returned untouched, so it costs nothing; spans and the task
+# timings in TaskRunner can still be switched on later.
+def timed(name=None):
+    def decorate(func):
+        if not enabled:
+            return func
+        metric = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _active:
+                return func(*args, **kwargs)
+            with Span(metric):
+                result = func(*args, **kwargs)
+                if isinstance(result, list):
+                    _local.rows += len(result)
+                return result
+        return wrapper
+
+    # Allow both @timed and @timed("name")
+    if callable(name):
+        func, name = name, None
+        return decorate(func)
+    return decorate
+
+
+def _trace(statement):
+    # Statements run by triggers are reported as "-- TRIGGER ..." comments
+    if enabled and not statement.startswith("--"):
+        _local.queries += 1
+
+
+# Count the statements run on a SQLite connection that is about to be used.
+# Nothing is installed while metrics are off, so untraced connections cost nothing.
+def watch(conn):
+    if enabled:
+        conn.set_trace_callback(_trace)
+    return conn
+
+
+def enable():
+    global enabled
+    enabled = True
+    _update_active()
+
+
+def disable():
+    global enabled
+    enabled = False
+    _update_active()
+
+
+# Forget everything collected so far
+def reset():
+    with _lock:
+        _metrics.clear()
+
+
+# Profile the next span whose name starts with `prefix` (by default the next
+# background task) with cProfile, saving the stats to `path`
+def profile_next(prefix="task.", path=None):
+    global _profile_request
+    with _lock:
+        _profile_request = (prefix, path)
+        _update_active()
+
+
+# Collected metrics as a dict of name -> summary, sorted by name
+def snapshot():
+    with _lock:
+        return {name: _metrics[name].to_dict() for name in sorted(_metrics)}
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Collected metrics in the Prometheus text exposition format
+def prometheus_text():
+    lines = [
+        "# HELP inventory_action_seconds Latency of instrumented actions.",
+        "# TYPE inventory_action_seconds histogram",
+    ]
+    with _lock:
+        metrics = [_metrics[name] for name in sorted(_metrics)]
+        for metric in metrics:
+            label = _label(metric.name)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, metric.buckets):
+                cumulative += count
+                lines.append(f'inventory_action_seconds_bucket{{action="{label}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'inventory_action_seconds_bucket{{action="{label}",le="+Inf"}} {metric.count}')
+            lines.append(f'inventory_action_seconds_sum{{action="{label}"}} {metric.total!r}')
+            lines.append(f'inventory_action_seconds_count{{action="{label}"}} {metric.count}')
+        lines += ["# HELP inventory_action_queries_total SQL statements run by instrumented actions.",
+                  "# TYPE inventory_action_queries_total counter"]
+        lines += [f'inventory_action_queries_total{{action="{_label(m.name)}"}} {m.queries}' for m in metrics]
+        lines += ["# HELP inventory_action_rows_total Rows returned by instrumented actions.",
+                  "# TYPE inventory_action_rows_total counter"]
+        lines += [f'inventory_action_rows_total{{action="{_label(m.name)}"}} {m.rows}' for m in metrics]
+    return "\n".join(lines) + "\n"
+
+
+# Write the metrics to `path`: JSON if it ends in .json, Prometheus text otherwise
+def dump(path):
+    if path.endswith(".json"):
+        text = json.dumps(snapshot(), indent=2)
+    else:
+        text = prometheus_text()
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(text)
+    os.replace(temp_path, path)
+    return path
+
+
+if METRICS_FILE:
+    atexit.register(lambda: dump(METRICS_FILE) if _metrics else None)
@@ -0,0 +1,164 @@
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import bcrypt
+
+import instrumentation
+import inventory_db
+from login_throttle import throttle
+
+
+# bcrypt cost factor for new hashes; existing hashes are upgraded on the next login
+BCRYPT_ROUNDS = int(os.environ.get("INVENTORY_BCRYPT_ROUNDS", "12"))
+
+# How long a session stays valid, in seconds
+SESSION_TTL = float(os.environ.get("INVENTORY_SESSION_TTL", str(8 * 60 * 60)))
+
+# Number of verified sessions kept in memory
+SESSION_CACHE_SIZE = 10000
+
+
+# Hash a password with the configured cost factor
+def hash_password(password, rounds=None):
+    with instrumentation.span("bcrypt.hash"):
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds or BCRYPT_ROUNDS))
+
+
+# Cost factor stored in a bcrypt hash ($2b$12$...)
+def hash_rounds(password_hash):
+    if isinstance(password_hash, str):
+        password_hash = password_hash.encode()
+    return int(password_hash.split(b"$")[2])
+
+
+_dummy_hash = None
+
+
+# Hash checked for usernames that do not exist, so they take as long as a wrong
+# password and response times do not reveal which accounts exist
+def dummy_hash():
+    global _dummy_hash
+    if _dummy_hash is None or hash_rounds(_dummy_hash) != BCRYPT_ROUNDS:
+        _dummy_hash = hash_password(secrets.token_urlsafe(16))
+    return _dummy_hash
+
+
+# Check a username and password, upgrading the stored hash if its cost is out of date.
+# Raises LoginThrottled, before any hashing, when the username or terminal has had
+# too many attempts.
+def verify_password(username, password, terminal=None):
+    throttle.check(username, terminal)
+    with inventory_db.connection() as conn:
+        user = conn.execute("SELECT password_hash FROM Users WHERE username = ?", (username,)).fetchone()
+    with instrumentation.span("bcrypt.check"):
+        valid = bcrypt.checkpw(password.encode('utf-8'), user[0] if user else dummy_hash()) and user is not None
+    if not valid:
+        throttle.failed(username, terminal)
+        return False
+    throttle.succeeded(username, terminal)
+
+    if hash_rounds(user[0]) != BCRYPT_ROUNDS:
+        new_hash = hash_password(password)
+        with inventory_db.connection() as conn:
+            # Only replace the hash we checked, in case the password changed meanwhile
+            conn.execute("UPDATE Users SET password_hash = ? WHERE username = ? AND password_hash = ?",
+                         (new_hash, username, user[0]))
+    return True
+
+
+def _token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+# Login sessions: persisted in SQLite (only token hashes are stored) with an
+# in-memory LRU of verified sessions so repeat checks skip both bcrypt and SQL
+class SessionStore:
+    def __init__(self, ttl=None, cache_size=SESSION_CACHE_SIZE):
+        self.ttl = ttl or SESSION_TTL
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # token hash -> (username, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Start a session for a user who has just been verified; returns the token
+    def create(self, username):
+        token = secrets.token_urlsafe(32)
+        token_hash = _token_hash(token)
+        expires_at = time.time() + self.ttl
+        with inventory_db.connection() as conn:
+            conn.execute("INSERT INTO Sessions (token_hash, username, expires_at) VALUES (?, ?, ?)",
+                         (token_hash, username, expires_at))
+        self._remember(token_hash, username, expires_at)
+        return token
+
+    # Username for a live session token, or None
+    def validate(self, token):
+        if not token:
+            return None
+        token_hash = _token_hash(token)
+        now = time.time()
+
+        with self._lock:
+            entry = self._cache.get(token_hash)
+            if entry is not None:
+                if entry[1] > now:
+                    self._cache.move_to_end(token_hash)
+                    self.hits += 1
+                    return entry[0]
+                del self._cache[token_hash]
+            self.misses += 1
+
+        with inventory_db.connection() as conn:
+            row = conn.execute("SELECT username, expires_at FROM Sessions WHERE token_hash = ? AND expires_at > ?",
+                               (token_hash, now)).fetchone()
+        if row is None:
+            return None
+        self._remember(token_hash, *row)
+        return row[0]
+
+    # End a session
+    def revoke(self, token):
+        token_hash = _token_hash(token)
+        with self._lock:
+            self._cache.pop(token_hash, None)
+        with inventory_db.connection() as conn:
+            conn.execute("DELETE FROM Sessions WHERE token_hash = ?", (token_hash,))
+
+    # End every session belonging to a user
+    def revoke_user(self, username):
+        with self._lock:
+            for token_hash in [h for h, (name, _) in self._cache.items() if name == username]:
+                del self._cache[token_hash]
+        with inventory_db.connection() as conn:
+            conn.execute("DELETE FROM Sessions WHERE username = ?", (username,))
+
+    # Delete expired sessions; returns how many were removed
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            for token_hash in [h for h, (_, expires_at) in self._cache.items() if expires_at <= now]:
+                del self._cache[token_hash]
+        with inventory_db.connection() as conn:
+            return conn.execute("DELETE FROM Sessions WHERE expires_at <= ?", (now,)).rowcount
+
+    def _remember(self, token_hash, username, expires_at):
+        with self._lock:
+            self._cache[token_hash] = (username, expires_at)
+            self._cache.move_to_end(token_hash)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+sessions = SessionStore()
+
+
+# Verify a password once and open a session; returns the token, or None if the login failed
+def authenticate(username, password, terminal=None):
+    if not verify_password(username, password, terminal):
+        return None
+    return sessions.create(username)
@@ -0,0 +1,167 @@
+import sqlite3
+
+import barcodes
+import change_log
+import instrumentation
+import inventory_db
+import product_cache
+import stock_movements
+from product_search import PRODUCT_FIELDS
+from inventory_auth import hash_password, verify_password, sessions
+
+
+# Password given to the default admin account when it is first created
+DEFAULT_ADMIN_PASSWORD = "admin123"
+
+
+# Raised when a product changed after it was read for editing
+class ConflictError(ValueError):
+    pass
+
+
+# Create the tables and the default admin account if they do not exist yet.
+# The admin password is only hashed when the account actually has to be created.
+@instrumentation.timed
+def setup_database(admin_username="admin"):
+    inventory_db.setup_schema()
+
+    with inventory_db.connection() as conn:
+        if conn.execute("SELECT 1 FROM Users WHERE username = ?", (admin_username,)).fetchone():
+            return
+    password_hash = hash_password(DEFAULT_ADMIN_PASSWORD)
+    with inventory_db.connection() as conn:
+        conn.execute("INSERT OR IGNORE INTO Users (username, password_hash, role) VALUES (?, ?, 'admin')",
+                     (admin_username, password_hash))
+
+
+# Check a username and password
+@instrumentation.timed
+def login(username, password):
+    return verify_password(username, password)
+
+
+# Create a user account; raises ValueError if the username is taken
+@instrumentation.timed
+def register(username, password):
+    # Hash the password before borrowing a connection
+    password_hash = hash_password(password)
+    try:
+        with inventory_db.connection() as conn:
+            conn.execute("INSERT INTO Users (username, password_hash, role) VALUES (?, ?, 'user')",
+                         (username, password_hash))
+    except sqlite3.IntegrityError:
+        raise ValueError("Username already exists!")
+
+
+# Delete a user account and the products it owns.
+# Their remaining stock is written off first so the movement log stays balanced.
+@instrumentation.timed
+def delete_user_account(username):
+    sessions.revoke_user(username)
+    with inventory_db.connection() as conn:
+        owned = [row[0] for row in conn.execute("""
+        SELECT Products.id FROM Products JOIN Users ON Users.id = Products.owner_id WHERE Users.username = ?
+        """, (username,))]
+        stock_movements.set_quantities(conn, [(product_id, 0) for product_id in owned])
+        conn.executemany("DELETE FROM Products WHERE id = ?", [(product_id,) for product_id in owned])
+        conn.execute("DELETE FROM Users WHERE username = ?", (username,))
+    if owned:
+        change_log.record_all()
+
+
+# Add a product; returns its id, raises ValueError if the name or SKU is taken.
+# The opening stock is recorded as a receipt, and `owner` is the username of the
+# account the product belongs to, if any.
+@instrumentation.timed
+def add_product(name, category, price, quantity, threshold, owner=None, sku=None):
+    sku = barcodes.clean(sku) if sku else None
+    try:
+        with inventory_db.connection() as conn:
+            cursor = conn.execute("""
+            INSERT INTO Products (name, category, price, quantity, low_stock_threshold, owner_id, sku)
+            VALUES (?, ?, ?, 0, ?, (SELECT id FROM Users WHERE username = ?), ?)
+            """, (name, category, price, threshold, owner, sku))
+            if int(quantity):
+                stock_movements.insert_movement(conn, cursor.lastrowid, "receipt",
+                                                stock_movements.to_delta("receipt", quantity))
+    except sqlite3.IntegrityError as e:
+        if "sku" in str(e):
+            raise ValueError("SKU already belongs to another product!")
+        raise ValueError("Product name already exists!")
+    product_id = cursor.lastrowid
+    product_cache.products.put((product_id, name, category, price, quantity, threshold),
+                               change_log.record(product_id))
+    if sku:
+        barcodes.index.put(sku, product_id)
+    return product_id
+
+
+# Fetch one product row, or None if it does not exist
+@instrumentation.timed
+def get_product(product_id):
+    return product_cache.products.get(int(product_id))
+
+
+# Fetch every product row
+@instrumentation.timed
+def get_products():
+    return product_cache.products.all()
+
+
+# Fetch a product row for editing as (row, version), or None if it does not exist
+@instrumentation.timed
+def get_versioned_product(product_id):
+    with inventory_db.connection() as conn:
+        row = conn.execute(f"SELECT {PRODUCT_FIELDS}, version FROM Products WHERE id = ?", (product_id,)).fetchone()
+    return (row[:-1], row[-1]) if row else None
+
+
+# Overwrite a product's details; returns False if it does not exist.
+# A change of quantity is recorded as an adjustment. Passing the version the
+# values were read at makes this a compare-and-swap: ConflictError is raised
+# instead of overwriting someone else's change.
+@instrumentation.timed
+def update_product(product_id, name, category, price, quantity, threshold, version=None):
+    if int(quantity) < 0:
+        raise ValueError("Quantity must not be negative!")
+    try:
+        with inventory_db.connection() as conn:
+            if version is None:
+                cursor = conn.execute("""
+                UPDATE Products SET name = ?, category = ?, price = ?, low_stock_threshold = ?
+                WHERE id = ?
+                """, (name, category, price, threshold, product_id))
+            else:
+                cursor = conn.execute("""
+                UPDATE Products SET name = ?, category = ?, price = ?, low_stock_threshold = ?, version = version + 1
+                WHERE id = ? AND version = ?
+                """, (name, category, price, threshold, product_id, version))
+                if cursor.rowcount == 0 and conn.execute("SELECT 1 FROM Products WHERE id = ?",
+                                                         (product_id,)).fetchone():
+                    raise ConflictError("This product was changed by someone else. Reload it and try again.")
+            if cursor.rowcount:
+                stock_movements.set_quantities(conn, [(product_id, int(quantity))])
+    except sqlite3.IntegrityError:
+        raise ValueError("Product name already exists!")
+    version = change_log.record(product_id)
+    if cursor.rowcount > 0:
+        product_cache.products.put((int(product_id), name, category, price, quantity, threshold), version)
+    return cursor.rowcount > 0
+
+
+# Add (or, with a negative delta, remove) stock in one atomic step
+# (quantity = quantity + delta), so concurrent adjustments never conflict
+@instrumentation.timed
+def adjust_quantity(product_id, delta):
+    stock_movements.adjust(int(product_id), delta)
+
+
+# Delete a product; returns False if it did not exist.
+# Its remaining stock is written off first so the movement log stays balanced.
+@instrumentation.timed
+def delete_product(product_id):
+    with inventory_db.connection() as conn:
+        stock_movements.set_quantities(conn, [(product_id, 0)])
+        cursor = conn.execute("DELETE FROM Products WHERE id = ?", (product_id,))
+    product_cache.products.discard(int(product_id), change_log.record(product_id))
+    return cursor.rowcount > 0
@@ -0,0 +1,548 @@
+import os
+import queue
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import instrumentation
+
+
+# Default database location, overridable with the INVENTORY_DB environment variable
+DB_PATH = os.environ.get("INVENTORY_DB", "inventory.db")
+
+# Name of this terminal, e.g. in login throttling and change feed subscriber names
+LOCAL_TERMINAL = os.environ.get("INVENTORY_TERMINAL") or socket.gethostname()
+
+# Number of long-lived connections kept open per pool
+POOL_SIZE = int(os.environ.get("INVENTORY_DB_POOL_SIZE", "4"))
+
+# Pragmas applied once to every new connection
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",      # ~16 MB page cache
+    "PRAGMA mmap_size = 268435456",    # 256 MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+)
+
+# Size of sqlite3's per-connection prepared statement cache
+STATEMENT_CACHE_SIZE = 256
+
+# Tables shared by both inventory applications
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS Users (
+        id INTEGER PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS Sessions (
+        token_hash TEXT PRIMARY KEY,
+        username TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_sessions_expires ON Sessions(expires_at)",
+    """
+    CREATE TABLE IF NOT EXISTS Products (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL,
+        category TEXT,
+        price REAL NOT NULL,
+        quantity INTEGER NOT NULL,
+        low_stock_threshold INTEGER DEFAULT 10,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    # Every change to a product bumps its row version, whichever path made it;
+    # writers that set the version themselves (compare-and-swap updates) skip this
+    """
+    CREATE TRIGGER IF NOT EXISTS products_version AFTER UPDATE ON Products
+    WHEN new.version = old.version BEGIN
+        UPDATE Products SET version = old.version + 1 WHERE id = new.id;
+    END
+    """,
+    # Indexes behind product search, filtering and sorting
+    "CREATE INDEX IF NOT EXISTS idx_products_category ON Products(IFNULL(category, ''))",
+    "CREATE INDEX IF NOT EXISTS idx_products_quantity ON Products(quantity)",
+    "CREATE INDEX IF NOT EXISTS idx_products_price ON Products(price)",
+    # Partial index holding only low-stock products; SQLite keeps it current on every write
+    """
+    CREATE INDEX IF NOT EXISTS idx_products_low_stock ON Products(quantity, id)
+    WHERE quantity <= low_stock_threshold
+    """,
+    # Full-text index over product names and categories, kept in sync by triggers
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, category, content='Products', content_rowid='id'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON Products BEGIN
+        INSERT INTO products_fts(rowid, name, category) VALUES (new.id, new.name, new.category);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON Products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, category)
+        VALUES ('delete', old.id, old.name, old.category);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, category ON Products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, category)
+        VALUES ('delete', old.id, old.name, old.category);
+        INSERT INTO products_fts(rowid, name, category) VALUES (new.id, new.name, new.category);
+    END
+    """,
+    # Append-only stock history; every movement adjusts Products.quantity
+    """
+    CREATE TABLE IF NOT EXISTS stock_movements (
+        id INTEGER PRIMARY KEY,
+        product_id INTEGER NOT NULL,
+        kind TEXT NOT NULL CHECK (kind IN ('receipt', 'sale', 'adjustment')),
+        delta INTEGER NOT NULL CHECK ((kind = 'receipt' AND delta > 0) OR (kind = 'sale' AND delta < 0)
+                                      OR (kind = 'adjustment' AND delta != 0)),
+        created_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_stock_movements_product ON stock_movements(product_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_stock_movements_time ON stock_movements(created_at)",
+    """
+    CREATE TRIGGER IF NOT EXISTS stock_movements_check BEFORE INSERT ON stock_movements BEGIN
+        SELECT RAISE(ABORT, 'unknown product')
+        WHERE NOT EXISTS (SELECT 1 FROM Products WHERE id = new.product_id);
+        SELECT RAISE(ABORT, 'insufficient stock')
+        WHERE (SELECT quantity FROM Products WHERE id = new.product_id) + new.delta < 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stock_movements_apply AFTER INSERT ON stock_movements BEGIN
+        UPDATE Products SET quantity = quantity + new.delta WHERE id = new.product_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stock_movements_no_update BEFORE UPDATE ON stock_movements BEGIN
+        SELECT RAISE(ABORT, 'stock_movements is append-only');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stock_movements_no_delete BEFORE DELETE ON stock_movements BEGIN
+        SELECT RAISE(ABORT, 'stock_movements is append-only');
+    END
+    """,
+    # Compressed stock levels as of a movement id, so rebuilds only replay the tail
+    """
+    CREATE TABLE IF NOT EXISTS stock_snapshots (
+        id INTEGER PRIMARY KEY,
+        movement_id INTEGER UNIQUE NOT NULL,
+        created_at REAL NOT NULL,
+        products INTEGER NOT NULL,
+        data BLOB NOT NULL
+    )
+    """,
+)
+
+
+# Bounded, thread-safe pool of long-lived SQLite connections
+class ConnectionPool:
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, timeout=30.0):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+    # Open a new connection and apply the tuning pragmas
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    # Take a connection from the pool, opening one if the pool is not yet full
+    def acquire(self):
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Timed out waiting for a database connection")
+
+    # Give a connection back to the pool
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put_nowait(conn)
+
+    # Borrow a connection; commits on success and rolls back on error
+    @contextmanager
+    def connection(self):
+        conn = instrumentation.watch(self.acquire())
+        try:
+            with conn:
+                yield conn
+        finally:
+            self.release(conn)
+
+    # Close every idle connection and refuse further use
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# Point the shared pool at a different database file or size
+def configure(path=None, size=None):
+    global _pool, DB_PATH, POOL_SIZE
+    with _pool_lock:
+        if path is not None:
+            DB_PATH = path
+        if size is not None:
+            POOL_SIZE = size
+        if _pool is not None:
+            _pool.close()
+        _pool = None
+
+
+# Return the shared connection pool, creating it on first use
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH, POOL_SIZE)
+    return _pool
+
+
+# Borrow a connection from the shared pool
+def connection():
+    return get_pool().connection()
+
+
+def _has_table(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is not None
+
+
+def _add_column(conn, table, column, declaration):
+    if column not in [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+# Migration 1: the tables in SCHEMA. Databases created before migrations were
+# tracked already hold some of them, so every step here is safe to repeat.
+def _baseline(conn):
+    has_fts = _has_table(conn, "products_fts")
+    has_snapshots = _has_table(conn, "stock_snapshots")
+    if _has_table(conn, "Products"):
+        _add_column(conn, "Products", "version", "INTEGER NOT NULL DEFAULT 0")
+    for statement in SCHEMA:
+        conn.execute(statement)
+    # Index products that existed before the full-text table was added
+    if not has_fts:
+        conn.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+    # Record the stock held before movements were tracked as the starting snapshot
+    if not has_snapshots:
+        import stock_movements
+        stock_movements.save_snapshot(conn, 0, conn.execute(
+            "SELECT id, quantity FROM Products WHERE quantity != 0 ORDER BY id").fetchall())
+
+
+# Migration 2: user roles, and which user owns each product
+def _roles_and_owners(conn):
+    if "role" not in [row[1] for row in conn.execute("PRAGMA table_info(Users)")]:
+        conn.execute("ALTER TABLE Users ADD COLUMN role TEXT NOT NULL DEFAULT 'user'")
+        # The applications seed their admin account before anyone can register
+        conn.execute("UPDATE Users SET role = 'admin' WHERE id = (SELECT MIN(id) FROM Users)")
+    _add_column(conn, "Products", "owner_id", "INTEGER REFERENCES Users(id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_owner ON Products(owner_id)")
+
+
+# Migration 3: how far each write-behind journal has been applied
+def _write_behind_state(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS write_behind_state (
+        journal TEXT PRIMARY KEY,
+        applied_seq INTEGER NOT NULL
+    )
+    """)
+
+
+# Tables and triggers for stock held per warehouse location
+LOCATION_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS locations (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL
+    )
+    """,
+    "INSERT OR IGNORE INTO locations (id, name) VALUES (1, 'Main')",
+    # Keyed by location first, so a location's stock is one range scan in product order
+    """
+    CREATE TABLE IF NOT EXISTS product_stock (
+        location_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL CHECK (quantity > 0),
+        PRIMARY KEY (location_id, product_id)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_product_stock_product ON product_stock(product_id)",
+    "CREATE INDEX IF NOT EXISTS idx_product_stock_quantity ON product_stock(location_id, quantity)",
+    # Two-sided moves between locations; each side is an adjustment in the movement log
+    """
+    CREATE TABLE IF NOT EXISTS transfers (
+        id INTEGER PRIMARY KEY,
+        product_id INTEGER NOT NULL,
+        from_location INTEGER NOT NULL,
+        to_location INTEGER NOT NULL,
+        quantity INTEGER NOT NULL CHECK (quantity > 0),
+        out_movement INTEGER NOT NULL,
+        in_movement INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_transfers_product ON transfers(product_id, id)",
+    "DROP TRIGGER IF EXISTS stock_movements_check",
+    "DROP TRIGGER IF EXISTS stock_movements_apply",
+    """
+    CREATE TRIGGER stock_movements_check BEFORE INSERT ON stock_movements BEGIN
+        SELECT RAISE(ABORT, 'unknown product')
+        WHERE NOT EXISTS (SELECT 1 FROM Products WHERE id = new.product_id);
+        SELECT RAISE(ABORT, 'unknown location')
+        WHERE NOT EXISTS (SELECT 1 FROM locations WHERE id = new.location_id);
+        SELECT RAISE(ABORT, 'insufficient stock')
+        WHERE IFNULL((SELECT quantity FROM product_stock
+                      WHERE location_id = new.location_id AND product_id = new.product_id), 0) + new.delta < 0;
+    END
+    """,
+    # The location's stock and the product total move together, in the same statement
+    """
+    CREATE TRIGGER stock_movements_apply AFTER INSERT ON stock_movements BEGIN
+        INSERT INTO product_stock (location_id, product_id, quantity)
+        SELECT new.location_id, new.product_id, new.delta WHERE new.delta > 0
+        ON CONFLICT (location_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity;
+        DELETE FROM product_stock
+        WHERE new.delta < 0 AND location_id = new.location_id AND product_id = new.product_id
+          AND quantity + new.delta = 0;
+        UPDATE product_stock SET quantity = quantity + new.delta
+        WHERE new.delta < 0 AND location_id = new.location_id AND product_id = new.product_id;
+        UPDATE Products SET quantity = quantity + new.delta WHERE id = new.product_id;
+    END
+    """,
+    # Products written with a quantity directly (bulk loads, generators) hold it at the default location
+    """
+    CREATE TRIGGER IF NOT EXISTS products_opening_stock AFTER INSERT ON Products
+    WHEN new.quantity > 0 BEGIN
+        INSERT INTO product_stock (location_id, product_id, quantity) VALUES (1, new.id, new.quantity);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_stock_delete AFTER DELETE ON Products BEGIN
+        DELETE FROM product_stock WHERE product_id = old.id;
+    END
+    """,
+)
+
+
+# Migration 4: warehouse locations with stock held per location. product_stock
+# only has rows for stock actually held, so it stays small however many
+# locations there are; Products.quantity remains the total over all locations.
+def _locations(conn):
+    _add_column(conn, "stock_movements", "location_id", "INTEGER NOT NULL DEFAULT 1")
+    has_stock = _has_table(conn, "product_stock")
+    for statement in LOCATION_SCHEMA:
+        conn.execute(statement)
+    # Until now every product's stock was in the one place
+    if not has_stock:
+        conn.execute("INSERT INTO product_stock (location_id, product_id, quantity) "
+                     "SELECT 1, id, quantity FROM Products WHERE quantity > 0")
+
+
+# Migration 5: an optional SKU / barcode per product, unique when set
+def _skus(conn):
+    _add_column(conn, "Products", "sku", "TEXT")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_sku ON Products(sku)")
+
+
+# Migration 6: login throttling state, so lockouts survive a restart
+def _login_throttle(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS login_throttle (
+        key TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        refilled_at REAL NOT NULL,
+        failures INTEGER NOT NULL,
+        failed_at REAL NOT NULL,
+        blocked_until REAL NOT NULL
+    ) WITHOUT ROWID
+    """)
+
+
+# Migration 7: bulk price and stock edits, with what is needed to undo the latest one
+def _bulk_operations(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS bulk_operations (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL CHECK (kind IN ('price', 'stock', 'delete')),
+        description TEXT NOT NULL,
+        products INTEGER NOT NULL,
+        params TEXT NOT NULL,
+        data BLOB,
+        created_at REAL NOT NULL,
+        undone_at REAL
+    )
+    """)
+
+
+# Migration 8: a change feed other processes can follow. Triggers append the id
+# of every inserted, updated or deleted product to product_changes, whose
+# sequence numbers only ever grow (AUTOINCREMENT never reuses one). A NULL
+# product id means every product may have changed. Writers that change many
+# products at once set change_feed_state.muted inside their transaction and
+# record that single entry instead of one per row.
+def _change_feed(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS product_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER,
+        changed_at REAL NOT NULL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS change_feed_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        muted INTEGER NOT NULL,
+        pruned_seq INTEGER NOT NULL
+    )
+    """)
+    conn.execute("INSERT OR IGNORE INTO change_feed_state (id, muted, pruned_seq) VALUES (1, 0, 0)")
+    # Where each subscriber has read up to, so pruning keeps what it has not read yet
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS change_feed_subscribers (
+        name TEXT PRIMARY KEY,
+        seq INTEGER NOT NULL,
+        seen_at REAL NOT NULL
+    ) WITHOUT ROWID
+    """)
+    now = "(julianday('now') - 2440587.5) * 86400.0"
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS product_changes_insert AFTER INSERT ON Products
+    WHEN (SELECT muted FROM change_feed_state) = 0 BEGIN
+        INSERT INTO product_changes (product_id, changed_at) VALUES (new.id, {now});
+    END
+    """)
+    # Every update ends with the statement that bumps the row version (the
+    # writer's own, or products_version's), so each one is recorded once
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS product_changes_update AFTER UPDATE ON Products
+    WHEN new.version != old.version AND (SELECT muted FROM change_feed_state) = 0 BEGIN
+        INSERT INTO product_changes (product_id, changed_at) VALUES (new.id, {now});
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS product_changes_delete AFTER DELETE ON Products
+    WHEN (SELECT muted FROM change_feed_state) = 0 BEGIN
+        INSERT INTO product_changes (product_id, changed_at) VALUES (old.id, {now});
+    END
+    """)
+
+
+# Schema changes in the order they are applied: (version, description, function).
+# Add new ones at the end; never edit one that has shipped.
+MIGRATIONS = (
+    (1, "baseline schema", _baseline),
+    (2, "user roles and product owners", _roles_and_owners),
+    (3, "write-behind journal positions", _write_behind_state),
+    (4, "warehouse locations and per-location stock", _locations),
+    (5, "product SKUs", _skus),
+    (6, "login throttling", _login_throttle),
+    (7, "bulk operations", _bulk_operations),
+    (8, "product change feed", _change_feed),
+)
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+_migrated = set()  # database paths already brought up to SCHEMA_VERSION by this process
+
+
+# Version recorded in the database, or 0 if it predates migrations
+def schema_version(conn):
+    try:
+        row = conn.execute("SELECT version FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+# Apply pending migrations; returns the versions applied. BEGIN IMMEDIATE makes
+# processes starting together take turns, and each re-checks the version once
+# it holds the lock.
+def migrate(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+        """)
+        current = schema_version(conn)
+        applied = []
+        for version, description, apply in MIGRATIONS:
+            if version > current:
+                apply(conn)
+                applied.append(version)
+        if applied:
+            conn.execute("INSERT OR REPLACE INTO schema_version (id, version) VALUES (1, ?)", (applied[-1],))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return applied
+
+
+# Bring the database schema up to date. Once it is, startup costs a single
+# integer lookup (and nothing at all on later calls in the same process).
+def setup_schema():
+    if DB_PATH in _migrated:
+        return []
+    with connection() as conn:
+        applied = migrate(conn) if schema_version(conn) < SCHEMA_VERSION else []
+    _migrated.add(DB_PATH)
+    return applied
@@ -0,0 +1,575 @@
+import argparse
+import asyncio
+import json
+import re
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import barcodes
+import bulk_edit
+import bulk_io
+import change_feed
+import inventory_auth
+import inventory_data
+import inventory_db
+import locations
+import login_throttle
+import low_stock
+import product_search
+import stock_movements
+
+
+FIELDS = ("id", "name", "category", "price", "quantity", "low_stock_threshold")
+
+# Largest request body accepted, in bytes
+MAX_BODY = 64 * 1024 * 1024
+
+# Most rows a listing returns per request
+MAX_LIMIT = 1000
+
+# Query parameters accepted by the product search endpoint, and how to parse each
+SEARCH_PARAMS = {
+    "text": str,
+    "name_prefix": str,
+    "name_contains": str,
+    "category": str,
+    "min_price": float,
+    "max_price": float,
+    "min_quantity": int,
+    "max_quantity": int,
+    "location": int,
+    "sku": str,
+}
+
+# Header key under which handlers find the client's address; a client cannot
+# send it, since parsed header names never contain a colon
+PEER = ":peer"
+
+ROUTES = []
+
+
+# Raised by handlers to send an error response
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# Register a handler for a method and path pattern. Routes that change data
+# (every method but GET, unless session=False) need a valid bearer token.
+def route(method, pattern, session=None):
+    def register(handler):
+        ROUTES.append((method, re.compile(pattern + "$"), handler, method != "GET" if session is None else session))
+        return handler
+    return register
+
+
+# Run a handler, first checking the bearer token if its route needs a session
+def call(handler, needs_session, match, query, body, headers):
+    if needs_session and inventory_auth.sessions.validate(bearer_token(headers)) is None:
+        raise HTTPError(HTTPStatus.UNAUTHORIZED, "Invalid or expired session")
+    return handler(match, query, body, headers)
+
+
+def product_json(row):
+    return dict(zip(FIELDS, row))
+
+
+# Current product with its row version, for clients that edit with compare-and-swap
+def versioned_product_json(product_id):
+    product = inventory_data.get_versioned_product(product_id)
+    if product is None:
+        raise HTTPError(HTTPStatus.NOT_FOUND, "Product not found")
+    row, version = product
+    return dict(product_json(row), version=version)
+
+
+def parse_json(body):
+    try:
+        return json.loads(body or b"null")
+    except ValueError as e:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"Invalid JSON: {e}")
+
+
+# Read the product fields from a request body
+def product_fields(body):
+    try:
+        return bulk_io.to_row(parse_json(body))
+    except (TypeError, ValueError) as e:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+
+
+def parse_bool(value):
+    return value.lower() in ("1", "true", "yes")
+
+
+# The ?limit= of a listing; anything but a whole number from 1 to MAX_LIMIT is a
+# bad request, since SQLite would take a negative LIMIT as no limit at all
+def parse_limit(query, default):
+    try:
+        limit = int(query.get("limit", default))
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "limit must be a whole number")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"limit must be between 1 and {MAX_LIMIT}")
+    return limit
+
+
+@route("GET", r"/health")
+def health(match, query, body, headers):
+    return HTTPStatus.OK, {"status": "ok"}
+
+
+# Verify a password once and hand back a session token for later requests.
+# Attempts are throttled per username and per client address.
+@route("POST", r"/login", session=False)
+def login(match, query, body, headers):
+    credentials = parse_json(body)
+    if not isinstance(credentials, dict):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Expected username and password")
+    try:
+        token = inventory_auth.authenticate(str(credentials.get("username", "")),
+                                            str(credentials.get("password", "")), headers.get(PEER))
+    except login_throttle.LoginThrottled as e:
+        raise HTTPError(HTTPStatus.TOO_MANY_REQUESTS, str(e))
+    if token is None:
+        raise HTTPError(HTTPStatus.UNAUTHORIZED, "Invalid username or password")
+    return HTTPStatus.OK, {"token": token}
+
+
+def bearer_token(headers):
+    scheme, _, token = headers.get("authorization", "").partition(" ")
+    return token if scheme.lower() == "bearer" else None
+
+
+@route("POST", r"/logout", session=False)
+def logout(match, query, body, headers):
+    token = bearer_token(headers)
+    if token:
+        inventory_auth.sessions.revoke(token)
+    return HTTPStatus.NO_CONTENT, None
+
+
+# Who the bearer token belongs to
+@route("GET", r"/session")
+def session(match, query, body, headers):
+    username = inventory_auth.sessions.validate(bearer_token(headers))
+    if username is None:
+        raise HTTPError(HTTPStatus.UNAUTHORIZED, "Invalid or expired session")
+    return HTTPStatus.OK, {"username": username}
+
+
+@route("GET", r"/products")
+def list_products(match, query, body, headers):
+    try:
+        filters = {name: parse(query[name]) for name, parse in SEARCH_PARAMS.items() if name in query}
+        order_by = query.get("order_by", "id")
+        descending = parse_bool(query.get("descending", "false"))
+        limit = parse_limit(query, 100)
+        filters["low_stock_only"] = parse_bool(query.get("low_stock_only", "false"))
+        after = None
+        if "after_id" in query:
+            after_id = int(query["after_id"])
+            after_value = query.get("after_value", after_id)
+            if order_by not in ("name", "category"):
+                after_value = float(after_value)
+            after = (after_value, after_id)
+        rows = product_search.search_products(order_by, descending, after=after, limit=limit, **filters)
+    except ValueError as e:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+
+    result = {"products": [product_json(row) for row in rows]}
+    if len(rows) == limit:
+        value, product_id = product_search.sort_key(rows[-1], order_by)
+        result["next"] = {"after_value": value, "after_id": product_id}
+    return HTTPStatus.OK, result
+
+
+@route("GET", r"/products/low-stock")
+def list_low_stock(match, query, body, headers):
+    limit = parse_limit(query, None) if "limit" in query else None
+    rows = low_stock.get_low_stock(limit, query.get("category"))
+    return HTTPStatus.OK, {"products": [product_json(row) for row in rows]}
+
+
+@route("GET", r"/products/export")
+def export_products(match, query, body, headers):
+    return HTTPStatus.OK, stream_products()
+
+
+@route("GET", r"/products/(\d+)")
+def get_product(match, query, body, headers):
+    return HTTPStatus.OK, versioned_product_json(int(match.group(1)))
+
+
+# Create a product, owned by the signed-in user
+@route("POST", r"/products")
+def create_product(match, query, body, headers):
+    owner = inventory_auth.sessions.validate(bearer_token(headers))
+    try:
+        product_id = inventory_data.add_product(*product_fields(body), owner=owner,
+                                                sku=parse_json(body).get("sku"))
+    except ValueError as e:
+        raise HTTPError(HTTPStatus.CONFLICT, str(e))
+    return HTTPStatus.CREATED, versioned_product_json(product_id)
+
+
+# Replace a product's details; with "version" in the body the update only applies
+# if the product has not changed since that version was read (409 otherwise)
+@route("PUT", r"/products/(\d+)")
+def update_product(match, query, body, headers):
+    product_id = int(match.group(1))
+    fields = product_fields(body)
+    version = parse_json(body).get("version")
+    try:
+        found = inventory_data.update_product(product_id, *fields, version=version)
+    except ValueError as e:
+        raise HTTPError(HTTPStatus.CONFLICT, str(e))
+    if not found:
+        raise HTTPError(HTTPStatus.NOT_FOUND, "Product not found")
+    return HTTPStatus.OK, versioned_product_json(product_id)
+
+
+@route("DELETE", r"/products/(\d+)")
+def delete_product(match, query, body, headers):
+    if not inventory_data.delete_product(int(match.group(1))):
+        raise HTTPError(HTTPStatus.NOT_FOUND, "Product not found")
+    return HTTPStatus.NO_CONTENT, None
+
+
+MOVEMENT_FIELDS = ("id", "kind", "delta", "created_at")
+
+
+# Record a receipt, sale or adjustment: {"kind": "sale", "quantity": 3}, and
+# optionally "location" (the default location otherwise)
+@route("POST", r"/products/(\d+)/movements")
+def create_movement(match, query, body, headers):
+    product_id = int(match.group(1))
+    movement = parse_json(body)
+    if not isinstance(movement, dict):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Expected kind and quantity")
+    try:
+        movement_id = stock_movements.record_movement(product_id, movement.get("kind"), movement.get("quantity"),
+                                                      movement.get("location", stock_movements.DEFAULT_LOCATION))
+    except (TypeError, ValueError) as e:
+        status = HTTPStatus.NOT_FOUND if str(e) in ("Product not found!", "Location not found!") \
+            else HTTPStatus.BAD_REQUEST
+        raise HTTPError(status, str(e))
+    return HTTPStatus.CREATED, {"id": movement_id, "product": product_json(inventory_data.get_product(product_id))}
+
+
+@route("GET", r"/products/(\d+)/movements")
+def list_movements(match, query, body, headers):
+    rows = stock_movements.history(int(match.group(1)), parse_limit(query, 100))
+    return HTTPStatus.OK, {"movements": [dict(zip(MOVEMENT_FIELDS, row)) for row in rows]}
+
+
+# Stock of a product rebuilt from the movement log, optionally as of a date or Unix time
+@route("GET", r"/products/(\d+)/stock")
+def get_stock(match, query, body, headers):
+    try:
+        when = stock_movements.parse_when(query["as_of"]) if "as_of" in query else None
+    except ValueError as e:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+    product_id = int(match.group(1))
+    return HTTPStatus.OK, {"id": product_id, "quantity": stock_movements.product_stock(product_id, when)}
+
+
+@route("GET", r"/products/sku/([^/]+)")
+def get_product_by_sku(match, query, body, headers):
+    row = barcodes.find(unquote(match.group(1)))
+    if row is None:
+        raise HTTPError(HTTPStatus.NOT_FOUND, "Unknown SKU")
+    return HTTPStatus.OK, product_json(row)
+
+
+# Record a point-of-sale scan: {"sku": "4006381333931"}, optionally with
+# "quantity", "receive": true to add stock, and "location"
+@route("POST", r"/scans")
+def create_scan(match, query, body, headers):
+    scan = parse_json(body)
+    if not isinstance(scan, dict):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Expected sku")
+    try:
+        product_id = barcodes.scan(scan.get("sku"), scan.get("quantity", 1), bool(scan.get("receive")),
+                                   scan.get("location", stock_movements.DEFAULT_LOCATION))
+    except (TypeError, ValueError) as e:
+        status = HTTPStatus.NOT_FOUND if str(e) == "Unknown SKU!" else HTTPStatus.BAD_REQUEST
+        raise HTTPError(status, str(e))
+    return HTTPStatus.CREATED, {"product": product_json(inventory_data.get_product(product_id))}
+
+
+# Where a product's stock is held
+@route("GET", r"/products/(\d+)/locations")
+def get_product_locations(match, query, body, headers):
+    rows = locations.stock_by_location(int(match.group(1)))
+    return HTTPStatus.OK, {"locations": [{"id": location_id, "name": name, "quantity": quantity}
+                                         for location_id, name, quantity in rows]}
+
+
+@route("GET", r"/locations")
+def list_locations(match, query, body, headers):
+    return HTTPStatus.OK, {"locations": [{"id": location_id, "name": name}
+                                         for location_id, name in locations.list_locations()]}
+
+
+@route("POST", r"/locations")
+def create_location(match, query, body, headers):
+    location = parse_json(body)
+    try:
+        location_id = locations.add_location(location.get("name") if isinstance(location, dict) else None)
+    except ValueError as e:
+        raise HTTPError(HTTPStatus.CONFLICT, str(e))
+    return HTTPStatus.CREATED, {"id": location_id}
+
+
+# Move stock between locations: {"product": 1, "from": 1, "to": 2, "quantity": 5}
+@route("POST", r"/transfers")
+def create_transfer(match, query, body, headers):
+    move = parse_json(body)
+    if not isinstance(move, dict):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Expected product, from, to and quantity")
+    try:
+        transfer_id = locations.transfer(int(move["product"]), int(move["from"]), int(move["to"]),
+                                         move["quantity"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+    return HTTPStatus.CREATED, {"id": transfer_id}
+
+
+BULK_EDIT_FIELDS = ("id", "kind", "description", "products", "created_at", "undone_at")
+
+
+# Change many products in one statement: {"action": "price", "percent": 10},
+# {"action": "price", "amount": -1.5}, {"action": "stock", "delta": 5,
+# "location_id": 2} or {"action": "delete"}, each with optional "filters"
+# (the search parameters of GET /products, plus "low_stock_only")
+@route("POST", r"/products/bulk-edit")
+def create_bulk_edit(match, query, body, headers):
+    edit = parse_json(body)
+    if not isinstance(edit, dict) or not isinstance(edit.get("filters", {}), dict):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "Expected action and filters")
+    given = edit.get("filters", {})
+    try:
+        filters = {name: parse(given[name]) for name, parse in SEARCH_PARAMS.items() if name in given}
+        filters["low_stock_only"] = bool(given.get("low_stock_only"))
+        action = edit.get("action")
+        if action == "price":
+            count = bulk_edit.reprice(edit.get("percent"), edit.get("amount"), **filters)
+        elif action == "stock":
+            count = bulk_edit.adjust_stock(edit.get("delta", 0),
+                                           edit.get("location_id", stock_movements.DEFAULT_LOCATION), **filters)
+        elif action == "delete":
+            count = bulk_edit.delete_products(**filters)
+        else:
+            raise ValueError(f"Unknown action: {action}")
+    except (TypeError, ValueError) as e:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+    return HTTPStatus.OK, {"products": count}
+
+
+@route("GET", r"/products/bulk-edit")
+def list_bulk_edits(match, query, body, headers):
+    rows = bulk_edit.history(parse_limit(query, 20))
+    return HTTPStatus.OK, {"operations": [dict(zip(BULK_EDIT_FIELDS, row)) for row in rows]}
+
+
+# Revert the latest bulk edit; "skipped" lists products changed or deleted
+# since, which are left as they are
+@route("POST", r"/products/bulk-edit/undo")
+def undo_bulk_edit(match, query, body, headers):
+    try:
+        count, skipped = bulk_edit.undo()
+    except ValueError as e:
+        raise HTTPError(HTTPStatus.CONFLICT, str(e))
+    return HTTPStatus.OK, {"products": count, "skipped": skipped}
+
+
+# Upsert many products at once: a JSON array or JSON Lines body
+@route("POST", r"/products/bulk")
+def bulk_upsert(match, query, body, headers):
+    text = body.decode("utf-8")
+    if text.lstrip().startswith("["):
+        records = enumerate(parse_json(body), start=1)
+    else:
+        records = bulk_io.read_records(text.splitlines(), "jsonl")
+    written, rejects = bulk_io.upsert_records(records)
+    return HTTPStatus.OK, {"written": written,
+                           "rejected": [{"line": line, "reason": reason} for line, reason in rejects]}
+
+
+# Yield the Products table as JSON Lines in batches
+def stream_products(batch_size=bulk_io.BATCH_SIZE):
+    with inventory_db.connection() as conn:
+        cursor = conn.execute(f"SELECT {', '.join(FIELDS)} FROM Products ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield "".join(json.dumps(product_json(row)) + "\n" for row in rows).encode("utf-8")
+
+
+# Local HTTP/JSON front end for the inventory data layer. Connections are handled
+# concurrently on the event loop; database work runs on a thread pool that shares
+# the inventory_db connection pool.
+class InventoryService:
+    def __init__(self, host="127.0.0.1", port=8080, workers=None):
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=workers or inventory_db.POOL_SIZE)
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.server
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        # Dashboards prune the change feed as they read, but nothing else would
+        # while none is open; nothing else purges the login throttle at all
+        chores = [asyncio.create_task(self.every(change_feed.PRUNE_INTERVAL, change_feed.prune)),
+                  asyncio.create_task(self.every(login_throttle.PURGE_INTERVAL, inventory_auth.throttle.purge))]
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            for chore in chores:
+                chore.cancel()
+
+    # Run func on the thread pool every `interval` seconds
+    async def every(self, interval, func):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await loop.run_in_executor(self.executor, func)
+            except sqlite3.Error:
+                pass  # e.g. the database is busy; try again next time
+
+    # Find and run the handler for a request on the thread pool
+    async def dispatch(self, method, target, body, headers):
+        url = urlsplit(target)
+        query = dict(parse_qsl(url.query))
+        path_matched = False
+        for route_method, pattern, handler, needs_session in ROUTES:
+            match = pattern.match(url.path)
+            if not match:
+                continue
+            if route_method != method:
+                path_matched = True
+                continue
+            loop = asyncio.get_running_loop()
+            try:
+                return await loop.run_in_executor(self.executor, call, handler, needs_session,
+                                                  match, query, body, headers)
+            except HTTPError as e:
+                return e.status, {"error": e.message}
+            except Exception as e:
+                return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)}
+        if path_matched:
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "Method not allowed"}
+        return HTTPStatus.NOT_FOUND, {"error": "Not found"}
+
+    # Serve HTTP/1.1 requests on one keep-alive connection
+    async def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.respond(writer, HTTPStatus.BAD_REQUEST, {"error": "Bad request line"}, False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if peer:
+                    headers[PEER] = peer[0]
+
+                length = headers.get("content-length", "0")
+                if not (length.isascii() and length.isdigit()):
+                    await self.respond(writer, HTTPStatus.BAD_REQUEST, {"error": "Bad Content-Length"}, False)
+                    break
+                length = int(length)
+                if length > MAX_BODY:
+                    await self.respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "Body too large"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+                status, payload = await self.dispatch(method, target, body, headers)
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        head = f"HTTP/1.1 {status.value} {status.phrase}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        if payload is not None and not isinstance(payload, (dict, list)):
+            # Streamed response: pull each chunk from the generator on the thread pool
+            writer.write((head + "Content-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n").encode())
+            loop = asyncio.get_running_loop()
+            try:
+                while True:
+                    chunk = await loop.run_in_executor(self.executor, next, payload, None)
+                    if chunk is None:
+                        break
+                    writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                    await writer.drain()
+            finally:
+                payload.close()  # Return the pooled connection even if the client went away
+            writer.write(b"0\r\n\r\n")
+        else:
+            data = b"" if payload is None else json.dumps(payload).encode("utf-8")
+            head += f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n"
+            writer.write(head.encode() + data)
+        await writer.drain()
+
+
+async def serve(host, port, workers):
+    service = InventoryService(host, port, workers)
+    await service.start()
+    print(f"Inventory service listening on http://{service.host}:{service.port}", flush=True)
+    await service.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the inventory over HTTP/JSON")
+    parser.add_argument("--db", help="database file (defaults to INVENTORY_DB or inventory.db)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080, help="0 picks a free port")
+    parser.add_argument("--workers", type=int, help="database worker threads (default: pool size)")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        inventory_db.configure(path=args.db)
+    # Routes that change data need a session, so a new database needs the admin account to sign in with
+    inventory_data.setup_database()
+    barcodes.index.warm()  # so the first scans are as fast as the rest
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
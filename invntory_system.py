@@ -1,165 +1,55 @@
-import sqlite3
-import bcrypt
+import barcodes
+import bulk_edit
+import instrumentation
+from inventory_auth import authenticate as open_session, sessions, verify_password
+from inventory_data import (setup_database, register, add_product, update_product, get_versioned_product,
+                            adjust_quantity, delete_product, delete_user_account, ConflictError)
+from inventory_db import LOCAL_TERMINAL
+from metrics_view import MetricsPanel, bind_debug_key
+from product_search import count_products
+from product_table import FeedWatcher, ProductTable, SearchBar
+from reports_view import ReportsView
+from scan_view import ScanWindow
+from stock_movements import DEFAULT_LOCATION
+from task_runner import TaskRunner
 from tkinter import *
 from tkinter import ttk, messagebox
 
 
-# Setup the database and initialize tables
-def setup_database():
-    conn = sqlite3.connect('inventory.db')
-    cursor = conn.cursor()
-
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS Users (
-        id INTEGER PRIMARY KEY,
-        username TEXT UNIQUE NOT NULL,
-        password_hash TEXT NOT NULL
-    )
-    """)
-
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS Products (
-        id INTEGER PRIMARY KEY,
-        name TEXT UNIQUE NOT NULL,
-        category TEXT,
-        price REAL NOT NULL,
-        quantity INTEGER NOT NULL,
-        low_stock_threshold INTEGER DEFAULT 10
-    )
-    """)
-
-    try:
-        password = bcrypt.hashpw("admin123".encode('utf-8'), bcrypt.gensalt())
-        cursor.execute("INSERT INTO Users (username, password_hash) VALUES (?, ?)", ("admin", password))
-    except sqlite3.IntegrityError:
-        pass  # Ignore if admin user already exists
-
-    conn.commit()
-    conn.close()
-
-
-# Call the setup_database function to initialize the database
-setup_database()
-
-
-# Function to authenticate a user
-def login(username, password):
-    conn = sqlite3.connect('inventory.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT password_hash FROM Users WHERE username = ?", (username,))
-    user = cursor.fetchone()
-    conn.close()
-
-    if user and bcrypt.checkpw(password.encode('utf-8'), user[0]):
-        return True
-    return False
-
-
-# Function to register a new user
-def register(username, password):
-    conn = sqlite3.connect('inventory.db')
-    cursor = conn.cursor()
-
-    # Check if the username already exists
-    cursor.execute("SELECT * FROM Users WHERE username = ?", (username,))
-    user = cursor.fetchone()
-
-    if user:
-        print(f"Username '{username}' already exists in the database.")  # Debug print
-        messagebox.showerror("Error", "Username already exists!")
-        conn.close()
-        return
+# Show the message returned by a background task
+def show_success(message):
+    with instrumentation.untimed():  # Time spent reading the dialog is not the app's
+        messagebox.showinfo("Success", message)
 
-    try:
-        # Hash the password before storing it
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        print(f"Hashing password for '{username}' and inserting into the database.")  # Debug print
-        cursor.execute("INSERT INTO Users (username, password_hash, role) VALUES (?, ?, ?)", (username, password_hash, "user"))
-
-        conn.commit()
-        print(f"User '{username}' successfully registered.")  # Debug print
-        messagebox.showinfo("Success", "Registration successful!")
-    except Exception as e:
-        print(f"Error during registration: {e}")  # Debug print
-        messagebox.showerror("Error", f"An error occurred: {e}")
-    finally:
-        conn.close()
-
-
-
-
-# Function to add a new product
-def add_product(name, category, price, quantity, threshold):
-    conn = sqlite3.connect('inventory.db')
-    cursor = conn.cursor()
-    try:
-        cursor.execute("""
-        INSERT INTO Products (name, category, price, quantity, low_stock_threshold)
-        VALUES (?, ?, ?, ?, ?)
-        """, (name, category, price, quantity, threshold))
-        conn.commit()
-        messagebox.showinfo("Success", "Product added successfully!")
-    except sqlite3.IntegrityError:
-        messagebox.showerror("Error", "Product name already exists!")
-    conn.close()
-
-
-# Function to get all products from the database
-def get_products():
-    conn = sqlite3.connect('inventory.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM Products")
-    products = cursor.fetchall()
-    conn.close()
-    return products
-
-
-# Function to update a product's details
-def update_product(product_id, name, category, price, quantity, threshold):
-    conn = sqlite3.connect('inventory.db')
-    cursor = conn.cursor()
-    cursor.execute("""
-    UPDATE Products SET name = ?, category = ?, price = ?, quantity = ?, low_stock_threshold = ?
-    WHERE id = ?
-    """, (name, category, price, quantity, threshold, product_id))
-    conn.commit()
-    conn.close()
-
-
-# Function to delete a product from the inventory
-def delete_product(product_id):
-    conn = sqlite3.connect('inventory.db')
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM Products WHERE id = ?", (product_id,))
-    conn.commit()
-    conn.close()
-
-
-# Function to delete a user account
-def delete_user_account(username):
-    conn = sqlite3.connect('inventory.db')
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM Users WHERE username = ?", (username,))
-    cursor.execute("DELETE FROM Products WHERE id IN (SELECT id FROM Products WHERE owner_id = (SELECT id FROM Users WHERE username = ?))", (username,))
-    conn.commit()
-    conn.close()
-    messagebox.showinfo("Success", "User account and associated products deleted!")
-    
+
+# Show the error raised by a background task
+def show_error(error):
+    with instrumentation.untimed():
+        messagebox.showerror("Error", str(error))
 
 
 # Dashboard view after a successful login
-def show_dashboard(username):
-    # Logout function to redirect the user back to the login GUI
+def show_dashboard(username, token=None):
+    # Logout function: end the session and redirect the user back to the login GUI
+    @instrumentation.timed("ui.logout")
     def logout():
-        dashboard.destroy()
-        login_gui()
+        watcher.stop()
+
+        def done(result=None):
+            runner.shutdown()
+            dashboard.destroy()
+            login_gui()
+
+        if token:
+            runner.submit(sessions.revoke, token, on_done=done, on_error=lambda error: done(),
+                          message="Signing out...")
+        else:
+            done()
 
     # Refresh the table with updated product information
+    @instrumentation.timed("ui.refresh_table")
     def refresh_table():
-        for row in tree.get_children():
-            tree.delete(row)
-        for product in get_products():
-            tree.insert('', 'end', values=product)
+        table.refresh()
 
     # Initialize the dashboard GUI
     dashboard = Tk()
@@ -168,35 +58,77 @@ def show_dashboard(username):
     # Create a menu bar for navigation
     menu_bar = Menu(dashboard)
     product_menu = Menu(menu_bar, tearoff=0)
-    product_menu.add_command(label="Add Product", command=lambda: add_product_gui(username, tree))
-    product_menu.add_command(label="Edit Product", command=lambda: edit_product_gui(username, tree))
-    product_menu.add_command(label="Delete Product", command=lambda: delete_product_gui(username, tree))
+    product_menu.add_command(label="Add Product", command=lambda: add_product_gui(username, table, runner))
+    product_menu.add_command(label="Edit Product", command=lambda: edit_product_gui(username, table, runner))
+    product_menu.add_command(label="Adjust Stock", command=lambda: adjust_stock_gui(username, table, runner))
+    product_menu.add_command(label="Delete Product", command=lambda: delete_product_gui(username, table, runner))
+    product_menu.add_separator()
+    product_menu.add_command(label="Bulk Edit...", command=lambda: bulk_edit_gui(table, runner))
+    product_menu.add_command(label="Undo Bulk Edit", command=lambda: undo_bulk_edit_gui(table, runner))
+    product_menu.add_separator()
+    product_menu.add_command(label="Scan Mode", command=lambda: ScanWindow(dashboard, runner, on_change=table.sync))
     menu_bar.add_cascade(label="Products", menu=product_menu)
+    menu_bar.add_command(label="Performance", command=lambda: MetricsPanel(dashboard))
     menu_bar.add_command(label="Logout", command=logout)
     dashboard.config(menu=menu_bar)
 
-    # Create a table to display products
-    columns = ("ID", "Name", "Category", "Price", "Quantity", "Low Stock Threshold")
-    tree = ttk.Treeview(dashboard, columns=columns, show="headings")
-    for col in columns:
-        tree.heading(col, text=col)
-    tree.pack(fill=BOTH, expand=True)
+    # Products and Reports tabs
+    notebook = ttk.Notebook(dashboard)
+    notebook.pack(fill=BOTH, expand=True)
+    products_tab = Frame(notebook)
+    notebook.add(products_tab, text="Products")
+
+    # Background work, shown in the status bar below; Escape cancels it
+    status = StringVar(dashboard)
+    runner = TaskRunner(dashboard, status_var=status)
+
+    # Create a table to display products, loaded a page at a time
+    table = ProductTable(products_tab, runner)
+    SearchBar(products_tab, table).pack(fill=X, padx=5, pady=5)
+    table.pack(fill=BOTH, expand=True)
     refresh_table()
 
+    Label(dashboard, textvariable=status, anchor="w").pack(fill=X)
+    dashboard.bind("<Escape>", lambda event: runner.cancel_all())
+    bind_debug_key(dashboard)
+    runner.submit(barcodes.index.warm, message="Loading SKUs...")  # Scans stay in memory from the first one
+
+    # Changes made on other dashboards show up without a refresh
+    watcher = FeedWatcher(dashboard, runner, table.sync)
+    watcher.start()
+
+    # Reports are built the first time their tab is opened
+    reports = ReportsView(notebook, runner)
+    notebook.add(reports.frame, text="Reports")
+
+    @instrumentation.timed("ui.tab_changed")
+    def tab_changed(event):
+        if notebook.select() == str(reports.frame) and not reports.category_tree.get_children():
+            reports.refresh()
+
+    notebook.bind("<<NotebookTabChanged>>", tab_changed)
+
     dashboard.mainloop()
 
 
 # Function to handle adding a product
-def add_product_gui(username, tree):
+@instrumentation.timed("ui.add_product_gui")
+def add_product_gui(username, table, runner):
+    def done(product_id):
+        table.sync()
+        show_success("Product added successfully!")
+
+    @instrumentation.timed("ui.add_product_gui.submit")
     def submit():
         name = name_entry.get()
         category = category_entry.get()
         price = float(price_entry.get())
         quantity = int(quantity_entry.get())
         threshold = int(threshold_entry.get())
-        add_product(name, category, price, quantity, threshold)
+        sku = sku_entry.get().strip() or None
+        runner.submit(add_product, name, category, price, quantity, threshold, username, sku,
+                      on_done=done, on_error=show_error, message="Adding product...")
         add_product_window.destroy()
-        show_dashboard(username)
 
     add_product_window = Toplevel()
     add_product_window.title("Add Product")
@@ -220,91 +152,229 @@ def add_product_gui(username, tree):
     Label(add_product_window, text="Low Stock Threshold:").pack(pady=5)
     threshold_entry = Entry(add_product_window, width=50,font= ("Arial",12)) 
     threshold_entry.pack(pady=5)
-    Button(add_product_window, text="Submit", command=submit).pack(pady=10)
 
+    Label(add_product_window, text="SKU / Barcode (optional):").pack(pady=5)
+    sku_entry = Entry(add_product_window, width=50, font=("Arial", 12))
+    sku_entry.pack(pady=5)
+    Button(add_product_window, text="Submit", command=submit).pack(pady=10)
 
-# Function to handle editing a product
-def edit_product_gui(username, tree):
-    def submit():
-        selected_item = tree.selection()
-        product_id = tree.item(selected_item, 'values')[0]
-        name = name_entry.get()
-        category = category_entry.get()
-        price = float(price_entry.get())
-        quantity = int(quantity_entry.get())
-        threshold = int(threshold_entry.get())
-        update_product(product_id, name, category, price, quantity, threshold)
-        edit_product_window.destroy()
-        show_dashboard(username)
 
+# Function to handle editing a product. The form is filled from the product as it
+# is now, and saving only succeeds if nobody has changed it since.
+@instrumentation.timed("ui.edit_product_gui")
+def edit_product_gui(username, table, runner):
+    tree = table.tree
     selected_item = tree.selection()
     if not selected_item:
-        messagebox.showerror("Error", "No product selected!")
+        show_error("No product selected!")
         return
+    product_id = tree.item(selected_item, 'values')[0]
 
-    selected_product = tree.item(selected_item, 'values')
-    product_id = selected_product[0]
-    name, category, price, quantity, threshold = selected_product[1:6]
+    def saved(result):
+        table.sync()
+        if not result:
+            show_error("Product no longer exists!")
 
-    edit_product_window = Toplevel()
-    edit_product_window.title("Edit Product")
+    def failed(error):
+        show_error(error)
+        if isinstance(error, ConflictError):
+            table.sync()  # Show the other change before the user retries
 
-    Label(edit_product_window, text="Product Name:").pack(pady=5)
-    name_entry = Entry(edit_product_window, textvariable=StringVar(edit_product_window, value=name))
-    name_entry.pack(pady=5)
+    def open_form(product):
+        if product is None:
+            table.sync()
+            show_error("Product no longer exists!")
+            return
+        (_, name, category, price, quantity, threshold), version = product
 
-    Label(edit_product_window, text="Category:").pack(pady=5)
-    category_entry = Entry(edit_product_window, textvariable=StringVar(edit_product_window, value=category))
-    category_entry.pack(pady=5)
+        @instrumentation.timed("ui.edit_product_gui.submit")
+        def submit():
+            runner.submit(update_product, product_id, name_entry.get(), category_entry.get(),
+                          float(price_entry.get()), int(quantity_entry.get()), int(threshold_entry.get()), version,
+                          on_done=saved, on_error=failed, message="Saving product...")
+            edit_product_window.destroy()
 
-    Label(edit_product_window, text="Price:").pack(pady=5)
-    price_entry = Entry(edit_product_window, textvariable=StringVar(edit_product_window, value=str(price)))
-    price_entry.pack(pady=5)
+        edit_product_window = Toplevel()
+        edit_product_window.title("Edit Product")
 
-    Label(edit_product_window, text="Quantity:").pack(pady=5)
-    quantity_entry = Entry(edit_product_window, textvariable=StringVar(edit_product_window, value=str(quantity)))
-    quantity_entry.pack(pady=5)
+        Label(edit_product_window, text="Product Name:").pack(pady=5)
+        name_entry = Entry(edit_product_window, textvariable=StringVar(edit_product_window, value=name))
+        name_entry.pack(pady=5)
 
-    Label(edit_product_window, text="Low Stock Threshold:").pack(pady=5)
-    threshold_entry = Entry(edit_product_window, textvariable=StringVar(edit_product_window, value=str(threshold)))
-    threshold_entry.pack(pady=5)
+        Label(edit_product_window, text="Category:").pack(pady=5)
+        category_entry = Entry(edit_product_window, textvariable=StringVar(edit_product_window, value=category or ""))
+        category_entry.pack(pady=5)
+
+        Label(edit_product_window, text="Price:").pack(pady=5)
+        price_entry = Entry(edit_product_window, textvariable=StringVar(edit_product_window, value=str(price)))
+        price_entry.pack(pady=5)
+
+        Label(edit_product_window, text="Quantity:").pack(pady=5)
+        quantity_entry = Entry(edit_product_window, textvariable=StringVar(edit_product_window, value=str(quantity)))
+        quantity_entry.pack(pady=5)
+
+        Label(edit_product_window, text="Low Stock Threshold:").pack(pady=5)
+        threshold_entry = Entry(edit_product_window, textvariable=StringVar(edit_product_window, value=str(threshold)))
+        threshold_entry.pack(pady=5)
+
+        Button(edit_product_window, text="Submit", command=submit).pack(pady=10)
+
+    runner.submit(get_versioned_product, product_id, on_done=open_form, on_error=show_error,
+                  message="Loading product...")
+
+
+# Function to add or remove stock of the selected product without touching its other details
+@instrumentation.timed("ui.adjust_stock_gui")
+def adjust_stock_gui(username, table, runner):
+    tree = table.tree
+    selected_item = tree.selection()
+    if not selected_item:
+        show_error("No product selected!")
+        return
+    product_id, name = tree.item(selected_item, 'values')[:2]
+
+    @instrumentation.timed("ui.adjust_stock_gui.submit")
+    def submit():
+        delta = int(delta_entry.get())
+        runner.submit(adjust_quantity, product_id, delta,
+                      on_done=lambda result: table.sync(), on_error=show_error, message="Adjusting stock...")
+        adjust_window.destroy()
 
-    Button(edit_product_window, text="Submit", command=submit).pack(pady=10)
+    adjust_window = Toplevel()
+    adjust_window.title("Adjust Stock")
+    Label(adjust_window, text=f"Change in stock for {name} (negative to remove):").pack(pady=5)
+    delta_entry = Entry(adjust_window)
+    delta_entry.pack(pady=5)
+    delta_entry.bind("<Return>", lambda event: submit())
+    Button(adjust_window, text="Submit", command=submit).pack(pady=10)
 
 
 # Function to handle deleting a product
-def delete_product_gui(username, tree):
+@instrumentation.timed("ui.delete_product_gui")
+def delete_product_gui(username, table, runner):
+    tree = table.tree
     selected_item = tree.selection()
     if not selected_item:
-        messagebox.showerror("Error", "No product selected!")
+        show_error("No product selected!")
         return
 
     selected_product = tree.item(selected_item, 'values')
     product_id = selected_product[0]
 
-    delete_product(product_id)
-    show_dashboard(username)
+    runner.submit(delete_product, product_id,
+                  on_done=lambda result: table.sync(), on_error=show_error, message="Deleting product...")
+
+
+# Change the price or stock of, or delete, every product matching the current search
+@instrumentation.timed("ui.bulk_edit_gui")
+def bulk_edit_gui(table, runner):
+    filters = dict(table.filters)
+    # Stock changes at the location being viewed, if the table is filtered to one
+    location_id = filters.get("location", DEFAULT_LOCATION)
+    actions = {
+        "Change prices by %": lambda value: bulk_edit.reprice(percent=float(value), **filters),
+        "Change prices by $": lambda value: bulk_edit.reprice(amount=float(value), **filters),
+        f"Change stock at location {location_id} by": lambda value: bulk_edit.adjust_stock(int(value), location_id,
+                                                                                          **filters),
+        "Delete products": lambda value: bulk_edit.delete_products(**filters),
+    }
+
+    def done(count):
+        table.sync()
+        show_success(f"{count} products changed. Products > Undo Bulk Edit reverts this.")
+
+    @instrumentation.timed("ui.bulk_edit_gui.submit")
+    def submit():
+        action = action_var.get()
+        if action == "Delete products":
+            with instrumentation.untimed():
+                if not messagebox.askyesno("Bulk Edit", "Delete every product matching the current search?"):
+                    return
+        value = value_entry.get()
+        runner.submit(actions[action], value, on_done=done, on_error=show_error, message="Applying bulk edit...")
+        bulk_window.destroy()
+
+    bulk_window = Toplevel()
+    bulk_window.title("Bulk Edit")
+    count_var = StringVar(bulk_window, value="Counting matching products...")
+    Label(bulk_window, textvariable=count_var).pack(pady=5)
+    action_var = StringVar(bulk_window, value="Change prices by %")
+    for action in actions:
+        Radiobutton(bulk_window, text=action, variable=action_var, value=action).pack(anchor="w", padx=10)
+    Label(bulk_window, text="By how much (negative to reduce):").pack(pady=5)
+    value_entry = Entry(bulk_window)
+    value_entry.pack(pady=5)
+    value_entry.bind("<Return>", lambda event: submit())
+    Button(bulk_window, text="Apply", command=submit).pack(pady=10)
+
+    runner.submit(lambda: count_products(**filters),
+                  on_done=lambda count: count_var.set(f"Applies to the {count} products matching the current search"),
+                  on_error=show_error, message="Counting products...")
+
+
+# Revert the latest bulk edit, after confirming which one it was
+@instrumentation.timed("ui.undo_bulk_edit_gui")
+def undo_bulk_edit_gui(table, runner):
+    def confirm(operation):
+        if operation is None:
+            show_error("Nothing to undo!")
+            return
+        with instrumentation.untimed():
+            if not messagebox.askyesno("Undo Bulk Edit", f"Undo \"{operation[2]}\" on {operation[3]} products?"):
+                return
+        def done(result):
+            restored, skipped = result
+            table.sync()
+            message = f"{restored} products restored."
+            if skipped:
+                message += (f" {len(skipped)} changed or deleted since were left as they are (ids "
+                            f"{', '.join(map(str, skipped[:10]))}{', ...' if len(skipped) > 10 else ''}).")
+            show_success(message)
+
+        runner.submit(bulk_edit.undo, on_done=done, on_error=show_error, message="Undoing bulk edit...")
+
+    runner.submit(bulk_edit.last_operation, on_done=confirm, on_error=show_error, message="Loading last bulk edit...")
 
 
 # Login/Register GUI
 def login_gui():
+    @instrumentation.timed("ui.authenticate")
     def authenticate():
         username = username_entry.get()
         password = password_entry.get()
-        if login(username, password):
-            login_window.destroy()
-            show_dashboard(username)
-        else:
-            messagebox.showerror("Error", "Invalid username or password!")
 
+        def done(token):
+            if token:
+                runner.shutdown()
+                login_window.destroy()
+                show_dashboard(username, token)
+            else:
+                show_error("Invalid username or password!")
+
+        runner.submit(open_session, username, password, LOCAL_TERMINAL,
+                      on_done=done, on_error=show_error, message="Signing in...")
+
+    @instrumentation.timed("ui.register_user")
     def register_user():
         username = reg_username_entry.get()
         password = reg_password_entry.get()
-        register(username, password)
+        runner.submit(register, username, password, on_done=lambda result: show_success("Registration successful!"),
+                      on_error=show_error, message="Registering...")
 
-    def delete_user_account():
+    @instrumentation.timed("ui.delete_account")
+    def delete_account():
         username = username_entry.get()
-        delete_user_account(username)
+        password = password_entry.get()
+
+        # Only the account's own password may delete it
+        def delete():
+            if not verify_password(username, password, LOCAL_TERMINAL):
+                raise ValueError("Invalid username or password!")
+            delete_user_account(username)
+
+        runner.submit(delete,
+                      on_done=lambda result: show_success("User account and associated products deleted!"),
+                      on_error=show_error, message="Deleting account...")
 
     login_window = Tk()
     login_window.title("Login/Register")
@@ -328,7 +398,7 @@ def login_gui():
     password_entry.pack(pady=5)
 
     Button(login_frame, text="Login", command=authenticate, width=20, font=("Arial", 12)).pack(pady=10)
-    Button(login_frame, text="Delete Account", command=delete_user_account, width=20, font=("Arial", 12)).pack(pady=5)
+    Button(login_frame, text="Delete Account", command=delete_account, width=20, font=("Arial", 12)).pack(pady=5)
 
     Label(register_frame, text="Username", bg="lightblue").pack(pady=10)
     reg_username_entry = Entry(register_frame, width=30, font=("Arial", 14))
@@ -340,9 +410,18 @@ def login_gui():
 
     Button(register_frame, text="Register", command=register_user, width=20, font=("Arial", 12)).pack(pady=10)
 
+    # Status bar showing background work; Escape cancels it
+    status = StringVar(login_window)
+    Label(login_window, textvariable=status, anchor="w").pack(fill=X)
+    runner = TaskRunner(login_window, status_var=status)
+    login_window.bind("<Escape>", lambda event: runner.cancel_all())
+    bind_debug_key(login_window)
+
     login_window.mainloop()
     
 
 
 # Start the application
-login_gui()
+if __name__ == "__main__":
+    setup_database("admin")
+    login_gui()
@@ -0,0 +1,188 @@
+import argparse
+import sqlite3
+import sys
+import time
+
+import change_log
+import inventory_db
+import stock_movements
+from stock_movements import DEFAULT_LOCATION
+
+
+# Add a warehouse location; returns its id, raises ValueError if the name is taken
+def add_location(name):
+    name = str(name or "").strip()
+    if not name:
+        raise ValueError("Location name must not be empty!")
+    try:
+        with inventory_db.connection() as conn:
+            return conn.execute("INSERT INTO locations (name) VALUES (?)", (name,)).lastrowid
+    except sqlite3.IntegrityError:
+        raise ValueError("Location name already exists!")
+
+
+# Remove a location that holds no stock; returns False if it did not exist
+def delete_location(location_id):
+    if int(location_id) == DEFAULT_LOCATION:
+        raise ValueError("The default location cannot be removed!")
+    with inventory_db.connection() as conn:
+        if conn.execute("SELECT 1 FROM product_stock WHERE location_id = ? LIMIT 1", (location_id,)).fetchone():
+            raise ValueError("Location still holds stock!")
+        return conn.execute("DELETE FROM locations WHERE id = ?", (location_id,)).rowcount > 0
+
+
+# Every location as (id, name), in id order
+def list_locations():
+    with inventory_db.connection() as conn:
+        return conn.execute("SELECT id, name FROM locations ORDER BY id").fetchall()
+
+
+# Where a product's stock is held, as (location id, name, quantity)
+def stock_by_location(product_id):
+    with inventory_db.connection() as conn:
+        return conn.execute("""
+        SELECT s.location_id, l.name, s.quantity FROM product_stock s JOIN locations l ON l.id = s.location_id
+        WHERE s.product_id = ? ORDER BY s.location_id
+        """, (product_id,)).fetchall()
+
+
+# Units of a product held at one location
+def location_quantity(product_id, location_id):
+    with inventory_db.connection() as conn:
+        row = conn.execute("SELECT quantity FROM product_stock WHERE location_id = ? AND product_id = ?",
+                           (location_id, product_id)).fetchone()
+    return row[0] if row else 0
+
+
+# Number of products and units held at a location
+def location_totals(location_id):
+    with inventory_db.connection() as conn:
+        return conn.execute("SELECT COUNT(*), IFNULL(SUM(quantity), 0) FROM product_stock WHERE location_id = ?",
+                            (location_id,)).fetchone()
+
+
+def _transfer(conn, product_id, from_location, to_location, quantity, created_at):
+    out_movement = stock_movements.insert_movement(conn, product_id, "adjustment", -quantity, created_at,
+                                                   from_location)
+    in_movement = stock_movements.insert_movement(conn, product_id, "adjustment", quantity, created_at,
+                                                  to_location)
+    return conn.execute("""
+    INSERT INTO transfers (product_id, from_location, to_location, quantity, out_movement, in_movement, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (product_id, from_location, to_location, quantity, out_movement, in_movement, created_at)).lastrowid
+
+
+def _check_transfer(from_location, to_location, quantity):
+    quantity = int(quantity)
+    if quantity <= 0:
+        raise ValueError("Quantity must be positive!")
+    if int(from_location) == int(to_location):
+        raise ValueError("Cannot transfer stock to the location it is already in!")
+    return quantity
+
+
+# Move stock between two locations; returns the transfer id. Both sides are
+# written in one transaction, so stock is never seen missing from one place
+# or counted twice, and the product total does not change.
+def transfer(product_id, from_location, to_location, quantity):
+    quantity = _check_transfer(from_location, to_location, quantity)
+    with inventory_db.connection() as conn:
+        transfer_id = _transfer(conn, product_id, from_location, to_location, quantity, time.time())
+    change_log.record(product_id)
+    stock_movements.maybe_snapshot()
+    return transfer_id
+
+
+# Apply many (product id, from location, to location, quantity) transfers in a
+# single transaction: all of them or, if any fails, none. Returns their ids.
+def transfer_many(moves):
+    moves = [(product_id, from_location, to_location, _check_transfer(from_location, to_location, quantity))
+             for product_id, from_location, to_location, quantity in moves]
+    created_at = time.time()
+    with inventory_db.connection() as conn:
+        ids = [_transfer(conn, *move, created_at) for move in moves]
+    for product_id in {move[0] for move in moves}:
+        change_log.record(product_id)
+    stock_movements.maybe_snapshot()
+    return ids
+
+
+# Most recent transfers of a product, newest first
+def transfer_history(product_id, limit=100):
+    with inventory_db.connection() as conn:
+        return conn.execute("""
+        SELECT id, from_location, to_location, quantity, created_at FROM transfers
+        WHERE product_id = ? ORDER BY id DESC LIMIT ?
+        """, (product_id, limit)).fetchall()
+
+
+# Products whose total disagrees with the sum over their locations, as (id, total, sum)
+def verify():
+    with inventory_db.connection() as conn:
+        return conn.execute("""
+        SELECT p.id, p.quantity, IFNULL(s.held, 0) FROM Products p
+        LEFT JOIN (SELECT product_id, SUM(quantity) AS held FROM product_stock GROUP BY product_id) s
+               ON s.product_id = p.id
+        WHERE p.quantity != IFNULL(s.held, 0)
+        ORDER BY p.id
+        """).fetchall()
+
+
+# Resolve a location given by id or by name
+def find_location(value):
+    with inventory_db.connection() as conn:
+        row = conn.execute("SELECT id FROM locations WHERE id = ? OR name = ?", (value, value)).fetchone()
+    if row is None:
+        raise ValueError("Location not found!")
+    return row[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Warehouse locations and the stock held at each")
+    parser.add_argument("--db", help="database file (defaults to INVENTORY_DB or inventory.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="list locations with the products and units held at each")
+    add = sub.add_parser("add", help="add a location")
+    add.add_argument("name")
+    stock = sub.add_parser("stock", help="show where a product's stock is held")
+    stock.add_argument("product", type=int)
+    move = sub.add_parser("transfer", help="move stock of a product between locations")
+    move.add_argument("product", type=int)
+    move.add_argument("source", help="location id or name")
+    move.add_argument("target", help="location id or name")
+    move.add_argument("quantity", type=int)
+    sub.add_parser("verify", help="check product totals against their per-location stock")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        inventory_db.configure(path=args.db)
+    inventory_db.setup_schema()
+
+    try:
+        if args.command == "list":
+            for location_id, name in list_locations():
+                products, units = location_totals(location_id)
+                print(f"{location_id:>6}  {name:30}  {products:>10} products  {units:>12} units")
+        elif args.command == "add":
+            print(f"added location {add_location(args.name)}")
+        elif args.command == "stock":
+            for location_id, name, quantity in stock_by_location(args.product):
+                print(f"{location_id:>6}  {name:30}  {quantity:>10}")
+        elif args.command == "transfer":
+            transfer_id = transfer(args.product, find_location(args.source), find_location(args.target),
+                                   args.quantity)
+            print(f"transfer {transfer_id} recorded")
+        else:
+            mismatches = verify()
+            for product_id, total, held in mismatches:
+                print(f"product {product_id}: total {total}, held across locations {held}")
+            print(f"{len(mismatches)} mismatched products")
+            return 1 if mismatches else 0
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
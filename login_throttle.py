@@ -0,0 +1,227 @@
+import argparse
+import math
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import inventory_db
+
+
+# Set INVENTORY_LOGIN_THROTTLE=0 to turn throttling off (benchmarks, trusted setups)
+ENABLED = os.environ.get("INVENTORY_LOGIN_THROTTLE", "1") != "0"
+
+
+# Token buckets per kind of key: (burst, attempts refilled per second).
+# A username may try 5 times at once and then once every 10 seconds; a
+# terminal (client address) gets more room, since several people share one.
+LIMITS = {
+    "user": (int(os.environ.get("INVENTORY_LOGIN_USER_BURST", "5")),
+             float(os.environ.get("INVENTORY_LOGIN_USER_RATE", "0.1"))),
+    "terminal": (int(os.environ.get("INVENTORY_LOGIN_TERMINAL_BURST", "20")),
+                 float(os.environ.get("INVENTORY_LOGIN_TERMINAL_RATE", "1"))),
+}
+
+# Consecutive failures allowed before a key is locked out
+FREE_FAILURES = int(os.environ.get("INVENTORY_LOGIN_FREE_FAILURES", "3"))
+
+# The first lockout lasts BACKOFF_BASE seconds and doubles with every further failure, up to BACKOFF_MAX
+BACKOFF_BASE = float(os.environ.get("INVENTORY_LOGIN_BACKOFF_BASE", "1"))
+BACKOFF_MAX = float(os.environ.get("INVENTORY_LOGIN_BACKOFF_MAX", "900"))
+
+# Failures older than this are forgotten
+FAILURE_WINDOW = float(os.environ.get("INVENTORY_LOGIN_FAILURE_WINDOW", str(60 * 60)))
+
+# Seconds between the inventory service's purges of expired entries
+PURGE_INTERVAL = float(os.environ.get("INVENTORY_LOGIN_PURGE_INTERVAL", "600"))
+
+# Keys kept in memory; the least recently used are dropped (their failures are already in SQLite)
+MAX_KEYS = 100_000
+
+# Stored columns, in the order each in-memory entry keeps them
+FIELDS = "tokens, refilled_at, failures, failed_at, blocked_until"
+
+
+# Raised before a password is checked when a username or terminal has had too many attempts
+class LoginThrottled(ValueError):
+    def __init__(self, retry_after):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f"Too many login attempts. Try again in {self.retry_after} "
+                         f"second{'s' if self.retry_after != 1 else ''}.")
+
+
+# Throttle keys for an attempt, terminal first so a flood from one address is
+# turned away before its usernames are even looked at
+def keys(username, terminal):
+    result = [] if terminal is None else [f"terminal:{terminal}"]
+    result.append(f"user:{username}")
+    return result
+
+
+# Per-username and per-terminal login limits. Every attempt takes a token from
+# each of its buckets, and failures lock a key out for exponentially longer
+# periods. check() runs before any password hashing, so rejected attempts cost
+# a dictionary lookup. Failures and lockouts are written to SQLite, so they
+# survive a restart; keys not in memory are loaded from there on first use,
+# outside the lock so one slow read does not hold up every other login.
+class LoginThrottle:
+    def __init__(self, limits=None, enabled=ENABLED, max_keys=MAX_KEYS):
+        self.limits = limits or LIMITS
+        self.enabled = enabled
+        self.max_keys = max_keys
+        self._entries = OrderedDict()  # key -> [tokens, refilled_at, failures, failed_at, blocked_until]
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    # Take one attempt for a username (and terminal); raises LoginThrottled if either
+    # is over its limit. An admitted attempt counts as a failure until succeeded()
+    # says otherwise, so a burst of guesses is cut off before the first is checked.
+    def check(self, username, terminal=None):
+        if not self.enabled:
+            return
+        attempt_keys = keys(username, terminal)
+        with self._lock:
+            missing = [key for key in attempt_keys if key not in self._entries]
+        loaded = self._load(missing) if missing else {}
+        now = time.time()
+        retry_after = 0
+        with self._lock:
+            entries = []
+            for key in attempt_keys:
+                entry = self._entry(key, now, loaded)
+                burst, rate = self.limits[key.partition(":")[0]]
+                entry[0] = min(burst, entry[0] + (now - entry[1]) * rate)
+                entry[1] = now
+                if entry[4] > now:
+                    retry_after = max(retry_after, entry[4] - now)
+                elif entry[0] < 1:
+                    retry_after = max(retry_after, (1 - entry[0]) / rate)
+                entries.append(entry)
+                if retry_after:
+                    # A locked-out terminal is rejected without even loading the username's entry
+                    break
+            if retry_after:
+                self.rejected += 1
+                raise LoginThrottled(retry_after)
+            for entry in entries:
+                entry[0] -= 1
+                if now - entry[3] > FAILURE_WINDOW:
+                    entry[2] = 0
+                entry[2] += 1
+                entry[3] = now
+                if entry[2] > FREE_FAILURES:
+                    entry[4] = now + min(BACKOFF_BASE * 2 ** (entry[2] - FREE_FAILURES - 1), BACKOFF_MAX)
+            self.allowed += 1
+
+    # The password was wrong: store the failure check() counted, so the lockout survives a restart
+    def failed(self, username, terminal=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            rows = [(key, *self._entries[key]) for key in keys(username, terminal) if key in self._entries]
+        with inventory_db.connection() as conn:
+            conn.executemany(f"INSERT OR REPLACE INTO login_throttle (key, {FIELDS}) VALUES (?, ?, ?, ?, ?, ?)",
+                             rows)
+
+    # A successful login clears the failures against its keys; the buckets keep
+    # their level. Only keys with failures stored before this attempt touch SQLite.
+    def succeeded(self, username, terminal=None):
+        if not self.enabled:
+            return
+        cleared = []
+        with self._lock:
+            for key in keys(username, terminal):
+                entry = self._entries.get(key)
+                if entry is not None:
+                    if entry[2] > 1:
+                        cleared.append((key,))
+                    entry[2], entry[4] = 0, 0.0
+        if cleared:
+            with inventory_db.connection() as conn:
+                conn.executemany("DELETE FROM login_throttle WHERE key = ?", cleared)
+
+    # Lift a lockout by hand, e.g. after an administrator has checked on an account
+    def reset(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        with inventory_db.connection() as conn:
+            return conn.execute("DELETE FROM login_throttle WHERE key = ?", (key,)).rowcount
+
+    # Keys currently locked out, from the database: [(key, failures, blocked_until)]
+    def locked(self):
+        with inventory_db.connection() as conn:
+            return conn.execute("SELECT key, failures, blocked_until FROM login_throttle "
+                                "WHERE blocked_until > ? ORDER BY blocked_until DESC", (time.time(),)).fetchall()
+
+    # Delete stored entries whose lockout is over and whose failures have
+    # expired, and those for usernames with no account as soon as their lockout
+    # is over, since guessed names would otherwise pile up; returns how many
+    def purge(self):
+        now = time.time()
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e[4] <= now and now - e[3] > FAILURE_WINDOW]:
+                del self._entries[key]
+        with inventory_db.connection() as conn:
+            return conn.execute("DELETE FROM login_throttle WHERE blocked_until <= ? AND (failed_at < ? OR "
+                                "(key LIKE 'user:%' AND substr(key, 6) NOT IN (SELECT username FROM Users)))",
+                                (now, now - FAILURE_WINDOW)).rowcount
+
+    def stats(self):
+        return {"keys": len(self._entries), "allowed": self.allowed, "rejected": self.rejected}
+
+    # Stored entries for keys not in memory: {key: row}
+    def _load(self, missing):
+        with inventory_db.connection() as conn:
+            rows = conn.execute(f"SELECT key, {FIELDS} FROM login_throttle "
+                                f"WHERE key IN ({','.join('?' * len(missing))})", missing).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    # In-memory entry for a key, taken from `loaded` (or started full) on a
+    # miss; called with the lock held
+    def _entry(self, key, now, loaded):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry
+        row = loaded.get(key)
+        entry = list(row) if row else [float(self.limits[key.partition(":")[0]][0]), now, 0, 0.0, 0.0]
+        self._entries[key] = entry
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+        return entry
+
+
+throttle = LoginThrottle()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show or lift login lockouts")
+    parser.add_argument("--db", help="database file (defaults to INVENTORY_DB or inventory.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="show locked-out usernames and terminals")
+    reset_parser = sub.add_parser("reset", help="lift the lockout on a username or terminal")
+    reset_parser.add_argument("key", help="user:<name> or terminal:<address>")
+    sub.add_parser("purge", help="delete expired entries")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        inventory_db.configure(path=args.db)
+    inventory_db.setup_schema()
+
+    if args.command == "list":
+        now = time.time()
+        for key, failures, blocked_until in throttle.locked():
+            print(f"{key}\t{failures} failures\t{math.ceil(blocked_until - now)}s left")
+    elif args.command == "reset":
+        if not throttle.reset(args.key):
+            print(f"{args.key} is not locked out", file=sys.stderr)
+            return 1
+    else:
+        print(f"{throttle.purge()} entries removed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
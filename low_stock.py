@@ -0,0 +1,75 @@
+import argparse
+import csv
+import sys
+
+import inventory_db
+from product_search import PRODUCT_FIELDS
+
+
+# Must match the WHERE clause of idx_products_low_stock exactly so SQLite reads
+# only that partial index instead of scanning the catalogue
+LOW_STOCK_CONDITION = "quantity <= low_stock_threshold"
+
+
+# Whether a product row (id, name, category, price, quantity, threshold) is low on stock
+def is_low_stock(row):
+    return row[5] is not None and row[4] <= row[5]
+
+
+# Products at or below their low-stock threshold, emptiest first
+def get_low_stock(limit=None, category=None):
+    sql = f"SELECT {PRODUCT_FIELDS} FROM Products INDEXED BY idx_products_low_stock WHERE {LOW_STOCK_CONDITION}"
+    params = []
+    if category is not None:
+        sql += " AND IFNULL(category, '') = ?"
+        params.append(category)
+    sql += " ORDER BY quantity, id"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    with inventory_db.connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+# Number of products at or below their low-stock threshold
+def count_low_stock():
+    with inventory_db.connection() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM Products INDEXED BY idx_products_low_stock "
+                            f"WHERE {LOW_STOCK_CONDITION}").fetchone()[0]
+
+
+# Print the low-stock report as a table or CSV
+def print_report(rows, as_csv=False, out=sys.stdout):
+    if as_csv:
+        writer = csv.writer(out)
+        writer.writerow(("id", "name", "category", "price", "quantity", "low_stock_threshold", "shortfall"))
+        for row in rows:
+            writer.writerow(row + (row[5] - row[4],))
+        return
+
+    print(f"{'ID':>8}  {'Name':30}  {'Category':15}  {'Qty':>6}  {'Min':>6}  {'Short':>6}", file=out)
+    for product_id, name, category, price, quantity, threshold in rows:
+        print(f"{product_id:>8}  {name[:30]:30}  {(category or '')[:15]:15}  {quantity:>6}  {threshold:>6}  "
+              f"{threshold - quantity:>6}", file=out)
+    print(f"{len(rows)} product(s) at or below their low-stock threshold", file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report products at or below their low-stock threshold")
+    parser.add_argument("--db", help="database file (defaults to INVENTORY_DB or inventory.db)")
+    parser.add_argument("--category", help="only report this category")
+    parser.add_argument("--limit", type=int, help="show at most this many products")
+    parser.add_argument("--csv", action="store_true", help="write CSV instead of a table")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        inventory_db.configure(path=args.db)
+    inventory_db.setup_schema()
+
+    rows = get_low_stock(args.limit, args.category)
+    print_report(rows, args.csv)
+    return 1 if rows else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
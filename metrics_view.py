@@ -0,0 +1,110 @@
+import tkinter as tk
+from tkinter import filedialog, ttk
+
+import instrumentation
+
+
+COLUMNS = ("Action", "Calls", "Mean ms", "p50 ms", "p95 ms", "p99 ms", "Max ms", "Queries", "Rows")
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.2f}"
+
+
+# Debug window listing the latency histograms, query counts and row counts
+# collected by instrumentation, refreshed every second while it is open
+class MetricsPanel:
+    def __init__(self, parent, refresh_ms=1000):
+        self.refresh_ms = refresh_ms
+        self.window = tk.Toplevel(parent)
+        self.window.title("Performance")
+        self.window.geometry("820x420")
+
+        controls = tk.Frame(self.window)
+        controls.pack(fill="x", padx=5, pady=5)
+        self.enabled_var = tk.BooleanVar(self.window, value=instrumentation.enabled)
+        tk.Checkbutton(controls, text="Collect metrics", variable=self.enabled_var,
+                       command=self.toggle).pack(side="left")
+        tk.Button(controls, text="Reset", command=self.reset).pack(side="left", padx=5)
+        tk.Button(controls, text="Save JSON...", command=lambda: self.save(".json")).pack(side="left")
+        tk.Button(controls, text="Save Prometheus...", command=lambda: self.save(".prom")).pack(side="left", padx=5)
+        tk.Button(controls, text="Profile next action", command=self.profile_next).pack(side="left")
+
+        frame = tk.Frame(self.window)
+        frame.pack(fill="both", expand=True, padx=5)
+        self.tree = ttk.Treeview(frame, columns=COLUMNS, show="headings")
+        for col in COLUMNS:
+            self.tree.heading(col, text=col)
+            self.tree.column(col, width=220 if col == "Action" else 70, anchor="w" if col == "Action" else "e")
+        scrollbar = ttk.Scrollbar(frame, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side="right", fill="y")
+        self.tree.pack(side="left", fill="both", expand=True)
+
+        self.status_var = tk.StringVar(self.window)
+        tk.Label(self.window, textvariable=self.status_var, anchor="w").pack(fill="x", padx=5, pady=5)
+
+        self._shown_profile = instrumentation.last_profile
+        self._after = None
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        self.refresh()
+
+    def toggle(self):
+        if self.enabled_var.get():
+            instrumentation.enable()
+        else:
+            instrumentation.disable()
+
+    def reset(self):
+        instrumentation.reset()
+        self.refresh()
+
+    # Ask for a file name and write the metrics there
+    def save(self, extension):
+        path = filedialog.asksaveasfilename(parent=self.window, defaultextension=extension,
+                                            initialfile=f"metrics{extension}")
+        if path:
+            self.status_var.set(f"Saved {instrumentation.dump(path)}")
+
+    # Capture a cProfile of the next background task started from the application
+    def profile_next(self):
+        instrumentation.profile_next()
+        self.status_var.set("Profiling the next action...")
+
+    def refresh(self):
+        self._after = None
+        metrics = instrumentation.snapshot()
+        if not metrics:
+            self.tree.delete(*self.tree.get_children())
+        for name, metric in metrics.items():
+            values = (name, metric["count"], _ms(metric["mean"]), _ms(metric["p50"]), _ms(metric["p95"]),
+                      _ms(metric["p99"]), _ms(metric["max"]), metric["queries"], metric["rows"])
+            if self.tree.exists(name):
+                self.tree.item(name, values=values)
+            else:
+                self.tree.insert("", "end", iid=name, values=values)
+
+        if instrumentation.last_profile is not self._shown_profile:
+            self._shown_profile = instrumentation.last_profile
+            self.show_profile(*self._shown_profile)
+        self._after = self.window.after(self.refresh_ms, self.refresh)
+
+    # Show the top of a cProfile capture in its own window
+    def show_profile(self, name, path, summary):
+        self.status_var.set(f"Profile of {name} saved to {path}")
+        window = tk.Toplevel(self.window)
+        window.title(f"Profile: {name}")
+        text = tk.Text(window, wrap="none", font=("Courier", 10), width=120, height=35)
+        text.insert("1.0", summary)
+        text.config(state="disabled")
+        text.pack(fill="both", expand=True)
+
+    def close(self):
+        if self._after is not None:
+            self.window.after_cancel(self._after)
+        self.window.destroy()
+
+
+# Open the debug panel from `root` with F12
+def bind_debug_key(root):
+    root.bind("<F12>", lambda event: MetricsPanel(root))
@@ -0,0 +1,240 @@
+import os
+import threading
+import time
+from array import array
+
+import change_log
+import inventory_db
+from product_search import PRODUCT_FIELDS
+
+
+# Most products kept in memory, overridable with the INVENTORY_CACHE_SIZE environment variable
+MAX_PRODUCTS = int(os.environ.get("INVENTORY_CACHE_SIZE", "200000"))
+
+# Seconds before the whole cache is dropped, bounding how stale it can get when
+# other processes write to the same database
+MAX_AGE = float(os.environ.get("INVENTORY_CACHE_TTL", "10"))
+
+# Ids looked up per query when loading several products
+MAX_IDS_PER_QUERY = 500
+
+# Stored in the threshold column for a NULL low_stock_threshold
+NO_THRESHOLD = -1
+
+
+# Read-through cache of Products rows. Products are held in parallel arrays (one
+# slot per product) with category names stored once and referenced by code, and
+# evicted with the CLOCK approximation of LRU when the cache is full.
+# The data layer writes through it; every other write path in this process is
+# picked up from change_log before each read, and writes from other processes
+# within max_age seconds.
+class ProductCache:
+    def __init__(self, max_size=MAX_PRODUCTS, max_age=MAX_AGE):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.clear()
+
+    def __len__(self):
+        return len(self._slots)
+
+    # Drop every cached product
+    def clear(self):
+        with self._lock:
+            self._slots = {}  # product id -> slot
+            self._ids = array("q")
+            self._names = []
+            self._codes = array("I")
+            self._prices = array("d")
+            self._quantities = array("q")
+            self._thresholds = array("q")
+            self._referenced = bytearray()
+            self._free = []
+            self._hand = 0
+            self._categories = [None]
+            self._category_codes = {None: 0}
+            self.complete = False  # True while every product is cached
+            self.version = change_log.current_version()
+            self._expires_at = time.monotonic() + self.max_age
+
+    # Catch up with products changed outside the cache since the last read: while the
+    # whole table is cached they are reloaded, otherwise they are dropped
+    def _sync(self):
+        changes = change_log.changes_since(self.version)
+        if changes is None or time.monotonic() >= self._expires_at:
+            self.clear()
+            return
+        self.version, changed = changes
+        for product_id in changed:
+            self._remove(product_id)
+        if changed and self.complete:
+            for row in self._load(list(changed)):
+                self._store(row)
+
+    def _load(self, product_ids):
+        rows = []
+        with inventory_db.connection() as conn:
+            for start in range(0, len(product_ids), MAX_IDS_PER_QUERY):
+                chunk = product_ids[start:start + MAX_IDS_PER_QUERY]
+                rows += conn.execute(f"SELECT {PRODUCT_FIELDS} FROM Products WHERE id IN "
+                                     f"({', '.join('?' * len(chunk))})", chunk).fetchall()
+        return rows
+
+    # Free a slot by sweeping the clock hand past recently used products
+    def _evict(self):
+        while True:
+            slot = self._hand
+            self._hand = (self._hand + 1) % len(self._ids)
+            if self._referenced[slot]:
+                self._referenced[slot] = 0
+                continue
+            del self._slots[self._ids[slot]]
+            self.evictions += 1
+            self.complete = False
+            return slot
+
+    def _store(self, row):
+        product_id, name, category, price, quantity, threshold = row
+        code = self._category_codes.get(category)
+        if code is None:
+            code = self._category_codes[category] = len(self._categories)
+            self._categories.append(category)
+        threshold = NO_THRESHOLD if threshold is None else int(threshold)
+
+        slot = self._slots.get(product_id)
+        if slot is None:
+            if self._free:
+                slot = self._free.pop()
+            elif len(self._ids) < self.max_size:
+                slot = len(self._ids)
+                for column, value in ((self._ids, 0), (self._codes, 0), (self._prices, 0.0),
+                                      (self._quantities, 0), (self._thresholds, 0), (self._referenced, 0)):
+                    column.append(value)
+                self._names.append(None)
+            elif self.max_size > 0:
+                slot = self._evict()
+            else:
+                return
+            self._slots[product_id] = slot
+
+        self._ids[slot] = product_id
+        self._names[slot] = name
+        self._codes[slot] = code
+        self._prices[slot] = float(price)
+        self._quantities[slot] = int(quantity)
+        self._thresholds[slot] = threshold
+        self._referenced[slot] = 1
+
+    def _remove(self, product_id):
+        slot = self._slots.pop(product_id, None)
+        if slot is not None:
+            self._names[slot] = None
+            self._referenced[slot] = 0
+            self._free.append(slot)
+
+    def _row(self, slot):
+        threshold = self._thresholds[slot]
+        return (self._ids[slot], self._names[slot], self._categories[self._codes[slot]], self._prices[slot],
+                self._quantities[slot], None if threshold == NO_THRESHOLD else threshold)
+
+    # Store rows read from the database at change_log `version`, skipping any changed since
+    def _store_loaded(self, rows, version):
+        self._sync()
+        changes = change_log.changes_since(version)
+        if changes is None:
+            return
+        changed = changes[1]
+        for row in rows:
+            if row[0] not in changed:
+                self._store(row)
+
+    # One product row, or None if it does not exist
+    def get(self, product_id):
+        with self._lock:
+            self._sync()
+            slot = self._slots.get(product_id)
+            if slot is not None:
+                self._referenced[slot] = 1
+                self.hits += 1
+                return self._row(slot)
+            self.misses += 1
+            version = change_log.current_version()
+
+        with inventory_db.connection() as conn:
+            row = conn.execute(f"SELECT {PRODUCT_FIELDS} FROM Products WHERE id = ?", (product_id,)).fetchone()
+        if row is not None:
+            with self._lock:
+                self._store_loaded([row], version)
+        return row
+
+    # Rows for several product ids, as a dict; missing products are left out
+    def get_many(self, product_ids):
+        found = {}
+        missing = []
+        with self._lock:
+            self._sync()
+            for product_id in product_ids:
+                slot = self._slots.get(product_id)
+                if slot is None:
+                    missing.append(product_id)
+                else:
+                    self._referenced[slot] = 1
+                    found[product_id] = self._row(slot)
+            self.hits += len(found)
+            self.misses += len(missing)
+            version = change_log.current_version()
+
+        rows = self._load(missing) if missing else []
+        with self._lock:
+            self._store_loaded(rows, version)
+        found.update((row[0], row) for row in rows)
+        return found
+
+    # Every product row in id order; served from memory once the whole table fits
+    def all(self):
+        with self._lock:
+            self._sync()
+            if self.complete:
+                self.hits += len(self._slots)
+                return [self._row(slot) for _, slot in sorted(self._slots.items())]
+            version = change_log.current_version()
+
+        with inventory_db.connection() as conn:
+            rows = conn.execute(f"SELECT {PRODUCT_FIELDS} FROM Products ORDER BY id").fetchall()
+        with self._lock:
+            self.misses += len(rows)
+            if len(rows) <= self.max_size:
+                self.clear()
+                self._store_loaded(rows, version)
+                self.complete = len(self._slots) == len(rows)
+        return rows
+
+    # Write-through: record a product row just written to the database, where
+    # `version` is what change_log.record returned for that write
+    def put(self, row, version):
+        with self._lock:
+            if version == self.version + 1:
+                self.version = version  # nothing else changed meanwhile
+            else:
+                self._sync()
+            self._store(row)
+
+    # Write-through: forget a product that was just deleted
+    def discard(self, product_id, version):
+        with self._lock:
+            if version == self.version + 1:
+                self.version = version
+            else:
+                self._sync()
+            self._remove(product_id)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self._slots), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+products = ProductCache()
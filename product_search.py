@@ -0,0 +1,172 @@
+import re
+
+import inventory_db
+
+
+PRODUCT_FIELDS = "id, name, category, price, quantity, low_stock_threshold"
+
+# Columns the product list can be sorted by, and the SQL expression used for each.
+# Nullable columns are coalesced so keyset comparisons never meet a NULL.
+SORT_EXPRESSIONS = {
+    "id": "id",
+    "name": "name",
+    "category": "IFNULL(category, '')",
+    "price": "price",
+    "quantity": "quantity",
+    "low_stock_threshold": "IFNULL(low_stock_threshold, 0)",
+}
+
+# Position of each sortable column in a product row
+SORT_INDEX = {"id": 0, "name": 1, "category": 2, "price": 3, "quantity": 4, "low_stock_threshold": 5}
+
+# Largest number of ids bound into a single IN (...) clause
+MAX_IDS_PER_QUERY = 500
+
+# Products held at one location, with the quantity held there in place of the
+# total. SQLite flattens this into the outer query, so the filters and keyset
+# bounds below apply to it unchanged.
+LOCATION_SOURCE = """
+(SELECT s.product_id AS id, p.name AS name, p.category AS category, p.price AS price, s.quantity AS quantity,
+        p.low_stock_threshold AS low_stock_threshold
+ FROM product_stock s JOIN Products p ON p.id = s.product_id WHERE s.location_id = ?)
+"""
+
+
+# Keyset position of a product row for the given sort column
+def sort_key(row, order_by="id"):
+    value = row[SORT_INDEX[order_by]]
+    if value is None:
+        value = "" if order_by == "category" else 0
+    return (value, row[0])
+
+
+# Turn free text into an FTS5 query matching every word as a prefix
+def fts_query(text):
+    words = re.findall(r"\w+", text)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+# Build the WHERE clause and parameters for a product query
+def _where(text=None, name_prefix=None, name_contains=None, category=None,
+           min_price=None, max_price=None, min_quantity=None, max_quantity=None,
+           low_stock_only=False, ids=None, sku=None):
+    clauses = []
+    params = []
+
+    if text:
+        match = fts_query(text)
+        if match:
+            clauses.append("id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)")
+            params.append(match)
+    if name_prefix:
+        clauses.append("name >= ? AND name < ?")
+        params += [name_prefix, name_prefix + "\U0010ffff"]
+    if name_contains:
+        escaped = name_contains.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        clauses.append("name LIKE ? ESCAPE '\\'")
+        params.append(f"%{escaped}%")
+    if category is not None:
+        clauses.append("IFNULL(category, '') = ?")
+        params.append(category)
+    if min_price is not None:
+        clauses.append("price >= ?")
+        params.append(min_price)
+    if max_price is not None:
+        clauses.append("price <= ?")
+        params.append(max_price)
+    if min_quantity is not None:
+        clauses.append("quantity >= ?")
+        params.append(min_quantity)
+    if max_quantity is not None:
+        clauses.append("quantity <= ?")
+        params.append(max_quantity)
+    if low_stock_only:
+        clauses.append("quantity <= low_stock_threshold")
+    if sku:
+        clauses.append("id IN (SELECT id FROM Products WHERE sku = ?)")
+        params.append(sku)
+    if ids is not None:
+        clauses.append(f"id IN ({', '.join('?' * len(ids))})")
+        params += list(ids)
+    return clauses, params
+
+
+# WHERE clause (empty, or starting with " WHERE ") and parameters for the filters
+def filter_sql(**filters):
+    clauses, params = _where(**filters)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+# Table to select products from, and its parameters: the whole catalogue, or
+# only what one location holds
+def _source(location=None):
+    if location is None:
+        return "Products", []
+    return LOCATION_SOURCE, [location]
+
+
+# Search products with filters, server-side sorting and keyset pagination.
+# `after` / `start_at` are sort_key() values: rows strictly after, or from, that position.
+# With a `location`, only products held there are returned, with the quantity held there.
+def search_products(order_by="id", descending=False, after=None, start_at=None, limit=200, location=None,
+                    **filters):
+    if order_by not in SORT_EXPRESSIONS:
+        raise ValueError(f"Cannot sort by {order_by!r}")
+
+    ids = filters.get("ids")
+    if ids is not None and len(ids) > MAX_IDS_PER_QUERY:
+        ids = list(ids)
+        rows = []
+        for i in range(0, len(ids), MAX_IDS_PER_QUERY):
+            chunk = dict(filters, ids=ids[i:i + MAX_IDS_PER_QUERY])
+            rows += search_products(order_by, descending, after, start_at, None, location, **chunk)
+        rows.sort(key=lambda row: sort_key(row, order_by), reverse=descending)
+        return rows if limit is None else rows[:limit]
+
+    clauses, params = _where(**filters)
+    expr = SORT_EXPRESSIONS[order_by]
+    position = after if after is not None else start_at
+    if position is not None:
+        op = "<" if descending else ">"
+        if after is None:
+            op += "="
+        if order_by == "id":
+            clauses.append(f"id {op} ?")
+            params.append(position[1])
+        else:
+            # The redundant bound on the sort column alone lets SQLite seek into the index
+            clauses.append(f"{expr} {op[0]}= ? AND ({expr}, id) {op} (?, ?)")
+            params += [position[0]] + list(position)
+
+    direction = "DESC" if descending else "ASC"
+    source, source_params = _source(location)
+    params = source_params + params
+    sql = f"SELECT {PRODUCT_FIELDS} FROM {source}"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += f" ORDER BY {expr} {direction}" if order_by == "id" else f" ORDER BY {expr} {direction}, id {direction}"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    with inventory_db.connection() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+# Count the products matching the filters
+def count_products(location=None, **filters):
+    clauses, params = _where(**filters)
+    source, source_params = _source(location)
+    params = source_params + params
+    sql = f"SELECT COUNT(*) FROM {source}"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    with inventory_db.connection() as conn:
+        return conn.execute(sql, params).fetchone()[0]
+
+
+# Distinct product categories, for filter pickers
+def get_categories():
+    with inventory_db.connection() as conn:
+        rows = conn.execute("SELECT DISTINCT IFNULL(category, '') FROM Products ORDER BY 1").fetchall()
+    return [row[0] for row in rows]
@@ -0,0 +1,421 @@
+import bisect
+import tkinter as tk
+from tkinter import ttk
+
+import change_feed
+import change_log
+import instrumentation
+import locations
+import low_stock
+import product_search
+
+
+COLUMNS = ("ID", "Name", "Category", "Price", "Quantity", "Low Stock Threshold")
+
+# Product field shown in each column, used for sorting
+COLUMN_FIELDS = dict(zip(COLUMNS, ("id", "name", "category", "price", "quantity", "low_stock_threshold")))
+
+
+# Treeview that only holds a sliding window of pages, loaded lazily while scrolling.
+# Rows are paged by keyset on the current sort column and id, never by OFFSET.
+# Queries run on the task runner and rows are inserted when they arrive, so the
+# window never waits on the database.
+class ProductTable:
+    def __init__(self, parent, runner, page_size=200, max_pages=5):
+        self.runner = runner
+        self.page_size = page_size
+        self.max_rows = page_size * max_pages
+
+        self.frame = tk.Frame(parent)
+        self.tree = ttk.Treeview(self.frame, columns=COLUMNS, show="headings")
+        for col in COLUMNS:
+            self.tree.heading(col, text=col, command=lambda field=COLUMN_FIELDS[col]: self.sort_by(field))
+        self.scrollbar = ttk.Scrollbar(self.frame, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=self._on_scroll)
+        self.scrollbar.pack(side="right", fill="y")
+        self.tree.pack(side="left", fill="both", expand=True)
+        self.tree.tag_configure("low_stock", background="#ffd6d6")
+
+        # Current query: search filters and sort order
+        self.filters = {}
+        self.order_by = "id"
+        self.descending = False
+
+        # Keyset bounds of the rows currently held in the Treeview
+        self._keys = {}
+        self.first_key = None
+        self.last_key = None
+        self.at_start = True
+        self.at_end = False
+
+        # Last change_log version applied to the view
+        self.version = change_log.current_version()
+
+        # Queries in flight, by kind: "refresh", "load" (scrolling) or "sync".
+        # Only one runs at a time, so rows are applied in the order they were
+        # read; a refresh cancels the others.
+        self._tasks = {}
+        self._resync = False  # a sync was asked for while one could not start
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def grid(self, **kwargs):
+        self.frame.grid(**kwargs)
+
+    # Reload the window, starting from the first row currently shown
+    def refresh(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        version = change_log.current_version()
+        first_key = self.first_key
+
+        def fetch():
+            rows = self._fetch(start_at=first_key)
+            return rows, first_key is None or not self._fetch(before=first_key, limit=1)
+
+        @instrumentation.timed("ui.table.refresh")
+        def done(result):
+            rows, self.at_start = result
+            self.version = version
+            self.tree.delete(*self.tree.get_children())
+            self._keys.clear()
+            self.at_end = len(rows) < self.page_size
+            self._insert(rows, "end")
+            self.first_key = self._key(rows[0]) if rows else None
+            self.last_key = self._key(rows[-1]) if rows else None
+            self._sync_pending()
+
+        self._submit("refresh", fetch, done, message="Loading products...")
+
+    # Jump back to the first page
+    def reset(self):
+        self.first_key = None
+        self.refresh()
+
+    # Show only products matching the given search filters
+    def set_filters(self, **filters):
+        self.filters = {name: value for name, value in filters.items() if value not in (None, "", False)}
+        self.reset()
+
+    # Sort by a column; choosing the same column again reverses the order
+    def sort_by(self, field):
+        if field == self.order_by:
+            self.descending = not self.descending
+        else:
+            self.order_by = field
+            self.descending = False
+        for col in COLUMNS:
+            arrow = ""
+            if COLUMN_FIELDS[col] == self.order_by:
+                arrow = " ▼" if self.descending else " ▲"
+            self.tree.heading(col, text=col + arrow)
+        self.reset()
+
+    # Apply only the products changed since the last refresh or sync. The view
+    # only moves to the new version once the changed rows are shown, so a sync
+    # that fails or is cancelled is picked up by the next one.
+    def sync(self):
+        if self._busy():
+            self._resync = True
+            return
+        self._resync = False
+        result = change_log.changes_since(self.version)
+        if result is None:
+            self.refresh()
+        elif result[1]:
+            self.apply_changes(*result)
+        else:
+            self.version = result[0]
+
+    # Fetch the given products, then update, insert, move or remove their
+    # Treeview items and move the view to `version`
+    def apply_changes(self, version, product_ids):
+        product_ids = list(product_ids)
+
+        def fetch():
+            return self._fetch(ids=product_ids, limit=None)
+
+        @instrumentation.timed("ui.table.sync")
+        def done(rows):
+            rows = {row[0]: row for row in rows}
+            for product_id in product_ids:
+                iid = str(product_id)
+                row = rows.get(product_id)
+                if self.tree.exists(iid):
+                    self.tree.delete(iid)
+                    del self._keys[iid]
+                if row is not None and self._in_window(self._key(row)):
+                    self._insert([row], self._position(self._key(row)))
+            self._update_bounds()
+            self._trim(from_top=False)
+            self.version = version
+            self._sync_pending()
+
+        self._submit("sync", fetch, done, message=None)
+
+    # Run fetch() on the runner and done(result) on the Tk thread when it returns
+    def _submit(self, kind, fetch, done, message):
+        def finished(result):
+            self._tasks.pop(kind, None)
+            done(result)
+
+        def failed(error):
+            self._tasks.pop(kind, None)
+            self.runner.root.report_callback_exception(type(error), error, error.__traceback__)
+
+        self._tasks[kind] = self.runner.submit(fetch, on_done=finished, on_error=failed, message=message)
+
+    # Whether a query is still to be applied; Escape cancels it
+    def _busy(self):
+        return any(not task.cancelled for task in self._tasks.values())
+
+    def _sync_pending(self):
+        if self._resync:
+            self.sync()
+
+    # Fetch products for the current query
+    def _fetch(self, after=None, before=None, start_at=None, limit=0, **extra):
+        if limit == 0:
+            limit = self.page_size
+        filters = dict(self.filters, **extra)
+        if before is not None:
+            rows = product_search.search_products(self.order_by, not self.descending, after=before,
+                                                  limit=limit, **filters)
+            return rows[::-1]
+        return product_search.search_products(self.order_by, self.descending, after=after, start_at=start_at,
+                                              limit=limit, **filters)
+
+    def _key(self, row):
+        return product_search.sort_key(row, self.order_by)
+
+    # Whether a row's sort position falls inside the range currently loaded
+    def _in_window(self, key):
+        if self.descending:
+            return ((self.at_start or key <= self.first_key) and
+                    (self.at_end or key >= self.last_key))
+        return ((self.at_start or key >= self.first_key) and
+                (self.at_end or key <= self.last_key))
+
+    # Index at which a row with the given sort position belongs
+    def _position(self, key):
+        keys = [self._keys[child] for child in self.tree.get_children()]
+        if self.descending:
+            keys.reverse()
+            return len(keys) - bisect.bisect(keys, key)
+        return bisect.bisect(keys, key)
+
+    def _update_bounds(self):
+        children = self.tree.get_children()
+        if children:
+            self.first_key = self._keys[children[0]]
+            self.last_key = self._keys[children[-1]]
+
+    def _insert(self, rows, index):
+        with instrumentation.span("ui.table.insert") as span:
+            count = 0
+            for row in rows:
+                iid = str(row[0])
+                tags = ("low_stock",) if low_stock.is_low_stock(row) else ()
+                self.tree.insert('', index, iid=iid, values=row, tags=tags)
+                self._keys[iid] = self._key(row)
+                count += 1
+            span.add_rows(count)
+
+    # Scrollbar callback: load more rows when the view nears either edge
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        if self._busy():
+            return
+        if float(last) > 0.9 and not self.at_end:
+            self._load_next()
+        elif float(first) < 0.1 and not self.at_start:
+            self._load_previous()
+
+    def _load_next(self):
+        last_key = self.last_key
+
+        def fetch():
+            return self._fetch(after=last_key)
+
+        @instrumentation.timed("ui.table.load_next")
+        def done(rows):
+            self.at_end = len(rows) < self.page_size
+            if rows:
+                anchor = self._first_visible()
+                self._insert(rows, "end")
+                self.last_key = self._key(rows[-1])
+                self._trim(from_top=True)
+                self._restore(anchor)
+            self._sync_pending()
+
+        self._submit("load", fetch, done, message=None)
+
+    def _load_previous(self):
+        first_key = self.first_key
+
+        def fetch():
+            return self._fetch(before=first_key)
+
+        @instrumentation.timed("ui.table.load_previous")
+        def done(rows):
+            self.at_start = len(rows) < self.page_size
+            if rows:
+                anchor = self._first_visible()
+                self._insert(reversed(rows), 0)
+                self.first_key = self._key(rows[0])
+                self._trim(from_top=False)
+                self._restore(anchor)
+            self._sync_pending()
+
+        self._submit("load", fetch, done, message=None)
+
+    # Drop rows from the far edge so the Treeview never holds more than max_rows
+    def _trim(self, from_top):
+        children = self.tree.get_children()
+        excess = len(children) - self.max_rows
+        if excess <= 0:
+            return
+        dropped = children[:excess] if from_top else children[-excess:]
+        self.tree.delete(*dropped)
+        for iid in dropped:
+            del self._keys[iid]
+        if from_top:
+            self.at_start = False
+        else:
+            self.at_end = False
+        self._update_bounds()
+
+    def _first_visible(self):
+        children = self.tree.get_children()
+        if not children:
+            return None
+        index = min(int(self.tree.yview()[0] * len(children)), len(children) - 1)
+        return children[index]
+
+    # Keep the row that was at the top of the view in place after loading
+    def _restore(self, anchor):
+        if not anchor or not self.tree.exists(anchor):
+            return
+        children = self.tree.get_children()
+        self.tree.yview_moveto(children.index(anchor) / len(children))
+
+
+# Search box, category, location and low-stock filters that drive a ProductTable.
+# Switching location only re-queries the page in view, like any other filter.
+# The category and location lists are loaded on the table's runner when the bar
+# is built, and reloaded in the background each time a list is opened.
+class SearchBar:
+    def __init__(self, parent, table):
+        self.table = table
+        self.frame = tk.Frame(parent)
+
+        self.text_var = tk.StringVar(self.frame)
+        self.category_var = tk.StringVar(self.frame)
+        self.location_var = tk.StringVar(self.frame)
+        self.low_stock_var = tk.BooleanVar(self.frame)
+
+        tk.Label(self.frame, text="Search:").pack(side="left")
+        entry = tk.Entry(self.frame, textvariable=self.text_var, width=30)
+        entry.pack(side="left", padx=5)
+        entry.bind("<Return>", lambda event: self.search())
+
+        tk.Label(self.frame, text="Category:").pack(side="left")
+        self.category_box = ttk.Combobox(self.frame, textvariable=self.category_var, width=15,
+                                         postcommand=self._load_categories)
+        self.category_box.pack(side="left", padx=5)
+        self.category_box.bind("<<ComboboxSelected>>", lambda event: self.search())
+
+        tk.Label(self.frame, text="Location:").pack(side="left")
+        self._locations = {}  # location name -> id
+        self.location_box = ttk.Combobox(self.frame, textvariable=self.location_var, width=15,
+                                         state="readonly", postcommand=self._load_locations)
+        self.location_box.pack(side="left", padx=5)
+        self.location_box.bind("<<ComboboxSelected>>", lambda event: self.search())
+
+        tk.Checkbutton(self.frame, text="Low stock only", variable=self.low_stock_var,
+                       command=self.search).pack(side="left", padx=5)
+        tk.Button(self.frame, text="Search", command=self.search).pack(side="left", padx=5)
+        tk.Button(self.frame, text="Clear", command=self.clear).pack(side="left")
+
+        self._load_categories()
+        self._load_locations()
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def grid(self, **kwargs):
+        self.frame.grid(**kwargs)
+
+    # Apply the current filters to the table
+    def search(self):
+        category = self.category_var.get()
+        self.table.set_filters(text=self.text_var.get().strip(),
+                               category=category if category else None,
+                               location=self._locations.get(self.location_var.get()),
+                               low_stock_only=self.low_stock_var.get())
+
+    # Remove all filters
+    def clear(self):
+        self.text_var.set("")
+        self.category_var.set("")
+        self.location_var.set("")
+        self.low_stock_var.set(False)
+        self.search()
+
+    def _load_categories(self):
+        def done(categories):
+            self.category_box["values"] = [""] + [c for c in categories if c]
+
+        self.table.runner.submit(product_search.get_categories, on_done=done, on_error=lambda error: None,
+                                 message=None)
+
+    def _load_locations(self):
+        def done(rows):
+            self._locations = {name: location_id for location_id, name in rows}
+            self.location_box["values"] = [""] + list(self._locations)
+
+        self.table.runner.submit(locations.list_locations, on_done=done, on_error=lambda error: None,
+                                 message=None)
+
+
+# Keeps views current with changes made by other processes: every
+# change_feed.POLL_INTERVAL seconds the shared change feed is polled on the
+# runner, what it returns is handed to change_log, and on_change (usually
+# ProductTable.sync) applies it
+class FeedWatcher:
+    def __init__(self, root, runner, on_change):
+        self.root = root
+        self.runner = runner
+        self.on_change = on_change
+        self.subscriber = change_feed.Subscriber()
+        self._task = None
+        self._after = None
+
+    def start(self):
+        if self._after is None:
+            self._tick()
+
+    # Stop polling and stop holding changes back for this view. The subscriber
+    # is closed here rather than on the runner, which logging out shuts down.
+    def stop(self):
+        if self._after is not None:
+            self.root.after_cancel(self._after)
+            self._after = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.subscriber.close()
+
+    def _tick(self):
+        self._after = self.root.after(int(change_feed.POLL_INTERVAL * 1000), self._tick)
+        # One poll at a time; a poll cancelled with Escape is simply replaced
+        if self._task is None or self._task.cancelled or self._task.future.done():
+            # A failed poll (the database busy, say) is retried on the next tick
+            self._task = self.runner.submit(self.subscriber.poll, on_done=self._apply,
+                                            on_error=lambda error: None, message=None)
+
+    def _apply(self, changed):
+        change_feed.publish(changed)
+        self.on_change()
@@ -0,0 +1,87 @@
+import tkinter as tk
+from tkinter import ttk
+
+import analytics
+
+
+CATEGORY_COLUMNS = ("Category", "Products", "Units", "Stock Value", "Low Stock")
+ABC_COLUMNS = ("Class", "Products", "Value")
+REORDER_COLUMNS = ("ID", "Quantity", "Reorder Point", "Sold / Day", "Turnover / Year")
+
+
+# Treeview with a vertical scrollbar, packed into `parent`
+def _table(parent, columns, height):
+    frame = tk.Frame(parent)
+    tree = ttk.Treeview(frame, columns=columns, show="headings", height=height)
+    for col in columns:
+        tree.heading(col, text=col)
+        tree.column(col, width=110, anchor="w" if col in ("Category", "Class") else "e")
+    scrollbar = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
+    tree.configure(yscrollcommand=scrollbar.set)
+    scrollbar.pack(side="right", fill="y")
+    tree.pack(side="left", fill="both", expand=True)
+    return frame, tree
+
+
+# Stock valuation, category rollups, ABC classes and reorder candidates.
+# The report is built on the task runner so large catalogues never block the window.
+class ReportsView:
+    def __init__(self, parent, runner, days=90, lead_time_days=7):
+        self.runner = runner
+        self.frame = tk.Frame(parent)
+
+        self.days_var = tk.IntVar(self.frame, value=days)
+        self.lead_time_var = tk.IntVar(self.frame, value=lead_time_days)
+        self.summary_var = tk.StringVar(self.frame, value="Press Refresh to build the report")
+
+        controls = tk.Frame(self.frame)
+        controls.pack(fill="x", padx=5, pady=5)
+        tk.Label(controls, text="Sales history (days):").pack(side="left")
+        tk.Spinbox(controls, from_=1, to=3650, width=6, textvariable=self.days_var).pack(side="left", padx=5)
+        tk.Label(controls, text="Lead time (days):").pack(side="left")
+        tk.Spinbox(controls, from_=1, to=365, width=6, textvariable=self.lead_time_var).pack(side="left", padx=5)
+        tk.Button(controls, text="Refresh", command=self.refresh).pack(side="left", padx=5)
+        tk.Label(self.frame, textvariable=self.summary_var, anchor="w").pack(fill="x", padx=5)
+
+        frame, self.category_tree = _table(self.frame, CATEGORY_COLUMNS, 8)
+        frame.pack(fill="both", expand=True, padx=5, pady=5)
+
+        self.abc_label = tk.Label(self.frame, text="ABC classes", anchor="w")
+        self.abc_label.pack(fill="x", padx=5)
+        frame, self.abc_tree = _table(self.frame, ABC_COLUMNS, 3)
+        frame.pack(fill="x", padx=5, pady=5)
+
+        tk.Label(self.frame, text="At or below reorder point", anchor="w").pack(fill="x", padx=5)
+        frame, self.reorder_tree = _table(self.frame, REORDER_COLUMNS, 8)
+        frame.pack(fill="both", expand=True, padx=5, pady=5)
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def grid(self, **kwargs):
+        self.frame.grid(**kwargs)
+
+    # Rebuild the report in the background
+    def refresh(self):
+        self.runner.submit(analytics.build_report, self.days_var.get(), self.lead_time_var.get(),
+                           on_done=self.show, on_error=self.show_error, message="Building report...")
+
+    def show_error(self, error):
+        self.summary_var.set(f"Report failed: {error}")
+
+    # Fill the tables from a report built by analytics.build_report
+    def show(self, report):
+        self.summary_var.set(f"{report['products']} products, {report['units']} units, "
+                             f"stock value {report['value']:,.2f}, turnover {report['turnover']:.2f}/year")
+
+        for tree in (self.category_tree, self.abc_tree, self.reorder_tree):
+            tree.delete(*tree.get_children())
+        for category, products, units, value, low in report["categories"]:
+            self.category_tree.insert("", "end", values=(category or "(none)", products, units, f"{value:,.2f}", low))
+
+        self.abc_label.config(text=f"ABC classes by {report['abc_basis']}")
+        for label, count, value in report["abc"]:
+            self.abc_tree.insert("", "end", values=(label, count, f"{value:,.2f}"))
+
+        for product_id, quantity, point, demand, rate in report["reorder"]:
+            self.reorder_tree.insert("", "end", values=(product_id, quantity, point, f"{demand:.2f}", f"{rate:.2f}"))
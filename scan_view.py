@@ -0,0 +1,93 @@
+import tkinter as tk
+from tkinter import ttk
+
+import barcodes
+import inventory_data
+import locations
+from stock_movements import DEFAULT_LOCATION
+
+
+# Record a scan and return the product row as it is afterwards
+def scan_product(sku, quantity, receive, location_id):
+    return inventory_data.get_product(barcodes.scan(sku, quantity, receive, location_id))
+
+
+# Point-of-sale style entry: a barcode scanner types the code followed by Enter,
+# and each scan sells (or receives) stock straight away. The entry keeps focus
+# and is cleared as soon as a code is read, so scans can follow each other
+# while earlier ones are still being written.
+class ScanWindow:
+    def __init__(self, parent, runner, on_change=None):
+        self.runner = runner
+        self.on_change = on_change
+        self.count = 0
+
+        self.window = tk.Toplevel(parent)
+        self.window.title("Scan Mode")
+
+        self.receive_var = tk.BooleanVar(self.window, value=False)
+        self.quantity_var = tk.IntVar(self.window, value=1)
+        self.location_var = tk.StringVar(self.window)
+        self.sku_var = tk.StringVar(self.window)
+        self.result_var = tk.StringVar(self.window, value="Scan a barcode or type a SKU and press Enter")
+        self.count_var = tk.StringVar(self.window, value="0 scans")
+
+        controls = tk.Frame(self.window)
+        controls.pack(fill="x", padx=10, pady=5)
+        tk.Radiobutton(controls, text="Sell", variable=self.receive_var, value=False).pack(side="left")
+        tk.Radiobutton(controls, text="Receive", variable=self.receive_var, value=True).pack(side="left")
+        tk.Label(controls, text="Quantity:").pack(side="left", padx=(10, 0))
+        tk.Spinbox(controls, from_=1, to=9999, width=5, textvariable=self.quantity_var).pack(side="left", padx=5)
+        tk.Label(controls, text="Location:").pack(side="left")
+        self._locations = {}  # location name -> id
+        self.location_box = ttk.Combobox(controls, textvariable=self.location_var, width=15, state="readonly",
+                                         postcommand=self._load_locations)
+        self.location_box.pack(side="left", padx=5)
+
+        self.entry = tk.Entry(self.window, textvariable=self.sku_var, font=("Arial", 18), width=30)
+        self.entry.pack(padx=10, pady=10)
+        self.entry.bind("<Return>", lambda event: self.scan())
+        self.entry.focus_set()
+
+        self.result_label = tk.Label(self.window, textvariable=self.result_var, font=("Arial", 12), anchor="w")
+        self.result_label.pack(fill="x", padx=10)
+        tk.Label(self.window, textvariable=self.count_var, anchor="w").pack(fill="x", padx=10, pady=(0, 10))
+
+        self._load_locations()
+
+    # Read the code in the entry and record it
+    def scan(self):
+        sku = self.sku_var.get().strip()
+        self.sku_var.set("")
+        if not sku:
+            return
+        try:
+            quantity = self.quantity_var.get()
+        except tk.TclError:
+            self.failed(ValueError("Quantity must be a whole number!"))
+            return
+        location_id = self._locations.get(self.location_var.get(), DEFAULT_LOCATION)
+        self.runner.submit(scan_product, sku, quantity, self.receive_var.get(), location_id,
+                           on_done=self.scanned, on_error=self.failed, message=f"Scanning {sku}...")
+
+    def scanned(self, row):
+        self.count += 1
+        self.count_var.set(f"{self.count} scan{'s' if self.count != 1 else ''}")
+        if row is not None:
+            self.result_label.config(fg="black")
+            self.result_var.set(f"{row[1]}: {row[4]} in stock")
+        if self.on_change:
+            self.on_change()
+
+    def failed(self, error):
+        self.window.bell()
+        self.result_label.config(fg="red")
+        self.result_var.set(str(error))
+
+    # Fill the location list on the runner, so opening it never waits on the database
+    def _load_locations(self):
+        def done(rows):
+            self._locations = {name: location_id for location_id, name in rows}
+            self.location_box["values"] = list(self._locations)
+
+        self.runner.submit(locations.list_locations, on_done=done, on_error=lambda error: None, message=None)
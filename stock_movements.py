@@ -0,0 +1,414 @@
+import argparse
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from array import array
+from datetime import datetime
+
+import change_log
+import inventory_db
+
+
+KINDS = ("receipt", "sale", "adjustment")
+
+# Take a new snapshot once this many movements have been recorded since the last one,
+# which bounds how much of the log any rebuild has to replay
+SNAPSHOT_INTERVAL = 100_000
+
+MOVEMENT_SQL = "INSERT INTO stock_movements (product_id, kind, delta, created_at) VALUES (?, ?, ?, ?)"
+
+# Location that stock is received into and sold from unless another is given
+DEFAULT_LOCATION = 1
+
+LOCATION_MOVEMENT_SQL = """
+INSERT INTO stock_movements (product_id, kind, delta, created_at, location_id) VALUES (?, ?, ?, ?, ?)
+"""
+
+# More (product, quantity) pairs than this are set a few statements at a time
+# through temp tables, rather than product by product
+SET_BATCH = 50
+
+# The targets, then the movements worked out from them; the movements are only
+# inserted once they are all known, since the triggers change what they are read from
+QUANTITY_SCHEMA = (
+    "CREATE TEMP TABLE IF NOT EXISTS quantity_targets (product PRIMARY KEY, quantity INTEGER) WITHOUT ROWID",
+    "CREATE TEMP TABLE IF NOT EXISTS quantity_movements (product_id INTEGER, delta INTEGER, location_id INTEGER)",
+    "DELETE FROM temp.quantity_targets",
+    "DELETE FROM temp.quantity_movements",
+)
+
+_snapshot_lock = threading.Lock()
+_snapshot_marks = {}  # database path -> movement id of the latest snapshot
+_decoded = {}  # (database path, snapshot id) -> {product id: quantity}
+
+
+# Signed change in stock for a movement of `quantity` units
+def to_delta(kind, quantity):
+    quantity = int(quantity)
+    if kind not in KINDS:
+        raise ValueError(f"Unknown movement kind: {kind}")
+    if kind == "adjustment":
+        if quantity == 0:
+            raise ValueError("Adjustment must not be zero!")
+        return quantity
+    if quantity <= 0:
+        raise ValueError("Quantity must be positive!")
+    return quantity if kind == "receipt" else -quantity
+
+
+# Append a movement on an open connection; the location's stock and
+# Products.quantity follow via trigger
+def insert_movement(conn, product_id, kind, delta, created_at=None, location_id=DEFAULT_LOCATION):
+    try:
+        cursor = conn.execute(LOCATION_MOVEMENT_SQL,
+                              (product_id, kind, delta, created_at or time.time(), location_id))
+    except sqlite3.IntegrityError as e:
+        raise movement_error(e)
+    return cursor.lastrowid
+
+
+# The ValueError to raise for a movement the triggers rejected, or the original error
+def movement_error(error):
+    message = str(error)
+    if "insufficient stock" in message:
+        return ValueError("Not enough stock!")
+    if "unknown product" in message:
+        return ValueError("Product not found!")
+    if "unknown location" in message:
+        return ValueError("Location not found!")
+    return error
+
+
+# Record adjustments that move each (product, quantity) to that absolute total.
+# Increases are booked at `location_id`; decreases draw on it first and then on
+# the product's other locations in id order, so a quantity of 0 clears them all.
+def set_quantities(conn, pairs, key="id", created_at=None, location_id=DEFAULT_LOCATION):
+    created_at = created_at or time.time()
+    pairs = list(pairs)
+    if len(pairs) > SET_BATCH:
+        _set_quantities_staged(conn, pairs, key, created_at, location_id)
+        return
+    for product, quantity in pairs:
+        row = conn.execute(f"SELECT id, quantity FROM Products WHERE {key} = ?", (product,)).fetchone()
+        if row is None or row[1] == quantity:
+            continue
+        product_id, delta = row[0], quantity - row[1]
+        if delta < 0:
+            held = conn.execute("""
+            SELECT location_id, quantity FROM product_stock WHERE product_id = ?
+            ORDER BY location_id != ?, location_id
+            """, (product_id, location_id)).fetchall()
+            for held_at, available in held:
+                if delta == 0:
+                    break
+                taken = min(available, -delta)
+                conn.execute(LOCATION_MOVEMENT_SQL, (product_id, "adjustment", -taken, created_at, held_at))
+                delta += taken
+        if delta:
+            # Anything left over is more than the product holds, which the trigger rejects
+            conn.execute(LOCATION_MOVEMENT_SQL, (product_id, "adjustment", delta, created_at, location_id))
+
+
+# set_quantities for many pairs at once; a product listed twice takes the later quantity
+def _set_quantities_staged(conn, pairs, key, created_at, location_id):
+    for statement in QUANTITY_SCHEMA:
+        conn.execute(statement)
+    conn.executemany("INSERT OR REPLACE INTO temp.quantity_targets (product, quantity) VALUES (?, ?)", pairs)
+    targets = f"temp.quantity_targets t JOIN Products p ON p.{key} = t.product"
+    conn.execute(f"""
+    INSERT INTO temp.quantity_movements (product_id, delta, location_id)
+    SELECT p.id, t.quantity - p.quantity, ? FROM {targets} WHERE t.quantity > p.quantity
+    """, (location_id,))
+    # Each location gives up what is still needed after the ones drawn on before it
+    conn.execute(f"""
+    INSERT INTO temp.quantity_movements (product_id, delta, location_id)
+    SELECT product_id, -MIN(quantity, need - drawn), location_id FROM (
+        SELECT s.product_id, s.location_id, s.quantity, p.quantity - t.quantity AS need,
+               IFNULL(SUM(s.quantity) OVER (PARTITION BY s.product_id ORDER BY s.location_id != ?, s.location_id
+                                            ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS drawn
+        FROM {targets} JOIN product_stock s ON s.product_id = p.id
+        WHERE t.quantity < p.quantity
+    ) WHERE drawn < need
+    """, (location_id,))
+    # Anything left over is more than the product holds, which the trigger rejects
+    conn.execute(f"""
+    INSERT INTO temp.quantity_movements (product_id, delta, location_id)
+    SELECT id, target - quantity + held, ? FROM (
+        SELECT p.id, p.quantity, t.quantity AS target,
+               IFNULL((SELECT SUM(quantity) FROM product_stock WHERE product_id = p.id), 0) AS held
+        FROM {targets} WHERE t.quantity < p.quantity
+    ) WHERE quantity - target > held
+    """, (location_id,))
+    conn.execute("""
+    INSERT INTO stock_movements (product_id, kind, delta, created_at, location_id)
+    SELECT product_id, 'adjustment', delta, ?, location_id FROM temp.quantity_movements ORDER BY rowid
+    """, (created_at,))
+    conn.execute("DELETE FROM temp.quantity_targets")
+    conn.execute("DELETE FROM temp.quantity_movements")
+
+
+# Record one receipt, sale or adjustment of `quantity` units; returns the movement id
+def record_movement(product_id, kind, quantity, location_id=DEFAULT_LOCATION):
+    delta = to_delta(kind, quantity)
+    with inventory_db.connection() as conn:
+        movement_id = insert_movement(conn, product_id, kind, delta, location_id=location_id)
+    change_log.record(product_id)
+    maybe_snapshot(movement_id)
+    return movement_id
+
+
+# Append many (product id, kind, delta, created_at) movements in one transaction;
+# returns the id of the last one
+def record_movements(movements):
+    movements = list(movements)
+    with inventory_db.connection() as conn:
+        conn.executemany(MOVEMENT_SQL, movements)
+        last_id = _last_movement_id(conn)
+    for product_id in {movement[0] for movement in movements}:
+        change_log.record(product_id)
+    maybe_snapshot(last_id)
+    return last_id
+
+
+def receive(product_id, quantity, location_id=DEFAULT_LOCATION):
+    return record_movement(product_id, "receipt", quantity, location_id)
+
+
+def sell(product_id, quantity, location_id=DEFAULT_LOCATION):
+    return record_movement(product_id, "sale", quantity, location_id)
+
+
+def adjust(product_id, delta, location_id=DEFAULT_LOCATION):
+    return record_movement(product_id, "adjustment", delta, location_id)
+
+
+# Most recent movements of a product, newest first
+def history(product_id, limit=100):
+    with inventory_db.connection() as conn:
+        return conn.execute("""
+        SELECT id, kind, delta, created_at FROM stock_movements
+        WHERE product_id = ? ORDER BY id DESC LIMIT ?
+        """, (product_id, limit)).fetchall()
+
+
+# Pack sorted (product id, quantity) pairs into a compressed blob
+def encode_snapshot(pairs):
+    ids = array("q", (product_id for product_id, _ in pairs))
+    quantities = array("q", (quantity for _, quantity in pairs))
+    if sys.byteorder == "big":
+        ids.byteswap()
+        quantities.byteswap()
+    return zlib.compress(ids.tobytes() + quantities.tobytes())
+
+
+def decode_snapshot(data, count):
+    values = array("q")
+    values.frombytes(zlib.decompress(data))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return dict(zip(values[:count], values[count:]))
+
+
+# Store a snapshot of stock levels as they stand after `movement_id` on an open connection
+def save_snapshot(conn, movement_id, pairs):
+    pairs = [(product_id, quantity) for product_id, quantity in sorted(pairs) if quantity]
+    conn.execute("""
+    INSERT OR IGNORE INTO stock_snapshots (movement_id, created_at, products, data) VALUES (?, ?, ?, ?)
+    """, (movement_id, time.time(), len(pairs), encode_snapshot(pairs)))
+
+
+# Latest snapshot at or before a movement id as (snapshot id, movement id, products, data)
+def _snapshot_before(conn, movement_id):
+    row = conn.execute("""
+    SELECT id, movement_id, products, data FROM stock_snapshots
+    WHERE movement_id <= ? ORDER BY movement_id DESC LIMIT 1
+    """, (movement_id,)).fetchone()
+    if row is None:
+        raise ValueError("No stock snapshot reaches back that far")
+    return row
+
+
+# Decoded snapshot contents; snapshots never change, so a few are kept in memory
+def _load_snapshot(row):
+    key = (inventory_db.DB_PATH, row[0])
+    stock = _decoded.get(key)
+    if stock is None:
+        stock = decode_snapshot(row[3], row[2])
+        if len(_decoded) >= 4:
+            _decoded.pop(next(iter(_decoded)))
+        _decoded[key] = stock
+    return stock
+
+
+def _last_movement_id(conn, when=None):
+    if when is None:
+        row = conn.execute("SELECT MAX(id) FROM stock_movements").fetchone()
+    else:
+        # One seek down the time index rather than MAX(id), which would scan every earlier movement
+        row = conn.execute("""
+        SELECT id FROM stock_movements WHERE created_at <= ? ORDER BY created_at DESC, id DESC LIMIT 1
+        """, (when,)).fetchone()
+    return row[0] if row and row[0] else 0
+
+
+# Stock of every product after `movement_id` (default: the latest): the nearest
+# snapshot plus the movements recorded since it
+def stock_at(movement_id=None):
+    with inventory_db.connection() as conn:
+        return _stock_at(conn, movement_id)
+
+
+def _stock_at(conn, movement_id=None):
+    if movement_id is None:
+        movement_id = _last_movement_id(conn)
+    snapshot = _snapshot_before(conn, movement_id)
+    stock = dict(_load_snapshot(snapshot))
+    tail = conn.execute("""
+    SELECT product_id, SUM(delta) FROM stock_movements WHERE id > ? AND id <= ? GROUP BY product_id
+    """, (snapshot[1], movement_id))
+    for product_id, delta in tail:
+        quantity = stock.get(product_id, 0) + delta
+        if quantity:
+            stock[product_id] = quantity
+        else:
+            stock.pop(product_id, None)
+    return stock
+
+
+# Stock of every product as of a Unix time (default: now)
+def stock_as_of(when=None):
+    with inventory_db.connection() as conn:
+        movement_id = _last_movement_id(conn, when)
+    return stock_at(movement_id)
+
+
+# Stock of one product as of a Unix time (default: now)
+def product_stock(product_id, when=None):
+    with inventory_db.connection() as conn:
+        movement_id = _last_movement_id(conn, when)
+        snapshot = _snapshot_before(conn, movement_id)
+        delta = conn.execute("""
+        SELECT IFNULL(SUM(delta), 0) FROM stock_movements WHERE product_id = ? AND id > ? AND id <= ?
+        """, (product_id, snapshot[1], movement_id)).fetchone()[0]
+    return _load_snapshot(snapshot).get(product_id, 0) + delta
+
+
+# Snapshot the current stock levels; returns the movement id it covers
+def take_snapshot():
+    with _snapshot_lock:
+        with inventory_db.connection() as conn:
+            movement_id = _last_movement_id(conn)
+        stock = stock_at(movement_id)
+        with inventory_db.connection() as conn:
+            save_snapshot(conn, movement_id, stock.items())
+        _snapshot_marks[inventory_db.DB_PATH] = movement_id
+    return movement_id
+
+
+# Take a snapshot if SNAPSHOT_INTERVAL movements have passed since the last one
+def maybe_snapshot(movement_id=None):
+    mark = _snapshot_marks.get(inventory_db.DB_PATH)
+    if mark is None or movement_id is None:
+        with inventory_db.connection() as conn:
+            if mark is None:
+                mark = conn.execute("SELECT IFNULL(MAX(movement_id), 0) FROM stock_snapshots").fetchone()[0]
+                _snapshot_marks[inventory_db.DB_PATH] = mark
+            if movement_id is None:
+                movement_id = _last_movement_id(conn)
+    if movement_id - mark >= SNAPSHOT_INTERVAL:
+        take_snapshot()
+
+
+# Products whose stored quantity disagrees with the movement log, as (id, expected, actual)
+def verify():
+    expected = stock_at()
+    with inventory_db.connection() as conn:
+        actual = dict(conn.execute("SELECT id, quantity FROM Products"))
+    return [(product_id, expected.get(product_id, 0), actual.get(product_id, 0))
+            for product_id in sorted(set(expected) | set(actual))
+            if expected.get(product_id, 0) != actual.get(product_id, 0) and product_id in actual]
+
+
+# Reset Products.quantity, and the stock held at each location, from the movement
+# log: totals from the latest snapshot plus the movements since it, other
+# locations from their movements, and the rest of each total at DEFAULT_LOCATION,
+# where opening stock is held. Returns the number of products whose total was fixed.
+def rebuild_quantities():
+    with inventory_db.connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for statement in QUANTITY_SCHEMA:
+            conn.execute(statement)
+        conn.executemany("INSERT INTO temp.quantity_targets (product, quantity) VALUES (?, ?)",
+                         _stock_at(conn).items())
+        conn.execute("DELETE FROM product_stock")
+        conn.execute("""
+        INSERT INTO product_stock (location_id, product_id, quantity)
+        SELECT location_id, product_id, SUM(delta) FROM stock_movements
+        WHERE location_id != ? AND product_id IN (SELECT id FROM Products)
+        GROUP BY location_id, product_id HAVING SUM(delta) > 0
+        """, (DEFAULT_LOCATION,))
+        conn.execute("""
+        INSERT INTO product_stock (location_id, product_id, quantity)
+        SELECT ?, p.id, t.quantity - IFNULL(SUM(ps.quantity), 0) FROM temp.quantity_targets t
+        JOIN Products p ON p.id = t.product
+        LEFT JOIN product_stock ps ON ps.product_id = p.id
+        GROUP BY p.id HAVING t.quantity - IFNULL(SUM(ps.quantity), 0) > 0
+        """, (DEFAULT_LOCATION,))
+        fixed = conn.execute("""
+        UPDATE Products SET quantity = s.held
+        FROM (SELECT p.id, IFNULL(SUM(ps.quantity), 0) AS held FROM Products p
+              LEFT JOIN product_stock ps ON ps.product_id = p.id GROUP BY p.id) s
+        WHERE s.id = Products.id AND Products.quantity != s.held
+        RETURNING Products.id
+        """).fetchall()
+    for (product_id,) in fixed:
+        change_log.record(product_id)
+    return len(fixed)
+
+
+def parse_when(text):
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stock movement log: snapshots, point-in-time stock and repair")
+    parser.add_argument("--db", help="database file (defaults to INVENTORY_DB or inventory.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("snapshot", help="snapshot current stock levels")
+    sub.add_parser("verify", help="check Products.quantity against the movement log")
+    sub.add_parser("rebuild", help="reset Products.quantity and per-location stock from the movement log")
+    as_of = sub.add_parser("as-of", help="print stock levels at a date (ISO format or Unix time)")
+    as_of.add_argument("when")
+    as_of.add_argument("--product", type=int, help="only this product id")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        inventory_db.configure(path=args.db)
+    inventory_db.setup_schema()
+
+    start = time.perf_counter()
+    if args.command == "snapshot":
+        print(f"snapshot taken at movement {take_snapshot()}")
+    elif args.command == "verify":
+        mismatches = verify()
+        for product_id, expected, actual in mismatches:
+            print(f"product {product_id}: log says {expected}, table says {actual}")
+        print(f"{len(mismatches)} mismatched products")
+    elif args.command == "rebuild":
+        print(f"rebuilt {rebuild_quantities()} product quantities")
+    elif args.product is not None:
+        print(product_stock(args.product, parse_when(args.when)))
+    else:
+        for product_id, quantity in sorted(stock_as_of(parse_when(args.when)).items()):
+            print(f"{product_id}\t{quantity}")
+    print(f"done in {time.perf_counter() - start:.3f}s", file=sys.stderr)
+    return 1 if args.command == "verify" and mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
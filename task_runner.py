@@ -0,0 +1,117 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
+
+
+# Metric name of a task or callback, e.g. "main_gui.update_product.done"
+def _name(func):
+    name = getattr(func, "__qualname__", None) or getattr(func, "__name__", "call")
+    return name.replace("<locals>.", "")
+
+
+# Run func(*args), timed as "task.<function name>"
+def _timed_call(name, func, *args):
+    with instrumentation.span(name):
+        return func(*args)
+
+
+# A unit of background work; cancelling it drops its result on the floor
+class Task:
+    def __init__(self, future, on_done, on_error):
+        self.future = future
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancelled = False
+
+    # Stop the task if it has not started, and ignore its result if it has
+    def cancel(self):
+        self.cancelled = True
+        self.future.cancel()
+
+
+# Runs database and hashing work on worker threads and hands results back to Tk
+class TaskRunner:
+    def __init__(self, root, workers=2, poll_ms=15, status_var=None):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.status_var = status_var
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._results = queue.SimpleQueue()
+        self._pending = set()
+        self._polling = None
+        self._cursor = root.cget("cursor")
+
+    # Run func(*args) on a worker; on_done/on_error are called on the Tk thread.
+    # With message=None the task runs quietly, without the busy cursor or status.
+    def submit(self, func, *args, on_done=None, on_error=None, message="Working..."):
+        future = self._executor.submit(_timed_call, "task." + _name(func), func, *args)
+        task = Task(future, on_done, on_error)
+        self._pending.add(task)
+        future.add_done_callback(lambda f: self._results.put(task))
+        if message is not None:
+            self._set_busy(message)
+        if self._polling is None:
+            self._polling = self.root.after(self.poll_ms, self._poll)
+        return task
+
+    # Cancel every task still waiting or running
+    def cancel_all(self):
+        for task in list(self._pending):
+            task.cancel()
+
+    # Whether any task is still in flight
+    def busy(self):
+        return bool(self._pending)
+
+    # Stop accepting work and release the worker threads
+    def shutdown(self):
+        self.cancel_all()
+        if self._polling is not None:
+            self.root.after_cancel(self._polling)
+            self._polling = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # Drain finished tasks and dispatch their callbacks on the Tk thread
+    def _poll(self):
+        self._polling = None
+        while True:
+            try:
+                task = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._pending.discard(task)
+            if task.cancelled or task.future.cancelled():
+                continue
+            error = task.future.exception()
+            if error is None:
+                if task.on_done:
+                    with instrumentation.span("ui." + _name(task.on_done)):
+                        task.on_done(task.future.result())
+            elif task.on_error:
+                with instrumentation.span("ui." + _name(task.on_error)):
+                    task.on_error(error)
+            else:
+                self.root.report_callback_exception(type(error), error, error.__traceback__)
+
+        # Redraw now rather than when Tk is next idle, so the cost can be measured
+        if instrumentation.enabled:
+            with instrumentation.span("ui.redraw"):
+                try:
+                    self.root.update_idletasks()
+                except Exception:
+                    pass  # The window is already gone
+
+        if self._pending:
+            self._polling = self.root.after(self.poll_ms, self._poll)
+        else:
+            self._set_busy(None)
+
+    # Show or clear the busy cursor and status message
+    def _set_busy(self, message):
+        try:
+            self.root.config(cursor="watch" if message else self._cursor)
+        except Exception:
+            return  # The window is already gone
+        if self.status_var is not None:
+            self.status_var.set(message or "")
@@ -0,0 +1,358 @@
+import fcntl
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import change_log
+import inventory_db
+import stock_movements
+
+
+# Flush once this many products have pending changes
+MAX_BATCH = int(os.environ.get("INVENTORY_WRITE_BATCH", "500"))
+
+# Flush changes that have been waiting this many seconds
+MAX_DELAY = float(os.environ.get("INVENTORY_WRITE_DELAY", "0.05"))
+
+# Columns an update may change, by update_product argument name
+UPDATE_COLUMNS = {"name": "name", "category": "category", "price": "price", "threshold": "low_stock_threshold"}
+
+
+# Raised by barrier() when queued changes could not be applied
+class WriteBehindError(ValueError):
+    def __init__(self, failures):
+        super().__init__("; ".join(f"product {product_id}: {error}" for product_id, error in failures))
+        self.failures = failures
+
+
+# The net effect of every queued change to one product: column updates, then an
+# absolute quantity, then a stock change on top of it, or a deletion
+class _Pending:
+    __slots__ = ("fields", "quantity", "delta", "deleted")
+
+    def __init__(self, fields=None, quantity=None, delta=0, deleted=False):
+        self.fields = fields or {}
+        self.quantity = quantity
+        self.delta = delta
+        self.deleted = deleted
+
+    # Fold a later change into this one; changes after a deletion are dropped
+    def merge(self, later):
+        if self.deleted:
+            return
+        if later.deleted:
+            self.fields, self.quantity, self.delta, self.deleted = {}, None, 0, True
+            return
+        self.fields.update(later.fields)
+        if later.quantity is not None:
+            self.quantity, self.delta = later.quantity, later.delta
+        else:
+            self.delta += later.delta
+
+
+# Open the journal at `path` and take an exclusive lock on it; None if another
+# process already holds it
+def _lock_journal(path):
+    journal = open(path, "a", buffering=1)
+    try:
+        fcntl.flock(journal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        journal.close()
+        return None
+    return journal
+
+
+# Queues product changes and applies them in batches, one transaction per batch.
+# Changes to the same product are coalesced, so a burst of scans of one item
+# becomes a single stock movement with the net change. New products are
+# applied in journal order relative to the other changes: the queue is a list
+# of groups, each the coalesced changes queued before a run of adds, so
+# deleting or renaming a product and then adding one under its old name works.
+#
+# Every change is written to a journal before it is queued, so it survives the
+# process crashing; the journal is only fsynced before each batch is applied,
+# so a power failure can lose the changes of the last max_delay seconds. The
+# batch records the last journal entry it contains in the same transaction, so
+# after a crash the entries after it are replayed in order, exactly once.
+#
+# Each queue holds an exclusive lock on its journal. Without a journal_path it
+# takes the first of the database's journals no other process holds, so
+# processes sharing a database never replay or truncate each other's journal,
+# and a journal left by a process that crashed is replayed by the next one to
+# take it.
+class WriteBehindQueue:
+    def __init__(self, journal_path=None, max_batch=MAX_BATCH, max_delay=MAX_DELAY):
+        if journal_path:
+            self.journal_path = os.path.abspath(journal_path)
+            self._journal = _lock_journal(self.journal_path)
+            if self._journal is None:
+                raise ValueError(f"Journal {self.journal_path} is in use by another process")
+        else:
+            for slot in itertools.count():
+                self.journal_path = os.path.abspath(f"{inventory_db.DB_PATH}.journal" + (f".{slot}" if slot else ""))
+                self._journal = _lock_journal(self.journal_path)
+                if self._journal is not None:
+                    break
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.failures = []  # (product id, error) pairs not yet reported by barrier()
+
+        self._lock = threading.Condition()
+        self._flush_lock = threading.Lock()  # batches are applied one at a time, in order
+        self._groups = []  # (product id -> _Pending, [(row, future), ...]) in journal order
+        self._queued = 0  # products and adds across the groups
+        self._oldest = None  # monotonic time of the oldest queued change
+        self._closed = False
+
+        inventory_db.setup_schema()
+        self._seq = self.recover()
+
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    # Queue a new product; returns a Future resolved with its id once it is written
+    def add_product(self, name, category, price, quantity, threshold):
+        if int(quantity) < 0:
+            raise ValueError("Quantity must not be negative!")
+        future = Future()
+        self._enqueue({"op": "add", "row": [name, category, price, int(quantity), threshold]}, future=future)
+        return future
+
+    # Queue a change to some of a product's details; arguments left as None are unchanged
+    def update_product(self, product_id, name=None, category=None, price=None, quantity=None, threshold=None):
+        if quantity is not None and int(quantity) < 0:
+            raise ValueError("Quantity must not be negative!")
+        values = {"name": name, "category": category, "price": price, "threshold": threshold}
+        fields = {UPDATE_COLUMNS[argument]: value for argument, value in values.items() if value is not None}
+        self._enqueue({"op": "update", "id": int(product_id), "fields": fields,
+                       "quantity": None if quantity is None else int(quantity)})
+
+    # Queue a stock change of `delta` units
+    def adjust_quantity(self, product_id, delta):
+        if int(delta) == 0:
+            raise ValueError("Adjustment must not be zero!")
+        self._enqueue({"op": "adjust", "id": int(product_id), "delta": int(delta)})
+
+    def delete_product(self, product_id):
+        self._enqueue({"op": "delete", "id": int(product_id)})
+
+    # Apply everything queued so far; returns the (product id, error) pairs that failed.
+    # Changes queued before the call are visible to every reader once it returns.
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                groups, seq = self._take()
+            if not groups:
+                return []
+            self._sync_journal()
+            try:
+                failures, added = self._apply(groups, seq)
+            except BaseException:
+                with self._lock:
+                    self._restore(groups)
+                raise
+            self._publish(groups, added)
+            with self._lock:
+                # Entries up to `seq` are applied; start a fresh journal once nothing is left in it
+                if not self._groups:
+                    self._journal.flush()
+                    self._journal.truncate(0)
+                self.failures += failures
+            return failures
+
+    # Flush, then raise WriteBehindError for any change that has failed since the last barrier
+    def barrier(self):
+        self.flush()
+        with self._lock:
+            failures, self.failures = self.failures, []
+        if failures:
+            raise WriteBehindError(failures)
+
+    # Flush what is queued and stop the background thread
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._lock.notify()
+        self._thread.join()
+        self.flush()
+        self._journal.close()
+
+    # Replay journal entries that were queued but never applied; returns the last sequence number
+    def recover(self):
+        with inventory_db.connection() as conn:
+            row = conn.execute("SELECT applied_seq FROM write_behind_state WHERE journal = ?",
+                               (self.journal_path,)).fetchone()
+        applied = row[0] if row else 0
+        if not os.path.exists(self.journal_path):
+            return applied
+
+        groups, seq = [], applied
+        with open(self.journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # a torn write at the end of the journal; nothing after it was acknowledged
+                if entry["seq"] > applied:
+                    self._queue(groups, entry, None)
+                    seq = entry["seq"]
+        if groups:
+            failures, added = self._apply(groups, seq)
+            self._publish(groups, added)
+            self.failures += failures
+        self._journal.truncate(0)
+        return seq
+
+    def _enqueue(self, entry, future=None):
+        with self._lock:
+            if self._closed:
+                raise ValueError("Write-behind queue is closed")
+            self._seq += 1
+            entry["seq"] = self._seq
+            self._journal.write(json.dumps(entry) + "\n")
+            self._queued += self._queue(self._groups, entry, future)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+                self._lock.notify()
+            elif self._queued >= self.max_batch:
+                self._lock.notify()
+
+    # Add a journal entry to the groups; returns 1 if it took a new slot in the
+    # batch, 0 if it was folded into a change already queued for its product
+    @staticmethod
+    def _queue(groups, entry, future):
+        op = entry["op"]
+        if op == "add":
+            if not groups:
+                groups.append(({}, []))
+            groups[-1][1].append((entry["row"], future))
+            return 1
+        # A change queued after an add starts a new group, so it is applied after the add
+        if not groups or groups[-1][1]:
+            groups.append(({}, []))
+        pending = groups[-1][0]
+        if op == "update":
+            change = _Pending(fields=entry["fields"], quantity=entry["quantity"])
+        elif op == "adjust":
+            change = _Pending(delta=entry["delta"])
+        else:
+            change = _Pending(deleted=True)
+        current = pending.get(entry["id"])
+        if current is None:
+            pending[entry["id"]] = change
+            return 1
+        current.merge(change)
+        return 0
+
+    # Hand the queued changes to the caller (with the lock held)
+    def _take(self):
+        groups = self._groups
+        self._groups, self._queued, self._oldest = [], 0, None
+        return groups, self._seq
+
+    # Put back a batch that could not be written, ahead of anything queued since
+    def _restore(self, groups):
+        self._groups = groups + self._groups
+        self._queued = sum(len(pending) + len(adds) for pending, adds in self._groups)
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+    def _sync_journal(self):
+        with self._lock:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+    # Write one batch in a single transaction, group by group. Returns the changes
+    # that failed, and (future, product id, error) for each added product.
+    def _apply(self, groups, seq):
+        failures = []
+        added = []
+        with inventory_db.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for pending, adds in groups:
+                # Each product's changes within a group apply completely or not at all
+                for product_id, change in pending.items():
+                    conn.execute("SAVEPOINT change")
+                    try:
+                        self._apply_change(conn, product_id, change)
+                    except (ValueError, sqlite3.IntegrityError) as e:
+                        conn.execute("ROLLBACK TO change")
+                        failures.append((product_id, str(e)))
+                    conn.execute("RELEASE change")
+
+                for row, future in adds:
+                    name, category, price, quantity, threshold = row
+                    try:
+                        cursor = conn.execute("""
+                        INSERT INTO Products (name, category, price, quantity, low_stock_threshold)
+                        VALUES (?, ?, ?, 0, ?)
+                        """, (name, category, price, threshold))
+                    except sqlite3.IntegrityError:
+                        added.append((future, None, ValueError("Product name already exists!")))
+                        continue
+                    if quantity:
+                        stock_movements.insert_movement(conn, cursor.lastrowid, "receipt", quantity)
+                    added.append((future, cursor.lastrowid, None))
+
+            conn.execute("""
+            INSERT INTO write_behind_state (journal, applied_seq) VALUES (?, ?)
+            ON CONFLICT (journal) DO UPDATE SET applied_seq = excluded.applied_seq
+            """, (self.journal_path, seq))
+        return failures, added
+
+    @staticmethod
+    def _apply_change(conn, product_id, change):
+        if conn.execute("SELECT 1 FROM Products WHERE id = ?", (product_id,)).fetchone() is None:
+            raise ValueError("Product not found!")
+        if change.deleted:
+            stock_movements.set_quantities(conn, [(product_id, 0)])
+            conn.execute("DELETE FROM Products WHERE id = ?", (product_id,))
+            return
+        if change.fields:
+            assignments = ", ".join(f"{column} = ?" for column in change.fields)
+            conn.execute(f"UPDATE Products SET {assignments} WHERE id = ?", (*change.fields.values(), product_id))
+        if change.quantity is not None:
+            stock_movements.set_quantities(conn, [(product_id, change.quantity)])
+        if change.delta:
+            stock_movements.insert_movement(conn, product_id, "adjustment", change.delta)
+
+    # Tell caches and views about a committed batch and resolve the add futures
+    def _publish(self, groups, added):
+        changed = [product_id for pending, _ in groups for product_id in pending]
+        changed += [product_id for _, product_id, _ in added if product_id is not None]
+        if len(changed) > change_log.MAX_ENTRIES // 2:
+            change_log.record_all()
+        else:
+            for product_id in changed:
+                change_log.record(product_id)
+        stock_movements.maybe_snapshot()
+        for future, product_id, error in added:
+            if future is None:
+                continue  # replayed from the journal
+            if error is None:
+                future.set_result(product_id)
+            else:
+                future.set_exception(error)
+
+    # Background flusher: wakes when a batch fills up or its oldest change is max_delay old
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._closed:
+                    if self._oldest is not None:
+                        wait = self._oldest + self.max_delay - time.monotonic()
+                        if wait <= 0 or self._queued >= self.max_batch:
+                            break
+                        self._lock.wait(wait)
+                    else:
+                        self._lock.wait()
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                time.sleep(self.max_delay)  # e.g. the database is locked; the batch was put back